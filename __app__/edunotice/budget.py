@@ -2,15 +2,18 @@
 Usage-based notifications module
 """
 
-from datetime import datetime, timezone
-
-from edunotice.notifications import indiv_email_usage_notification
-from edunotice.sender import send_email
-from edunotice.utilities import log
+from edunotice.notifications import (
+    indiv_email_usage_notification,
+    new_sub_details_html,
+)
+from edunotice.outbox import enqueue
+from edunotice.utilities import log, IdIndex
 from edunotice.db import session_open, session_close
-from edunotice.structure import SubscriptionClass, DetailsClass
+from edunotice.structure import SubscriptionClass
 
 from edunotice.constants import (
+    CONST_EMAIL_SUB_DETAILS_TAG,
+    CONST_NOTICE_USAGE,
     CONST_SUB_CANCELLED,
     CONST_USAGE_CODE_50,
     CONST_USAGE_CODE_75,
@@ -19,69 +22,147 @@ from edunotice.constants import (
     CONST_EMAIL_SUBJECT_USAGE_2,
 )
 
+# utilisation thresholds and the usage codes they map to
+#   (0 - below the first threshold, no notification)
+_USAGE_THRESHOLDS = (0.5, 0.75, 0.90, 0.95)
+_USAGE_CODES = (
+    0,
+    CONST_USAGE_CODE_50,
+    CONST_USAGE_CODE_75,
+    CONST_USAGE_CODE_90,
+    CONST_USAGE_CODE_95,
+)
+
 
-def _usage_notification(budget, usage):
+def _usage_codes(budgets, usages):
     """
-    Estimates utilisation percentage and checks whether subscription should
-        be notified about it.
+    Estimates utilisation percentages of a number of subscriptions at once
+        and maps them to the usage notification codes: the code of the
+        highest utilisation threshold (_USAGE_THRESHOLDS) reached.
 
     Arguments:
-        budget - subscription's budget
-        usage - subscription's usage
-
+        budgets - a list of subscriptions' budgets
+        usages - a list of subscriptions' usages
     Returns:
-        notify - flag whether subscription should be notified about its usage
-        notification_code - notification code
+        codes - an array of usage codes (0 - no notification)
     """
 
-    notify = False
-    notification_code = None
+    # numpy is imported on use to keep it off the cold start
+    import numpy as np
 
-    if budget in (None, 0):
-        utilisation = 0.0
-    else:
-        utilisation = float(usage) / float(budget)
+    # missing values become NaN
+    budgets = np.array(budgets, dtype=float)
+    usages = np.array(usages, dtype=float)
 
-    if utilisation >= 0.5:
-        notify = True
+    with np.errstate(divide="ignore", invalid="ignore"):
+        utilisation = usages / budgets
 
-        if utilisation >= 0.95:
-            notification_code = CONST_USAGE_CODE_95
-        elif utilisation >= 0.90:
-            notification_code = CONST_USAGE_CODE_90
-        elif utilisation >= 0.75:
-            notification_code = CONST_USAGE_CODE_75
-        else:
-            notification_code = CONST_USAGE_CODE_50
+    # no budget (None or 0) or usage means no utilisation
+    utilisation = np.where(
+        (np.nan_to_num(budgets) != 0) & ~np.isnan(utilisation),
+        utilisation,
+        0.0,
+    )
 
-    return notify, notification_code
+    thresholds = np.array(_USAGE_THRESHOLDS)
 
+    return np.array(_USAGE_CODES)[
+        np.searchsorted(thresholds, utilisation, side="right")
+    ]
 
-def _notify_usage_sub(
-    session, lab_dict, sub_dict, details, usage_code, timestamp_utc=None
-):
+
+def _usage_candidates(session, upd_sub_list):
     """
-    Sends a usage-based notification.
+    Finds the updated subscriptions which should be notified about their
+        usage: the active subscriptions whose usage code is higher than the
+        code of the last usage notification sent. The usage codes are
+        evaluated in a single pass and the last codes are fetched with
+        a single query.
 
     Arguments:
         session - an active sql session
+        upd_sub_list - a list of tuple (before, after) of subscription details
+    Returns:
+        candidates - a list of tuples (details, usage_code)
+    """
+
+    # only for active subscriptions.
+    #   If subscription is cancelled, it should have been alerady notified
+    active_details = [
+        details
+        for _, details in upd_sub_list
+        if details.subscription_status.lower() != CONST_SUB_CANCELLED.lower()
+    ]
+
+    if len(active_details) == 0:
+        return []
+
+    codes = _usage_codes(
+        [details.handout_budget for details in active_details],
+        [details.handout_consumed for details in active_details],
+    )
+
+    notify_idx = codes.nonzero()[0]
+
+    if len(notify_idx) == 0:
+        return []
+
+    # the latest notification codes
+    sub_ids = {active_details[idx].sub_id for idx in notify_idx}
+
+    latest_codes = dict(
+        session.query(SubscriptionClass.id, SubscriptionClass.usage_code)
+        .filter(SubscriptionClass.id.in_(sub_ids))
+        .all()
+    )
+
+    candidates = []
+
+    for idx in notify_idx:
+        details = active_details[idx]
+        usage_code = int(codes[idx])
+        latest_code = latest_codes.get(details.sub_id)
+
+        if latest_code is None or usage_code > latest_code:
+            candidates.append((details, usage_code))
+
+            # a subscription listed twice is only notified once per code
+            latest_codes[details.sub_id] = usage_code
+
+    return candidates
+
+
+def _usage_email(lab_dict, sub_dict, details, usage_code):
+    """
+    Prepares a usage-based notification email.
+
+    Arguments:
         lab_dict - lab name /internal id dictionary
         sub_dict - subscription id /internal id dictionary
         details - subscription details
         usage_code - usage code
-        timestamp_utc - timestamp when emails were sent (for testing purposes)
     Returns:
         success - flag if the action was succesful
         error - error message
+        message - tuple (to_str, subject, html_content, substitutions)
     """
 
+    message = None
+
+    # the details block is substituted when sending
+    details_html = new_sub_details_html(lab_dict, sub_dict, details)
+
     success, error, html_content = indiv_email_usage_notification(
-        lab_dict, sub_dict, details, usage_code
+        lab_dict,
+        sub_dict,
+        details,
+        usage_code,
+        details_html=CONST_EMAIL_SUB_DETAILS_TAG,
     )
 
     if success:
         log(
-            "Sending subscription utilisation email (%d) to: %s -> %s "
+            "Queueing subscription utilisation email (%d) to: %s -> %s "
             % (
                 usage_code,
                 details.subscription_name,
@@ -92,44 +173,55 @@ def _notify_usage_sub(
 
         subject = "%s %d%%" % (CONST_EMAIL_SUBJECT_USAGE_2, usage_code)
 
-        success, error = send_email(
-            details.subscription_users, subject, html_content
+        message = (
+            details.subscription_users,
+            subject,
+            html_content,
+            {CONST_EMAIL_SUB_DETAILS_TAG: details_html},
         )
 
-        if success:
+    return success, error, message
 
-            if timestamp_utc is not None:
-                notice_sent_timestamp = timestamp_utc
-            else:
-                notice_sent_timestamp = datetime.now(timezone.utc)
 
-            session.query(DetailsClass).filter(
-                DetailsClass.id == details.id
-            ).update(
-                {
-                    "usage_code": usage_code,
-                    "usage_notice_sent": notice_sent_timestamp,
-                }
-            )
+def _queue_usage_sub(
+    session, details, usage_code, message, timestamp_utc=None
+):
+    """
+    Queues a usage-based notification in the outbox. The subscription's
+        notification code is updated by the caller straight away (see
+        notify_usage), so the notification is not queued again by the
+        following crawls.
 
-            session.query(SubscriptionClass).filter(
-                SubscriptionClass.id == details.sub_id
-            ).update(
-                {
-                    "usage_code": usage_code,
-                    "usage_notice_sent": notice_sent_timestamp,
-                }
-            )
+    Arguments:
+        session - an active sql session (changes are committed by the
+            caller)
+        details - subscription details
+        usage_code - usage code
+        message - tuple (to_str, subject, html_content, substitutions)
+        timestamp_utc - timestamp when the email was queued
+    Returns:
+        success - flag if the action was succesful
+        error - error message
+    """
 
-            session.commit()
+    success, error = enqueue(
+        session,
+        CONST_NOTICE_USAGE,
+        details,
+        message,
+        notice_code=usage_code,
+        timestamp_utc=timestamp_utc,
+    )
 
     return success, error
 
 
-def notify_usage(engine, lab_dict, sub_dict, upd_sub_list, timestamp_utc=None):
+def notify_usage(
+    engine, lab_dict, sub_dict, upd_sub_list, timestamp_utc=None, session=None
+):
     """
     Checks remaining budgets for new and updated subscriptions
-        and sends out usage-based notifications.
+        and queues usage-based notifications in the outbox.
 
         Notification 1: 50% of monetary credit has been used
         Notification 2: 75% of monetary credit has been used
@@ -141,69 +233,62 @@ def notify_usage(engine, lab_dict, sub_dict, upd_sub_list, timestamp_utc=None):
         lab_dict - lab name /internal id dictionary
         sub_dict - subscription id /internal id dictionary
         upd_sub_list - a list of tuple (before, after) of subscription details
-        timestamp_utc - timestamp when emails were sent (for testing purposes)
+        timestamp_utc - timestamp when emails were queued (for testing
+            purposes)
+        session - an active sql session to queue the notifications in, e.g.
+            the ingest transaction (default: a new session committed once
+            the notifications have been queued)
     Returns:
         success - flag if the action was succesful
         error - error message
-        count - the number of nutifications sent
+        count - the number of nutifications queued
     """
 
     success = True
     error = None
     count = 0
 
-    session = session_open(engine)
+    own_session = session is None
 
-    # Notifying updated subscriptions
-    for _, sub_update in enumerate(upd_sub_list):
-
-        send_notification = False
+    if own_session:
+        session = session_open(engine)
 
-        # prev_details = sub_update[0]
-        new_details = sub_update[1]
+    # inverted indices for the id -> name lookups, built once for all
+    #   the notifications
+    lab_dict = IdIndex.of(lab_dict)
+    sub_dict = IdIndex.of(sub_dict)
 
-        # only for active subscriptions.
-        #   If subscription is cancelled, it should have been alerady notified
-        if (
-            new_details.subscription_status.lower()
-            == CONST_SUB_CANCELLED.lower()
-        ):
-            continue
-
-        # check the budget notification code
-        notify, usage_code = _usage_notification(
-            new_details.handout_budget, new_details.handout_consumed
-        )
+    # subscription usage code updates
+    code_mappings = []
 
-        if not notify:
-            continue
+    # Notifying updated subscriptions
+    for new_details, usage_code in _usage_candidates(session, upd_sub_list):
 
-        # check the latest notification code
-        sub_latest_noti_code = (
-            session.query(SubscriptionClass)
-            .filter(SubscriptionClass.id == new_details.sub_id)
-            .first()
-            .usage_code
+        prep_success, _, message = _usage_email(
+            lab_dict, sub_dict, new_details, usage_code
         )
 
-        if sub_latest_noti_code is None:
-            send_notification = True
-        elif usage_code > sub_latest_noti_code:
-            send_notification = True
-
-        if send_notification:
-            send_success, _ = _notify_usage_sub(
+        if prep_success:
+            queue_success, _ = _queue_usage_sub(
                 session,
-                lab_dict,
-                sub_dict,
                 new_details,
                 usage_code,
+                message,
                 timestamp_utc=timestamp_utc,
             )
 
-            if send_success:
+            if queue_success:
                 count += 1
+                code_mappings.append(
+                    {"id": new_details.sub_id, "usage_code": usage_code}
+                )
+
+    # the codes of the notified subscriptions are updated at once
+    session.bulk_update_mappings(SubscriptionClass, code_mappings)
 
-    session_close(session)
+    # the queued notifications are committed at once (by the caller when
+    #   it passed its session)
+    if own_session:
+        session_close(session)
 
     return success, error, count
@@ -23,17 +23,81 @@ SQL_ENGINE = "postgresql"
 if TEST_MODE:
     print("!!! EduNotice is running TEST MODE !!!")
 
-    SQL_USER = "postgres"
-    SQL_PASSWORD = ""
-    SQL_HOST = "localhost"
-    SQL_PORT = "5432"
-    SQL_DBNAME = "edutestdb"
-else:
-    SQL_USER = os.environ["ENS_SQL_USER"]
-    SQL_PASSWORD = os.environ["ENS_SQL_PASS"]
-    SQL_HOST = os.environ["ENS_SQL_HOST"]
-    SQL_PORT = os.environ["ENS_SQL_PORT"]
-    SQL_DBNAME = os.environ["ENS_SQL_DBNAME"].strip().lower()
+# the connection settings (SQL_USER, SQL_PASSWORD, SQL_HOST, SQL_PORT,
+#   SQL_DBNAME and SQL_CONNECTION_STRING*) are read from the environment on
+#   first use (see __getattr__), so the module can be imported without them
+_SQL_SETTINGS = (
+    "SQL_USER",
+    "SQL_PASSWORD",
+    "SQL_HOST",
+    "SQL_PORT",
+    "SQL_DBNAME",
+    "SQL_CONNECTION_STRING",
+    "SQL_CONNECTION_STRING_DEFAULT",
+    "SQL_CONNECTION_STRING_DB",
+)
+
+
+def _sql_settings():
+    """
+    Reads the database connection settings
+
+    Returns:
+        settings - a dictionary of the SQL_* connection settings
+    """
+
+    if TEST_MODE:
+        settings = dict(
+            SQL_USER="postgres",
+            SQL_PASSWORD="",
+            SQL_HOST="localhost",
+            SQL_PORT="5432",
+            SQL_DBNAME="edutestdb",
+        )
+    else:
+        settings = dict(
+            SQL_USER=os.environ["ENS_SQL_USER"],
+            SQL_PASSWORD=os.environ["ENS_SQL_PASS"],
+            SQL_HOST=os.environ["ENS_SQL_HOST"],
+            SQL_PORT=os.environ["ENS_SQL_PORT"],
+            SQL_DBNAME=os.environ["ENS_SQL_DBNAME"].strip().lower(),
+        )
+
+    settings["SQL_CONNECTION_STRING"] = "%s://%s:%s@%s:%s" % (
+        SQL_ENGINE,
+        settings["SQL_USER"],
+        settings["SQL_PASSWORD"],
+        settings["SQL_HOST"],
+        settings["SQL_PORT"],
+    )
+
+    settings["SQL_CONNECTION_STRING_DEFAULT"] = "%s/%s" % (
+        settings["SQL_CONNECTION_STRING"],
+        SQL_DEFAULT_DBNAME,
+    )
+
+    settings["SQL_CONNECTION_STRING_DB"] = "%s/%s" % (
+        settings["SQL_CONNECTION_STRING"],
+        settings["SQL_DBNAME"],
+    )
+
+    return settings
+
+
+def __getattr__(name):
+    """
+    Reads the connection settings on first use and caches them as module
+        attributes
+    """
+
+    if name in _SQL_SETTINGS:
+        settings = _sql_settings()
+        globals().update(settings)
+
+        return settings[name]
+
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
 
 SQL_DEFAULT_DBNAME = "postgres"
 SQL_TEST_DBNAME1 = "edutestdb1"
@@ -43,21 +107,30 @@ SQL_TEST_DBNAME4 = "edutestdb4"
 SQL_TEST_DBNAME5 = "edutestdb5"
 SQL_TEST_DBNAME6 = "edutestdb6"
 SQL_TEST_DBNAME7 = "edutestdb7"
+SQL_TEST_DBNAME8 = "edutestdb8"
+SQL_TEST_DBNAME9 = "edutestdb9"
 
-SQL_CONNECTION_STRING = "%s://%s:%s@%s:%s" % (
-    SQL_ENGINE,
-    SQL_USER,
-    SQL_PASSWORD,
-    SQL_HOST,
-    SQL_PORT,
-)
+# Connection pool (engines are reused across warm function invocations)
+try:
+    SQL_POOL_SIZE = int(os.environ["ENS_SQL_POOL_SIZE"])
+except Exception:
+    SQL_POOL_SIZE = 5
 
-SQL_CONNECTION_STRING_DEFAULT = "%s/%s" % (
-    SQL_CONNECTION_STRING,
-    SQL_DEFAULT_DBNAME,
-)
+try:
+    SQL_POOL_MAX_OVERFLOW = int(os.environ["ENS_SQL_POOL_MAX_OVERFLOW"])
+except Exception:
+    SQL_POOL_MAX_OVERFLOW = 5
 
-SQL_CONNECTION_STRING_DB = "%s/%s" % (SQL_CONNECTION_STRING, SQL_DBNAME)
+# seconds after which a pooled connection is replaced
+try:
+    SQL_POOL_RECYCLE = int(os.environ["ENS_SQL_POOL_RECYCLE"])
+except Exception:
+    SQL_POOL_RECYCLE = 1800
+
+try:
+    SQL_POOL_PRE_PING = os.environ["ENS_SQL_POOL_PRE_PING"].lower() == "true"
+except Exception:
+    SQL_POOL_PRE_PING = True
 
 # Time zone
 CONST_TIME_ZONE_NAME = time.tzname[time.daylight]
@@ -67,6 +140,7 @@ CONST_TIME_ZONE_NAME = time.tzname[time.daylight]
 SG_FROM_EMAIL = os.environ.get("ENS_FROM_EMAIL")
 SG_SUMMARY_RECIPIENTS = os.environ.get("ENS_SUMMARY_RECIPIENTS")
 SG_API_KEY = os.environ.get("ENS_EMAIL_API")
+SG_API_HOST = os.environ.get("ENS_EMAIL_API_HOST", "https://api.sendgrid.com")
 try:
     SG_TEST_EMAIL = os.environ["ENS_TEST_EMAIL_API"].lower() == "true"
 except Exception:
@@ -93,17 +167,105 @@ try:
 except Exception:
     SG_EMAIL_DISABLE = False
 
+# maximum number of emails sent concurrently
+try:
+    SG_EMAIL_WORKERS = int(os.environ["ENS_EMAIL_WORKERS"])
+except Exception:
+    SG_EMAIL_WORKERS = 8
+
+# rate limit of the requests to SendGrid (token bucket): requests per second
+#   (0 - unlimited) and the burst size
+try:
+    SG_EMAIL_RATE = float(os.environ["ENS_EMAIL_RATE"])
+except Exception:
+    SG_EMAIL_RATE = 10.0
+
+try:
+    SG_EMAIL_BURST = int(os.environ["ENS_EMAIL_BURST"])
+except Exception:
+    SG_EMAIL_BURST = 20
+
+# throttled (429), failed (5xx) and unreachable requests are retried with
+#   an exponential backoff (seconds)
+try:
+    SG_EMAIL_MAX_RETRIES = int(os.environ["ENS_EMAIL_MAX_RETRIES"])
+except Exception:
+    SG_EMAIL_MAX_RETRIES = 4
+
+try:
+    SG_EMAIL_BACKOFF_BASE = float(os.environ["ENS_EMAIL_BACKOFF_BASE"])
+except Exception:
+    SG_EMAIL_BACKOFF_BASE = 0.5
+
+try:
+    SG_EMAIL_BACKOFF_MAX = float(os.environ["ENS_EMAIL_BACKOFF_MAX"])
+except Exception:
+    SG_EMAIL_BACKOFF_MAX = 30.0
+
+# emails sharing a subject and html template are sent in a single request
+#   (one personalization per email)
+try:
+    SG_EMAIL_BATCH = os.environ["ENS_EMAIL_BATCH"].lower() == "true"
+except Exception:
+    SG_EMAIL_BATCH = True
+
+# SendGrid limits: recipients per request (across all personalizations)
+#   and the total size of substitutions per personalization (bytes)
+SG_BATCH_MAX_RECIPIENTS = 1000
+SG_SUBSTITUTIONS_MAX_BYTES = 10000
+
+# substitution tag of the subscription details block in batched emails
+CONST_EMAIL_SUB_DETAILS_TAG = "-sub_details-"
+
+# Notification outbox
+#   kinds of queued notifications
+CONST_NOTICE_NEW = "new"
+CONST_NOTICE_UPD = "update"
+CONST_NOTICE_EXPIRY = "expiry"
+CONST_NOTICE_USAGE = "usage"
+
+# the outbox is drained right after a crawl has been ingested, otherwise
+#   (default) only by the outbox function, so crawls do not wait on SendGrid
+try:
+    SG_OUTBOX_DRAIN_INLINE = (
+        os.environ["ENS_OUTBOX_DRAIN_INLINE"].lower() == "true"
+    )
+except Exception:
+    SG_OUTBOX_DRAIN_INLINE = False
+
+# number of outbox entries sent per round
+try:
+    SG_OUTBOX_DRAIN_LIMIT = int(os.environ["ENS_OUTBOX_DRAIN_LIMIT"])
+except Exception:
+    SG_OUTBOX_DRAIN_LIMIT = 1000
+
+# failed outbox entries are retried by later drains up to this many attempts
+try:
+    SG_OUTBOX_MAX_ATTEMPTS = int(os.environ["ENS_OUTBOX_MAX_ATTEMPTS"])
+except Exception:
+    SG_OUTBOX_MAX_ATTEMPTS = 5
+
 # DB Constants
 COURSES_TABLE_NAME = "course"
 LABS_TABLE_NAME = "lab"
 SUBSCRIPTIONS_TABLE_NAME = "subscription"
 DETAILS_TABLE_NAME = "details"
+SUBSCRIPTION_LATEST_TABLE_NAME = "subscription_latest"
 LOGS_TABLE_NAME = "logs"
+OUTBOX_TABLE_NAME = "outbox"
 
 ID_COL_NAME = "id"
 
+# number of details entries fetched per round trip when streaming
+#   the summary
+try:
+    CONST_SUMMARY_YIELD_PER = int(os.environ["ENS_SUMMARY_YIELD_PER"])
+except Exception:
+    CONST_SUMMARY_YIELD_PER = 500
+
 # Log codes
 CONST_LOG_CODE_SUCCESS = 0  # The operation completed successfully.
+CONST_LOG_CODE_EXPIRY_SWEEP = 1  # The expiry sweep completed successfully.
 
 # Notification codes
 CONST_EXPR_CODE_0 = 0
@@ -4,6 +4,7 @@ Data module.
 """
 
 from edunotice.db import session_open, session_close
+from edunotice.utilities import IdIndex
 
 from edunotice.structure import LabClass, CourseClass, SubscriptionClass
 
@@ -17,7 +18,7 @@ def get_labs_dict(engine):
     Returns:
         success - flag if the action was succesful
         error - error message
-        labs_dict - lab name/internal id dictionary
+        labs_dict - lab name/internal id dictionary (IdIndex)
     """
 
     session = session_open(engine)
@@ -42,7 +43,7 @@ def get_labs_dict(engine):
     for (course_id, course_name) in courses_list:
         courses_dict.update({course_id: course_name})
 
-    labs_dict = {}
+    labs_dict = IdIndex()
 
     for (lab_id, course_id, lab_name) in labs_list:
 
@@ -63,7 +64,7 @@ def get_subs_dict(engine):
     Returns:
         success - flag if the action was succesful
         error - error message
-        subs_dict - subscription id/internal id dictionary
+        subs_dict - subscription id/internal id dictionary (IdIndex)
     """
 
     session = session_open(engine)
@@ -78,7 +79,7 @@ def get_subs_dict(engine):
 
     session_close(session)
 
-    subs_dict = {}
+    subs_dict = IdIndex()
 
     for (sub_guid, sub_id) in subs_list:
         subs_dict.update({sub_guid: sub_id})
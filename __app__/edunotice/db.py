@@ -3,19 +3,83 @@ DB management module.
 
 """
 
-from sqlalchemy import create_engine
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy_utils import database_exists, drop_database
+from sqlalchemy.schema import CreateIndex
 
+from edunotice import constants
 from edunotice.constants import (
-    SQL_CONNECTION_STRING,
-    SQL_CONNECTION_STRING_DB,
-    SQL_CONNECTION_STRING_DEFAULT,
-    SQL_DBNAME,
+    SQL_POOL_SIZE,
+    SQL_POOL_MAX_OVERFLOW,
+    SQL_POOL_RECYCLE,
+    SQL_POOL_PRE_PING,
 )
 
 from edunotice.structure import BASE
 
+# engines and session factories live for the lifetime of the process, so
+#   that warm Azure Function invocations reuse their connection pools
+_ENGINES = {}
+_SESSION_FACTORIES = weakref.WeakKeyDictionary()
+_REGISTRY_LOCK = threading.Lock()
+
+# indexes no longer declared in the schema, dropped by migrate_db
+_RETIRED_INDEXES = (
+    "ix_details_new_notice_sent",
+    "ix_details_update_notice_sent",
+    "ix_details_expiry_notice_sent",
+    "ix_details_usage_notice_sent",
+)
+
+
+def get_engine(connection_string=None):
+    """
+    Returns a shared engine for the connection string. The engine is
+        created on the first call and reused afterwards.
+
+    Arguments:
+        connection_string - sql connection string (default: the service
+            database)
+    Returns:
+        engine - an sql engine instance
+    """
+
+    if connection_string is None:
+        connection_string = constants.SQL_CONNECTION_STRING_DB
+
+    with _REGISTRY_LOCK:
+        engine = _ENGINES.get(connection_string)
+
+        if engine is None:
+            engine = create_engine(
+                connection_string,
+                pool_size=SQL_POOL_SIZE,
+                max_overflow=SQL_POOL_MAX_OVERFLOW,
+                pool_recycle=SQL_POOL_RECYCLE,
+                pool_pre_ping=SQL_POOL_PRE_PING,
+            )
+
+            _ENGINES.update({connection_string: engine})
+
+    return engine
+
+
+def dispose_engines():
+    """
+    Closes the connection pools of all the shared engines and forgets them.
+    """
+
+    with _REGISTRY_LOCK:
+        for engine in _ENGINES.values():
+            engine.dispose()
+
+        _ENGINES.clear()
+
 
 def create_db(db_name=None):
     """
@@ -30,16 +94,21 @@ def create_db(db_name=None):
 
     # if db_name is not specified, use the default values
     if db_name is None:
-        new_db_name = SQL_DBNAME
-        new_db_sql_con_string = SQL_CONNECTION_STRING_DB
+        new_db_name = constants.SQL_DBNAME
+        new_db_sql_con_string = constants.SQL_CONNECTION_STRING_DB
     else:
         new_db_name = db_name
-        new_db_sql_con_string = "%s/%s" % (SQL_CONNECTION_STRING, db_name)
+        new_db_sql_con_string = "%s/%s" % (
+            constants.SQL_CONNECTION_STRING,
+            db_name,
+        )
+
+    from sqlalchemy_utils import database_exists
 
     if not database_exists(new_db_sql_con_string):
 
         try:
-            engine = create_engine(SQL_CONNECTION_STRING_DEFAULT)
+            engine = create_engine(constants.SQL_CONNECTION_STRING_DEFAULT)
 
             conn = engine.connect()
 
@@ -60,6 +129,52 @@ def create_db(db_name=None):
     return True, None
 
 
+def migrate_db(db_name=None):
+    """
+    Brings an existing database up to date with the schema: creates the
+        missing tables and the missing indexes of the existing tables
+        (create_all skips existing tables together with their indexes) and
+        drops the retired indexes. Safe to run on every deploy.
+
+    Arguments:
+        db_name - name of the database
+    Returns:
+        success - success flag
+        error - error message
+    """
+
+    # if db_name is not specified, use the default value
+    if db_name is None:
+        db_sql_con_string = constants.SQL_CONNECTION_STRING_DB
+    else:
+        db_sql_con_string = "%s/%s" % (
+            constants.SQL_CONNECTION_STRING,
+            db_name,
+        )
+
+    engine = create_engine(db_sql_con_string)
+
+    try:
+        with engine.begin() as conn:
+            BASE.metadata.create_all(conn, checkfirst=True)
+
+            for table in BASE.metadata.sorted_tables:
+                for index in table.indexes:
+                    ddl = str(CreateIndex(index).compile(dialect=conn.dialect))
+                    ddl = ddl.replace("INDEX ", "INDEX IF NOT EXISTS ", 1)
+
+                    conn.execute(ddl)
+
+            for index_name in _RETIRED_INDEXES:
+                conn.execute("DROP INDEX IF EXISTS %s" % index_name)
+    except Exception as exception:
+        return False, "Error while migrating the database: %s" % exception
+    finally:
+        engine.dispose()
+
+    return True, None
+
+
 def drop_db(db_name=None):
     """
     Drops the default database.
@@ -73,9 +188,14 @@ def drop_db(db_name=None):
 
     # if db_name is not specified, use the default value
     if db_name is None:
-        del_db_sql_con_string = SQL_CONNECTION_STRING_DB
+        del_db_sql_con_string = constants.SQL_CONNECTION_STRING_DB
     else:
-        del_db_sql_con_string = "%s/%s" % (SQL_CONNECTION_STRING, db_name)
+        del_db_sql_con_string = "%s/%s" % (
+            constants.SQL_CONNECTION_STRING,
+            db_name,
+        )
+
+    from sqlalchemy_utils import drop_database
 
     drop_database(del_db_sql_con_string)
 
@@ -84,14 +204,21 @@ def drop_db(db_name=None):
 
 def session_open(engine):
     """
-    Opens a new connection/session to the db and binds the engine
+    Opens a new connection/session to the db and binds the engine. The
+        session factory is created once per engine.
 
     Arguments:
         engine: the connected engine
     """
 
-    Session = sessionmaker()
-    Session.configure(bind=engine)
+    with _REGISTRY_LOCK:
+        Session = _SESSION_FACTORIES.get(engine)
+
+        if Session is None:
+            Session = sessionmaker()
+            Session.configure(bind=engine)
+
+            _SESSION_FACTORIES[engine] = Session
 
     return Session()
 
@@ -105,3 +232,111 @@ def session_close(session):
 
     session.commit()
     session.close()
+
+
+def session_rollback(session):
+    """
+    Discards the changes made within the session and closes it
+    Arguments:
+        session: session
+    """
+
+    session.rollback()
+    session.close()
+
+
+class QueryProfiler:
+    """
+    Opt-in profiler of the statements an engine issues. Statements are
+        counted and timed per logical operation (see operation), together
+        with the slowest statements of every operation.
+    """
+
+    def __init__(self, engine, num_slowest=5):
+        """
+        Arguments:
+            engine - an sql engine instance to profile
+            num_slowest - number of the slowest statements kept per operation
+        """
+
+        self.engine = engine
+        self.num_slowest = num_slowest
+        self.operations = {}
+
+    @contextmanager
+    def operation(self, name):
+        """
+        Profiles the statements issued within the block (also by other
+            threads using the engine) as a logical operation. The
+            statistics of an operation profiled more than once add up.
+
+        Arguments:
+            name - operation name
+        Returns:
+            stats - operation statistics dictionary: statements, db_time
+                (seconds) and slowest (a list of (duration, statement)
+                tuples, the slowest first)
+        """
+
+        stats = self.operations.setdefault(
+            name, {"statements": 0, "db_time": 0.0, "slowest": []}
+        )
+
+        # start times of the statements in progress are kept per operation,
+        #   so nested operations (e.g. metrics stages) do not mix them up
+        start_key = ("query_start_time", object())
+
+        def _before(conn, cursor, statement, parameters, context, many):
+            conn.info.setdefault(start_key, []).append(time.perf_counter())
+
+        def _after(conn, cursor, statement, parameters, context, many):
+            start_times = conn.info.get(start_key)
+
+            # the statement started before the operation
+            if not start_times:
+                return
+
+            duration = time.perf_counter() - start_times.pop()
+
+            if not start_times:
+                del conn.info[start_key]
+
+            stats["statements"] += 1
+            stats["db_time"] += duration
+
+            slowest = stats["slowest"]
+            slowest.append((duration, statement))
+            slowest.sort(key=lambda x: x[0], reverse=True)
+            del slowest[self.num_slowest:]
+
+        event.listen(self.engine, "before_cursor_execute", _before)
+        event.listen(self.engine, "after_cursor_execute", _after)
+
+        try:
+            yield stats
+        finally:
+            event.remove(self.engine, "before_cursor_execute", _before)
+            event.remove(self.engine, "after_cursor_execute", _after)
+
+    def report(self):
+        """
+        Formats the operation statistics.
+
+        Returns:
+            report - a multi-line report of the operations
+        """
+
+        lines = []
+
+        for name, stats in self.operations.items():
+            lines.append(
+                "%s: %d statement(s), %.3f s"
+                % (name, stats["statements"], stats["db_time"])
+            )
+
+            for duration, statement in stats["slowest"]:
+                lines.append(
+                    "    %.4f s  %s" % (duration, " ".join(statement.split()))
+                )
+
+        return "\n".join(lines)
@@ -3,90 +3,103 @@ Notifications management module.
 
 """
 
-from datetime import datetime, timezone
-import pandas as pd
+from sqlalchemy.exc import SQLAlchemyError
 
 from edunotice.constants import (
     CONST_EMAIL_SUBJECT_NEW,
     CONST_EMAIL_SUBJECT_UPD,
+    CONST_EMAIL_SUB_DETAILS_TAG,
+    CONST_NOTICE_NEW,
+    CONST_NOTICE_UPD,
+    SG_OUTBOX_DRAIN_INLINE,
     # CONST_SUB_CANCELLED,
 )
 
 from edunotice.notifications import (
     indiv_email_new,
     indiv_email_upd,
+    new_sub_details_html,
+    upd_sub_details_html,
     details_changed,
 )
 
-from edunotice.sender import send_email
+from edunotice.outbox import enqueue, drain_outbox
+from edunotice.sender import SEND_COUNTERS
 from edunotice.ingress import update_edu_data
-from edunotice.utilities import log
-from edunotice.db import session_open, session_close
-from edunotice.structure import DetailsClass
+from edunotice.metrics import Metrics, stage
+from edunotice.utilities import log, IdIndex
+from edunotice.db import session_open, session_close, session_rollback
 
 from edunotice.budget import notify_usage
 from edunotice.expiry import notify_expire
 
 
 def _indv_emails(
-    engine, lab_dict, sub_dict, new_sub_list, upd_sub_list, timestamp_utc=None
+    session, lab_dict, sub_dict, new_sub_list, upd_sub_list, timestamp_utc=None
 ):
     """
-    Prepares and sends out individual emails for new and updated subscriptions.
+    Prepares individual emails for new and updated subscriptions and queues
+        them in the outbox.
 
     Arguments:
-        engine - an sql engine instance
+        session - an active sql session (changes are committed by the
+            caller)
         lab_dict - lab name /internal id dictionary
         sub_dict - subscription id /internal id dictionary
         new_sub_list - a list of details of new subscriptions
         upd_sub_list - a list of tuple (before, after) of subscription details
-        timestamp_utc - timestamp when emails were sent (for testing purposes)
+        timestamp_utc - timestamp when emails were queued (for testing
+            purposes)
     Returns:
         success - flag if the action was succesful
         error - error message
-        new_count - the number of new subscription nutifications sent
-        upd_count - the number of subscription update nutifications sent
+        new_count - the number of new subscription nutifications queued
+        upd_count - the number of subscription update nutifications queued
     """
 
     new_count = 0
     upd_count = 0
 
-    session = session_open(engine)
+    # inverted indices for the id -> name lookups, built once for all
+    #   the notifications
+    lab_dict = IdIndex.of(lab_dict)
+    sub_dict = IdIndex.of(sub_dict)
 
     # Notifying about new subscriptions
     for new_sub in new_sub_list:
 
-        # generating html content
-        success, _, html_content = indiv_email_new(lab_dict, sub_dict, new_sub)
+        # generating html content, the details block is substituted when
+        #   sending
+        details_html = new_sub_details_html(lab_dict, sub_dict, new_sub)
+
+        success, _, html_content = indiv_email_new(
+            lab_dict,
+            sub_dict,
+            new_sub,
+            details_html=CONST_EMAIL_SUB_DETAILS_TAG,
+        )
 
         if success:
-            # sending email
             log(
-                "Sending new subscription email to: %s "
+                "Queueing new subscription email to: %s "
                 % (new_sub.subscription_users),
                 level=1,
             )
-            success, _ = send_email(
-                new_sub.subscription_users,
-                CONST_EMAIL_SUBJECT_NEW,
-                html_content,
+            success, _ = enqueue(
+                session,
+                CONST_NOTICE_NEW,
+                new_sub,
+                (
+                    new_sub.subscription_users,
+                    CONST_EMAIL_SUBJECT_NEW,
+                    html_content,
+                    {CONST_EMAIL_SUB_DETAILS_TAG: details_html},
+                ),
+                timestamp_utc=timestamp_utc,
             )
 
-            # let's note that the email was sent successfully
-            if success:
-
-                if timestamp_utc is not None:
-                    notice_sent_timestamp = timestamp_utc
-                else:
-                    notice_sent_timestamp = datetime.now(timezone.utc)
-
-                session.query(DetailsClass).filter(
-                    DetailsClass.id == new_sub.id
-                ).update({"new_notice_sent": notice_sent_timestamp})
-
-                session.commit()
-
-                new_count += 1
+        if success:
+            new_count += 1
 
     # Notifying about updates
     for _, sub_update in enumerate(upd_sub_list):
@@ -120,48 +133,56 @@ def _indv_emails(
 
         if send_upd_email:
 
-            success, _, html_content = indiv_email_upd(
+            details_html = upd_sub_details_html(
                 lab_dict, sub_dict, sub_update
             )
 
+            success, _, html_content = indiv_email_upd(
+                lab_dict,
+                sub_dict,
+                sub_update,
+                details_html=CONST_EMAIL_SUB_DETAILS_TAG,
+            )
+
             if success:
                 log(
-                    "Sending subscription update email to: %s "
+                    "Queueing subscription update email to: %s "
                     % (new_details.subscription_users),
                     level=1,
                 )
-                success, _ = send_email(
-                    new_details.subscription_users,
-                    CONST_EMAIL_SUBJECT_UPD,
-                    html_content,
+                success, _ = enqueue(
+                    session,
+                    CONST_NOTICE_UPD,
+                    new_details,
+                    (
+                        new_details.subscription_users,
+                        CONST_EMAIL_SUBJECT_UPD,
+                        html_content,
+                        {CONST_EMAIL_SUB_DETAILS_TAG: details_html},
+                    ),
+                    timestamp_utc=timestamp_utc,
                 )
 
-                # let's note that the email was sent successfully
-                if success:
-
-                    if timestamp_utc is not None:
-                        notice_sent_timestamp = timestamp_utc
-                    else:
-                        notice_sent_timestamp = datetime.now(timezone.utc)
-
-                    session.query(DetailsClass).filter(
-                        DetailsClass.id == new_details.id
-                    ).update({"update_notice_sent": notice_sent_timestamp})
-
-                    session_close(session)
-
-                    upd_count += 1
-
-    session_close(session)
+            if success:
+                upd_count += 1
 
     return True, None, new_count, upd_count
 
 
 def _notify_subscriptions(
-    engine, lab_dict, sub_dict, new_sub_list, upd_sub_list, timestamp_utc=None
+    engine,
+    lab_dict,
+    sub_dict,
+    new_sub_list,
+    upd_sub_list,
+    timestamp_utc=None,
+    session=None,
+    metrics=None,
 ):
     """
-    Sends individual notifications
+    Queues individual notifications in the outbox. Unless the notifications
+        are queued in the caller's session, they are committed and the
+        outbox is drained (if SG_OUTBOX_DRAIN_INLINE).
 
     Arguments:
         engine - an sql engine instance
@@ -169,26 +190,42 @@ def _notify_subscriptions(
         sub_dict - subscription id /internal id dictionary
         new_sub_list - a list of details of new subscriptions
         upd_sub_list - a list of tuple (before, after) of subscription details
-        timestamp_utc - timestamp when emails were sent (for testing purposes)
+        timestamp_utc - timestamp when emails were queued/sent (for testing
+            purposes)
+        session - an active sql session to queue the notifications in, e.g.
+            the ingest transaction (changes are committed by the caller)
+        metrics - Metrics instance recording the notification stages
+            (individual, expiry, usage, send)
     Returns:
         success - flag if the action was succesful
         error - error message
-        counts - counts of notifications sent
+        counts - counts of notifications queued
             (new, update, time-based, usage-based)
     """
 
     success = True
     error = ""
 
+    own_session = session is None
+
+    if own_session:
+        session = session_open(engine)
+
     # new and update notifications
-    sub_success, sub_error, new_count, upd_count = _indv_emails(
-        engine,
-        lab_dict,
-        sub_dict,
-        new_sub_list,
-        upd_sub_list,
-        timestamp_utc=timestamp_utc,
-    )
+    with stage(metrics, "notify.individual", engine) as record:
+        sub_success, sub_error, new_count, upd_count = _indv_emails(
+            session,
+            lab_dict,
+            sub_dict,
+            new_sub_list,
+            upd_sub_list,
+            timestamp_utc=timestamp_utc,
+        )
+        record["rows"] = len(new_sub_list) + len(upd_sub_list)
+        record["emails"] = new_count + upd_count
+
+        # the queued notifications are written within the stage
+        session.flush()
 
     if not sub_success:
         success = False
@@ -196,9 +233,19 @@ def _notify_subscriptions(
         log("Time notification error: %s" % (sub_error), level=0)
 
     # time-based notifications
-    time_success, time_error, time_count = notify_expire(
-        engine, lab_dict, sub_dict, upd_sub_list, timestamp_utc=timestamp_utc
-    )
+    with stage(metrics, "notify.expiry", engine) as record:
+        time_success, time_error, time_count = notify_expire(
+            engine,
+            lab_dict,
+            sub_dict,
+            upd_sub_list,
+            timestamp_utc=timestamp_utc,
+            session=session,
+        )
+        record["rows"] = len(upd_sub_list)
+        record["emails"] = time_count
+
+        session.flush()
 
     if not time_success:
         success = False
@@ -206,9 +253,19 @@ def _notify_subscriptions(
         log("Time notification error: %s" % (time_error), level=0)
 
     # usage-based notifications
-    usage_success, usage_error, usage_count = notify_usage(
-        engine, lab_dict, sub_dict, upd_sub_list, timestamp_utc=timestamp_utc
-    )
+    with stage(metrics, "notify.usage", engine) as record:
+        usage_success, usage_error, usage_count = notify_usage(
+            engine,
+            lab_dict,
+            sub_dict,
+            upd_sub_list,
+            timestamp_utc=timestamp_utc,
+            session=session,
+        )
+        record["rows"] = len(upd_sub_list)
+        record["emails"] = usage_count
+
+        session.flush()
 
     if not usage_success:
         success = False
@@ -217,21 +274,65 @@ def _notify_subscriptions(
 
     counts = (new_count, upd_count, time_count, usage_count)
 
+    if own_session:
+        session_close(session)
+
+        if SG_OUTBOX_DRAIN_INLINE:
+            _drain(engine, timestamp_utc=timestamp_utc, metrics=metrics)
+
     return success, error, counts
 
 
-def update_subscriptions(engine, args, timestamp_utc=None):
+def _drain(engine, timestamp_utc=None, metrics=None):
+    """
+    Sends out the notifications queued in the outbox
+
+    Arguments:
+        engine - an sql engine instance
+        timestamp_utc - timestamp when emails were sent (for testing purposes)
+        metrics - Metrics instance recording the send stage
+    """
+
+    log("Sending queued notification emails", level=1)
+
+    with stage(metrics, "send", engine) as record:
+        success, error, sent_counts = drain_outbox(
+            engine, timestamp_utc=timestamp_utc
+        )
+        record["emails"] = sum(sent_counts.values())
+
+    if success:
+        log(
+            "Sent %d notification email(s), sender counters: %s"
+            % (sum(sent_counts.values()), SEND_COUNTERS.snapshot()),
+            level=1,
+            indent=2,
+        )
+    else:
+        log("Outbox error: %s" % (error), level=0)
+
+
+def update_subscriptions(engine, args, timestamp_utc=None, metrics=None):
     """
-    Sends individual notifications
+    Ingests the crawl data and queues individual notifications within the
+        same transaction, then sends them out (if SG_OUTBOX_DRAIN_INLINE,
+        otherwise they are sent by the outbox function). If the
+        notifications cannot be queued, the crawl data is committed without
+        them and the failure is reported. The wall time,
+        database round trips, rows and emails of every stage are logged.
 
     Arguments:
         engine - an sql engine instance
         args - command line arguments
+        timestamp_utc - timestamp when emails were queued/sent (for testing
+            purposes)
+        metrics - Metrics instance the stages are recorded in, e.g. to
+            inspect them afterwards (default: a new instance)
 
     Returns:
         success - flag if the action was succesful
         error - error message
-        counts - counts of notifications sent
+        counts - counts of notifications queued
             (new, update, time-based, usage-based)
     """
 
@@ -245,12 +346,17 @@ def update_subscriptions(engine, args, timestamp_utc=None):
 
     counts = (new_count, upd_count, time_count, usage_count)
 
+    if metrics is None:
+        metrics = Metrics()
+
     log("Notification service started", level=1)
 
     if hasattr(args, "input_df"):
         crawl_df = args.input_df
 
     elif hasattr(args, "input_file"):
+        import pandas as pd
+
         # read the crawl data in
         crawl_df = pd.read_csv(args.input_file)
         log("Read %d data entries" % (len(crawl_df)), level=1)
@@ -258,26 +364,76 @@ def update_subscriptions(engine, args, timestamp_utc=None):
         success = False
         error = "Input data is not provided"
 
-    if success:
-        log("Appending DB with the new crawl data", level=1)
-        (
-            success,
-            error,
-            lab_dict,
-            sub_dict,
-            new_sub_list,
-            upd_sub_list,
-        ) = update_edu_data(engine, crawl_df)
+    notify_success = True
+    notify_error = ""
 
     if success:
-        log("Sending individual notification emails", level=1)
-        success, error, counts = _notify_subscriptions(
-            engine,
-            lab_dict,
-            sub_dict,
-            new_sub_list,
-            upd_sub_list,
-            timestamp_utc=timestamp_utc,
-        )
+        # the crawl data and the notifications are committed together
+        session = session_open(engine)
+
+        try:
+            log("Appending DB with the new crawl data", level=1)
+            (
+                success,
+                error,
+                lab_dict,
+                sub_dict,
+                new_sub_list,
+                upd_sub_list,
+            ) = update_edu_data(
+                engine, crawl_df, session=session, metrics=metrics
+            )
+
+            if success:
+                log("Queueing individual notification emails", level=1)
+
+                # the notifications are queued in a savepoint, so a failure
+                #   to prepare them does not discard the crawl data
+                savepoint = session.begin_nested()
+
+                try:
+                    (
+                        notify_success,
+                        notify_error,
+                        counts,
+                    ) = _notify_subscriptions(
+                        engine,
+                        lab_dict,
+                        sub_dict,
+                        new_sub_list,
+                        upd_sub_list,
+                        timestamp_utc=timestamp_utc,
+                        session=session,
+                        metrics=metrics,
+                    )
+
+                    savepoint.commit()
+                except Exception as exception:
+                    savepoint.rollback()
+
+                    notify_success = False
+                    notify_error = exception
+
+                    log(
+                        "Failed to queue notification emails: %s"
+                        % (exception),
+                        level=0,
+                    )
+        except SQLAlchemyError as exception:
+            success = False
+            error = exception
+
+        if success:
+            session_close(session)
+        else:
+            session_rollback(session)
+
+    if success and SG_OUTBOX_DRAIN_INLINE:
+        _drain(engine, timestamp_utc=timestamp_utc, metrics=metrics)
+
+    # the crawl data is kept, but the failure is reported
+    if success and not notify_success:
+        success = False
+        error = notify_error
 
     return success, error, counts
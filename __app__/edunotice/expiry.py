@@ -2,31 +2,58 @@
 Time-based notifications module
 """
 
-from datetime import datetime, timezone
+from datetime import datetime, time, timedelta, timezone
 
-from edunotice.notifications import indiv_email_expiry_notification
-from edunotice.sender import send_email
-from edunotice.utilities import log
-from edunotice.db import session_open, session_close
-from edunotice.structure import SubscriptionClass, DetailsClass
+from sqlalchemy import and_, func, or_
+from sqlalchemy.exc import SQLAlchemyError
+
+from edunotice.notifications import (
+    indiv_email_expiry_notification,
+    new_sub_details_html,
+)
+from edunotice.outbox import enqueue
+from edunotice.ingress import get_latest_log_timestamp
+from edunotice.data import get_labs_dict, get_subs_dict
+from edunotice.utilities import log, IdIndex
+from edunotice.db import session_open, session_close, session_rollback
+from edunotice.structure import (
+    SubscriptionClass,
+    DetailsClass,
+    SubscriptionLatestClass,
+    LogsClass,
+)
 
 from edunotice.constants import (
+    CONST_EMAIL_SUB_DETAILS_TAG,
+    CONST_NOTICE_EXPIRY,
     CONST_EXPR_CODE_0,
     CONST_EXPR_CODE_1,
     CONST_EXPR_CODE_7,
     CONST_EXPR_CODE_30,
     CONST_EMAIL_SUBJECT_EXPIRE,
     CONST_SUB_CANCELLED,
+    CONST_LOG_CODE_EXPIRY_SWEEP,
+)
+
+# remaining days bounds of the expiry codes and the codes they map to
+#   (-1 - more than 30 days remaining, no notification)
+_EXPIRY_DAYS = (0, 1, 7, 30)
+_EXPIRY_CODES = (
+    CONST_EXPR_CODE_0,
+    CONST_EXPR_CODE_1,
+    CONST_EXPR_CODE_7,
+    CONST_EXPR_CODE_30,
+    -1,
 )
 
 
-def _check_remaining_time(expiry_date, current_date=datetime.utcnow().date()):
+def _check_remaining_time(expiry_date, current_date=None):
     """
     Checks the remaining time by comparing expiry and current dates.
 
     Arguments:
         expiry_date - expiry date of a subscription
-        current_date - current date (default: now)
+        current_date - current date (default: today, UTC)
 
     Returns:
         expires - flag whether subscription should be notified about the
@@ -38,6 +65,9 @@ def _check_remaining_time(expiry_date, current_date=datetime.utcnow().date()):
     expires = False
     expiry_code = None
 
+    if current_date is None:
+        current_date = datetime.utcnow().date()
+
     if isinstance(expiry_date, datetime):
         days_diff = (expiry_date.date() - current_date).days
     else:
@@ -59,82 +89,185 @@ def _check_remaining_time(expiry_date, current_date=datetime.utcnow().date()):
     return expires, expiry_code, days_diff
 
 
-def _notify_expiring_sub(
-    session,
-    lab_dict,
-    sub_dict,
-    details,
-    expiry_code,
-    remain_days,
-    timestamp_utc=None,
-):
+def _expiry_codes(expiry_dates, current_date):
+    """
+    Checks the remaining time of a number of subscriptions at once and maps
+        it to the expiration codes (see _check_remaining_time).
+
+    Arguments:
+        expiry_dates - a list of expiry dates of subscriptions
+        current_date - current date
+    Returns:
+        codes - an array of expiration codes (-1 - no notification)
+        days_diff - an array of remaining numbers of days
     """
-    Sends a time-based notification for an expiring subscription.
+
+    # numpy is imported on use to keep it off the cold start
+    import numpy as np
+
+    days_diff = (
+        np.array(expiry_dates, dtype="datetime64[us]").astype("datetime64[D]")
+        - np.datetime64(current_date, "D")
+    ).astype(int)
+
+    codes = np.array(_EXPIRY_CODES)[
+        np.searchsorted(np.array(_EXPIRY_DAYS), days_diff, side="left")
+    ]
+
+    return codes, days_diff
+
+
+def _expiry_candidates(session, upd_sub_list, current_date):
+    """
+    Finds the updated subscriptions which should be notified about their
+        expiry: the active subscriptions which entered an expiration period
+        they have not been notified about. The remaining time is evaluated
+        in a single pass and the last codes are fetched with a single query.
 
     Arguments:
         session - an active sql session
+        upd_sub_list - a list of tuple (before, after) of subscription details
+        current_date - current date
+    Returns:
+        candidates - a list of tuples (details, expiry_code, remain_days)
+    """
+
+    # only for active subscriptions. If subscription is cancelled,
+    #   it should have been notified.
+    # subscription_expiry_date can be null if handout status is pending
+    #   acceptance
+    active_details = [
+        details
+        for _, details in upd_sub_list
+        if details.subscription_status.lower() != CONST_SUB_CANCELLED.lower()
+        and details.subscription_expiry_date is not None
+    ]
+
+    if len(active_details) == 0:
+        return []
+
+    codes, days_diff = _expiry_codes(
+        [details.subscription_expiry_date for details in active_details],
+        current_date,
+    )
+
+    notify_idx = (codes >= 0).nonzero()[0]
+
+    if len(notify_idx) == 0:
+        return []
+
+    # the latest notification codes
+    sub_ids = {active_details[idx].sub_id for idx in notify_idx}
+
+    latest_codes = dict(
+        session.query(SubscriptionClass.id, SubscriptionClass.expiry_code)
+        .filter(SubscriptionClass.id.in_(sub_ids))
+        .all()
+    )
+
+    candidates = []
+
+    for idx in notify_idx:
+        details = active_details[idx]
+        expiry_code = int(codes[idx])
+        latest_code = latest_codes.get(details.sub_id)
+
+        if latest_code is None or (
+            latest_code > expiry_code and expiry_code != CONST_EXPR_CODE_0
+        ):
+            candidates.append((details, expiry_code, int(days_diff[idx])))
+
+            # a subscription listed twice is only notified once per code
+            latest_codes[details.sub_id] = expiry_code
+
+    return candidates
+
+
+def _expiry_email(lab_dict, sub_dict, details, remain_days):
+    """
+    Prepares a time-based notification email for an expiring subscription.
+
+    Arguments:
         lab_dict - lab name /internal id dictionary
         sub_dict - subscription id /internal id dictionary
         details - subscription details
-        expiry_code - expiration code
         remain_days - remaining number of days
-        timestamp_utc - timestamp when emails were sent (for testing purposes)
     Returns:
         success - flag if the action was succesful
         error - error message
+        message - tuple (to_str, subject, html_content, substitutions)
     """
 
+    message = None
+
+    # the details block is substituted when sending
+    details_html = new_sub_details_html(lab_dict, sub_dict, details)
+
     success, error, html_content = indiv_email_expiry_notification(
-        lab_dict, sub_dict, details, remain_days
+        lab_dict,
+        sub_dict,
+        details,
+        remain_days,
+        details_html=CONST_EMAIL_SUB_DETAILS_TAG,
     )
 
     if success:
         log(
-            "Sending subscription expiry notification email to: %s "
+            "Queueing subscription expiry notification email to: %s "
             % (details.subscription_users),
             level=1,
         )
 
         subject = "%s %d day(s)" % (CONST_EMAIL_SUBJECT_EXPIRE, remain_days)
-        success, error = send_email(
-            details.subscription_users, subject, html_content
+
+        message = (
+            details.subscription_users,
+            subject,
+            html_content,
+            {CONST_EMAIL_SUB_DETAILS_TAG: details_html},
         )
 
-        if success:
+    return success, error, message
 
-            if timestamp_utc is not None:
-                notice_sent_timestamp = timestamp_utc
-            else:
-                notice_sent_timestamp = datetime.now(timezone.utc)
-
-            session.query(DetailsClass).filter(
-                DetailsClass.id == details.id
-            ).update(
-                {
-                    "expiry_code": expiry_code,
-                    "expiry_notice_sent": notice_sent_timestamp,
-                }
-            )
 
-            session.query(SubscriptionClass).filter(
-                SubscriptionClass.id == details.sub_id
-            ).update(
-                {
-                    "expiry_code": expiry_code,
-                    "expiry_notice_sent": notice_sent_timestamp,
-                }
-            )
+def _queue_expiring_sub(
+    session, details, expiry_code, message, timestamp_utc=None
+):
+    """
+    Queues a time-based notification in the outbox. The subscription's
+        notification code is updated by the caller straight away (see
+        notify_expire and sweep_expiry), so the notification is not queued
+        again by the following crawls.
+
+    Arguments:
+        session - an active sql session (changes are committed by the
+            caller)
+        details - subscription details
+        expiry_code - expiration code
+        message - tuple (to_str, subject, html_content, substitutions)
+        timestamp_utc - timestamp when the email was queued
+    Returns:
+        success - flag if the action was succesful
+        error - error message
+    """
 
-            session.commit()
+    success, error = enqueue(
+        session,
+        CONST_NOTICE_EXPIRY,
+        details,
+        message,
+        notice_code=expiry_code,
+        timestamp_utc=timestamp_utc,
+    )
 
     return success, error
 
 
 def notify_expire(engine, lab_dict, sub_dict, upd_sub_list,
-                  timestamp_utc=None):
+                  timestamp_utc=None, session=None):
     """
-    Checks remaining time for updated subscriptions and sends out time-based
-        notifications.
+    Checks remaining time for updated subscriptions and queues time-based
+        notifications in the outbox.
 
         Notification 1: 1 day before end
         Notification 2: 7 days before end
@@ -145,11 +278,15 @@ def notify_expire(engine, lab_dict, sub_dict, upd_sub_list,
         lab_dict - lab name /internal id dictionary
         sub_dict - subscription id /internal id dictionary
         upd_sub_list - a list of tuple (before, after) of subscription details
-        timestamp_utc - timestamp when emails were sent (for testing purposes)
+        timestamp_utc - timestamp when emails were queued (for testing
+            purposes)
+        session - an active sql session to queue the notifications in, e.g.
+            the ingest transaction (default: a new session committed once
+            the notifications have been queued)
     Returns:
         success - flag if the action was succesful
         error - error message
-        count - the number of nutifications sent
+        count - the number of nutifications queued
     """
 
     success = True
@@ -161,69 +298,202 @@ def notify_expire(engine, lab_dict, sub_dict, upd_sub_list,
     else:
         current_date = timestamp_utc.date()
 
-    session = session_open(engine)
+    own_session = session is None
 
-    # Notifying updated subscriptions about expiry
-    for _, sub_update in enumerate(upd_sub_list):
+    if own_session:
+        session = session_open(engine)
 
-        expires = False
-        expiry_code = None
-        send_notification = False
+    # inverted indices for the id -> name lookups, built once for all
+    #   the notifications
+    lab_dict = IdIndex.of(lab_dict)
+    sub_dict = IdIndex.of(sub_dict)
 
-        # prev_details = sub_update[0]
-        new_details = sub_update[1]
+    # subscription expiry code updates
+    code_mappings = []
 
-        # only for active subscriptions. If subscription is cancelled,
-        # it should have been notified
-        if (
-            new_details.subscription_status.lower()
-            == CONST_SUB_CANCELLED.lower()
-        ):
-            continue
-
-        # subscription_expiry_date can be null if handout status is pending
-        #   acceptance
-        if new_details.subscription_expiry_date is not None:
-            # check the expiration notification code
-            expires, expiry_code, remain_days = _check_remaining_time(
-                new_details.subscription_expiry_date, current_date=current_date
-            )
+    # Notifying updated subscriptions about expiry
+    for new_details, expiry_code, remain_days in _expiry_candidates(
+        session, upd_sub_list, current_date
+    ):
 
-            if not expires:
-                continue
-        else:
-            continue
-
-        # check the latest notification code
-        sub_latest_noti_code = (
-            session.query(SubscriptionClass)
-            .filter(SubscriptionClass.id == new_details.sub_id)
-            .first()
-            .expiry_code
+        prep_success, _, message = _expiry_email(
+            lab_dict, sub_dict, new_details, remain_days
         )
 
-        if sub_latest_noti_code is None:
-            send_notification = True
-        elif (
-            sub_latest_noti_code > expiry_code
-            and expiry_code != CONST_EXPR_CODE_0
-        ):
-            send_notification = True
-
-        if send_notification:
-            send_success, _ = _notify_expiring_sub(
+        if prep_success:
+            queue_success, _ = _queue_expiring_sub(
                 session,
-                lab_dict,
-                sub_dict,
                 new_details,
                 expiry_code,
-                remain_days,
+                message,
                 timestamp_utc=timestamp_utc,
             )
 
-            if send_success:
+            if queue_success:
                 count += 1
+                code_mappings.append(
+                    {"id": new_details.sub_id, "expiry_code": expiry_code}
+                )
+
+    # the codes of the notified subscriptions are updated at once
+    session.bulk_update_mappings(SubscriptionClass, code_mappings)
+
+    # the queued notifications are committed at once (by the caller when
+    #   it passed its session)
+    if own_session:
+        session_close(session)
+
+    return success, error, count
+
+
+def _sweep_wh(prev_date, current_date):
+    """
+    Returns the where clause selecting the subscriptions which entered
+        an expiration period after the previous sweep date, up to the current
+        date. A subscription enters the period of N days N days before its
+        expiry date.
+
+    Arguments:
+        prev_date - date of the previous sweep (None - no previous sweep)
+        current_date - current date
+    Returns:
+        wh_clause - where clause on the latest subscription expiry dates
+    """
+
+    expiry_date = SubscriptionLatestClass.subscription_expiry_date
+
+    def _day_start(date, days):
+        return datetime.combine(date + timedelta(days=days), time.min)
+
+    # all the subscriptions within the longest period
+    if prev_date is None:
+        return expiry_date < _day_start(current_date, max(_EXPIRY_DAYS) + 1)
+
+    return or_(
+        *[
+            and_(
+                expiry_date >= _day_start(prev_date, days + 1),
+                expiry_date < _day_start(current_date, days + 1),
+            )
+            for days in _EXPIRY_DAYS
+        ]
+    )
+
 
-    session_close(session)
+def sweep_expiry(engine, timestamp_utc=None):
+    """
+    Checks remaining time for the active subscriptions independently of
+        the crawls and queues time-based notifications in the outbox. Only
+        the subscriptions which entered an expiration period since the
+        previous sweep are checked: they are looked up by the expiry dates of
+        their latest details. The sweep is logged together with the queued
+        notifications.
+
+    Arguments:
+        engine - an sql engine instance
+        timestamp_utc - timestamp of the sweep (for testing purposes)
+    Returns:
+        success - flag if the action was succesful
+        error - error message
+        count - the number of nutifications queued
+    """
+
+    count = 0
+
+    if timestamp_utc is None:
+        timestamp_utc = datetime.now(timezone.utc)
+
+    current_date = timestamp_utc.date()
+
+    success, error, prev_timestamp_utc = get_latest_log_timestamp(
+        engine, code=CONST_LOG_CODE_EXPIRY_SWEEP
+    )
+
+    if not success:
+        return success, error, count
+
+    prev_date = None
+
+    if prev_timestamp_utc is not None:
+        prev_date = prev_timestamp_utc.date()
+
+    session = session_open(engine)
+
+    try:
+        sweep_details = (
+            session.query(DetailsClass)
+            .join(
+                SubscriptionLatestClass,
+                SubscriptionLatestClass.details_id == DetailsClass.id,
+            )
+            .filter(
+                _sweep_wh(prev_date, current_date),
+                func.lower(DetailsClass.subscription_status)
+                != CONST_SUB_CANCELLED.lower(),
+            )
+            .order_by(SubscriptionLatestClass.subscription_expiry_date)
+            .all()
+        )
+
+        log(
+            "Expiry sweep: %d subscription(s) entered an expiration period"
+            % (len(sweep_details)),
+            level=1,
+        )
+
+        candidates = _expiry_candidates(
+            session, [(details, details) for details in sweep_details],
+            current_date,
+        )
+
+        if len(candidates) > 0:
+            success, error, lab_dict = get_labs_dict(engine)
+
+        if success and len(candidates) > 0:
+            success, error, sub_dict = get_subs_dict(engine)
+
+        if success:
+            # subscription expiry code updates
+            code_mappings = []
+
+            for details, expiry_code, remain_days in candidates:
+
+                prep_success, _, message = _expiry_email(
+                    lab_dict, sub_dict, details, remain_days
+                )
+
+                if prep_success:
+                    queue_success, _ = _queue_expiring_sub(
+                        session,
+                        details,
+                        expiry_code,
+                        message,
+                        timestamp_utc=timestamp_utc,
+                    )
+
+                    if queue_success:
+                        count += 1
+                        code_mappings.append(
+                            {"id": details.sub_id, "expiry_code": expiry_code}
+                        )
+
+            # the codes of the notified subscriptions are updated at once
+            session.bulk_update_mappings(SubscriptionClass, code_mappings)
+
+            session.add(
+                LogsClass(
+                    code=CONST_LOG_CODE_EXPIRY_SWEEP,
+                    timestamp_utc=timestamp_utc,
+                )
+            )
+    except SQLAlchemyError as exception:
+        success = False
+        error = exception
+
+    # the sweep is logged together with the queued notifications
+    if success:
+        session_close(session)
+    else:
+        session_rollback(session)
 
     return success, error, count
@@ -3,14 +3,19 @@ Data ingress module.
 
 """
 
+import ast
+import hashlib
 from datetime import datetime, timezone
-import pandas as pd
+from types import SimpleNamespace
 
 from sqlalchemy import desc, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import SQLAlchemyError
 
 from edunotice.db import (
     session_open,
     session_close,
+    session_rollback,
 )
 
 from edunotice.structure import (
@@ -18,6 +23,7 @@ from edunotice.structure import (
     LabClass,
     SubscriptionClass,
     DetailsClass,
+    SubscriptionLatestClass,
     LogsClass,
 )
 
@@ -37,14 +43,159 @@ from edunotice.constants import (
     CONST_LOG_CODE_SUCCESS,
 )
 
-from edunotice.notifications import details_changed
+from edunotice.notifications import details_changed, DETAILS_CHANGED_COLUMNS
+from edunotice.metrics import stage
+from edunotice.utilities import IdIndex
 
+# columns of a details entry covered by its content hash: all the crawled
+#   values apart from the crawl time
+DETAILS_HASH_COLUMNS = DETAILS_CHANGED_COLUMNS + (
+    "handout_consumed",
+    "handout_name",
+    "lab_id",
+)
+
+
+def _convert_money(money_col):
+    """
+    Converts a column of amounts in dollars (e.g. "$1,000.00") to floats.
+
+    Arguments:
+        money_col - pandas series with the amounts
+    Returns:
+        converted_col - pandas series of floats
+    """
+
+    import pandas as pd
+
+    if pd.api.types.is_numeric_dtype(money_col):
+        return money_col.astype(float)
+
+    return (
+        money_col.astype(str)
+        .str.replace("$", "", regex=False)
+        .str.replace(",", "", regex=False)
+        .astype(float)
+    )
+
+
+def _convert_users(users):
+    """
+    Converts a list of subscription users (or its string representation,
+        e.g. "['a@b.com', 'c@d.com']") to a comma separated string.
+
+    Arguments:
+        users - a list of users or its string representation
+    Returns:
+        users_str - comma separated string of users
+    """
+
+    if isinstance(users, list):
+        return ", ".join(users)
+
+    if not isinstance(users, str):
+        return ""
+
+    # already converted
+    if not users.startswith("["):
+        return users
+
+    return ", ".join(ast.literal_eval(users))
+
+
+def _convert_users_col(users_col):
+    """
+    Converts a column of subscription users to comma separated strings.
+        Every distinct value is parsed only once.
+
+    Arguments:
+        users_col - pandas series with the subscription users
+    Returns:
+        converted_col - pandas series of comma separated strings
+    """
+
+    try:
+        users_dict = {}
+        for users in users_col.unique():
+            users_dict.update({users: _convert_users(users)})
+    except TypeError:
+        # lists are not hashable, convert values one by one
+        return users_col.map(_convert_users)
+
+    return users_col.map(users_dict).fillna("")
 
-def CONVERT_LAMBDA(x):
+
+def _to_pydatetime(datetime_col):
     """
-    Function to convert amount in dollars to a float
+    Converts a column of pandas datetimes to python datetime objects,
+        missing values are converted to None.
+
+    Arguments:
+        datetime_col - pandas series of datetimes
+    Returns:
+        converted_col - pandas series of python datetime objects
+    """
+
+    import pandas as pd
+
+    converted_col = pd.Series(
+        list(datetime_col.dt.to_pydatetime()),
+        index=datetime_col.index,
+        dtype=object,
+    )
+
+    return converted_col.where(datetime_col.notna(), None)
+
+
+def _normalise_edu_data(eduhub_df):
     """
-    return float(x.replace("$", "").replace(",", ""))
+    Converts the eduhub crawl data column-wise to the types used by the
+        database: amounts to floats, expiry dates and crawl times to
+        datetimes (None if missing) and subscription users to comma
+        separated strings. The function can be applied to already
+        normalised data.
+
+    Arguments:
+        eduhub_df - pandas dataframe with the eduhub crawl data
+    Returns:
+        success - flag if the action was succesful
+        error - error message
+        norm_df - a normalised copy of eduhub_df
+    """
+
+    import pandas as pd
+
+    norm_df = eduhub_df.copy()
+
+    try:
+        norm_df[CONST_PD_COL_HANDOUT_BUDGET] = _convert_money(
+            eduhub_df[CONST_PD_COL_HANDOUT_BUDGET]
+        )
+        norm_df[CONST_PD_COL_HANDOUT_CONSUMED] = _convert_money(
+            eduhub_df[CONST_PD_COL_HANDOUT_CONSUMED]
+        )
+
+        norm_df[CONST_PD_COL_SUB_USERS] = _convert_users_col(
+            eduhub_df[CONST_PD_COL_SUB_USERS]
+        )
+
+        # While subscription is "Pending acceptance",
+        #   it doesn't show its expiry date
+        expiry_col = pd.to_datetime(
+            eduhub_df[CONST_PD_COL_SUB_EXPIRY_DATE],
+            format="%Y-%m-%d",
+            errors="coerce",
+        )
+        crawl_time_col = pd.to_datetime(
+            eduhub_df[CONST_PD_COL_CRAWL_TIME_UTC]
+        )
+    except (KeyError, ValueError, SyntaxError) as exception:
+        return False, exception, None
+
+    norm_df[CONST_PD_COL_SUB_EXPIRY_DATE] = _to_pydatetime(expiry_col)
+    norm_df[CONST_PD_COL_CRAWL_TIME_UTC] = _to_pydatetime(crawl_time_col)
+
+    return True, None, norm_df
 
 
 def _check_df(eduhub_df):
@@ -58,6 +209,10 @@ def _check_df(eduhub_df):
         error - error message
     """
 
+    # pandas is imported on first use, so the modules that do not ingest
+    #   crawl data (e.g. the summary) do not load it
+    import pandas as pd
+
     # Checks if df exists
     if not isinstance(eduhub_df, pd.DataFrame):
         return False, "Not a pandas dataframe"
@@ -69,7 +224,7 @@ def _check_df(eduhub_df):
     return True, None
 
 
-def update_edu_data(engine, eduhub_df):
+def update_edu_data(engine, eduhub_df, session=None, metrics=None):
     """
     Updates the database with the eduhub crawl data. If a course, lab or
         handout/subscription is not found, new one is created. Updated
@@ -78,6 +233,11 @@ def update_edu_data(engine, eduhub_df):
     Arguments:
         engine - an sql engine instance
         eduhub_df - pandas dataframe with the eduhub crawl data
+        session - an active sql session to write the data in (changes are
+            committed or rolled back by the caller, default: a new session
+            committed once all the tables have been updated)
+        metrics - Metrics instance recording the ingest stages (courses,
+            labs, subscriptions, details)
     Returns:
         success - flag if the action was succesful
         error - error message
@@ -96,39 +256,79 @@ def update_edu_data(engine, eduhub_df):
     success, error = _check_df(eduhub_df)
 
     if success:
-        # order data by 'Subscription id' and 'Crawl time utc'
-        eduhub_df.sort_values(
-            by=[CONST_PD_COL_SUB_ID, CONST_PD_COL_CRAWL_TIME_UTC], inplace=True
-        )
-
-        # getting unique courses and making sure that they are in the database
-        success, error, course_dict = _update_courses(engine, eduhub_df)
+        # converting the crawl data to the database types
+        success, error, eduhub_df = _normalise_edu_data(eduhub_df)
 
     if success:
-        # getting unique labs and making sure that they are in the database
-        success, error, lab_dict = _update_labs(engine, eduhub_df, course_dict)
+        # order data by 'Subscription id' and 'Crawl time utc', the only
+        #   sort of the crawl data
+        _sort_edu_data(eduhub_df)
 
-    if success:
-        # getting unique subscriptions and making sure that they are in the
-        # database
-        success, error, sub_dict = _update_subscriptions(engine, eduhub_df)
+        # the crawl data is written within a single transaction which is
+        #   committed once all the tables have been updated
+        own_session = session is None
 
-    if success:
-        # updating details
-        success, error, sub_new_list, sub_upd_list = _update_details(
-            engine, eduhub_df, lab_dict, sub_dict
-        )
+        if own_session:
+            session = session_open(engine)
+
+        try:
+            # getting unique courses and making sure that they are in the
+            #   database
+            with stage(metrics, "ingest.courses", engine) as record:
+                success, error, course_dict = _update_courses(
+                    session, eduhub_df
+                )
+                record["rows"] = len(eduhub_df)
+
+            if success:
+                # getting unique labs and making sure that they are in the
+                #   database
+                with stage(metrics, "ingest.labs", engine) as record:
+                    success, error, lab_dict = _update_labs(
+                        session, eduhub_df, course_dict
+                    )
+                    record["rows"] = len(eduhub_df)
+
+            if success:
+                # getting unique subscriptions and making sure that they are
+                #   in the database
+                with stage(metrics, "ingest.subscriptions", engine) as record:
+                    success, error, sub_dict = _update_subscriptions(
+                        session, eduhub_df
+                    )
+                    record["rows"] = len(eduhub_df)
+
+            if success:
+                # updating details
+                with stage(metrics, "ingest.details", engine) as record:
+                    (
+                        success,
+                        error,
+                        sub_new_list,
+                        sub_upd_list,
+                    ) = _update_details(session, eduhub_df, lab_dict, sub_dict)
+                    record["rows"] = len(eduhub_df)
+        except SQLAlchemyError as exception:
+            success = False
+            error = exception
+
+        if own_session:
+            if success:
+                session_close(session)
+            else:
+                session_rollback(session)
 
     return success, error, lab_dict, sub_dict, sub_new_list, sub_upd_list
 
 
-def new_log(engine, timestamp_utc=None):
+def new_log(engine, timestamp_utc=None, code=CONST_LOG_CODE_SUCCESS):
     """
     Logs successful update of edu_data
 
     Arguments:
         engine - an sql engine instance
         timestamp_utc - timestamp value
+        code - log code (CONST_LOG_CODE_*)
     Returns:
         success - flag if the action was succesful
         error - error message
@@ -140,7 +340,7 @@ def new_log(engine, timestamp_utc=None):
     session = session_open(engine)
 
     new_log_entry = LogsClass(
-        code=CONST_LOG_CODE_SUCCESS,
+        code=code,
         timestamp_utc=timestamp_utc,
     )
 
@@ -154,12 +354,13 @@ def new_log(engine, timestamp_utc=None):
     return True, None
 
 
-def get_latest_log_timestamp(engine):
+def get_latest_log_timestamp(engine, code=CONST_LOG_CODE_SUCCESS):
     """
     Gets the latest timestamp value.
 
     Arguments:
         engine - an sql engine instance
+        code - log code (CONST_LOG_CODE_*) of the entries looked up
     Returns:
         success - flag if the action was succesful
         error - error message
@@ -168,7 +369,11 @@ def get_latest_log_timestamp(engine):
 
     session = session_open(engine)
 
-    timestamp = session.query(func.max(LogsClass.timestamp_utc)).first()[0]
+    timestamp = (
+        session.query(func.max(LogsClass.timestamp_utc))
+        .filter(LogsClass.code == code)
+        .first()[0]
+    )
 
     session.expunge_all()
     session_close(session)
@@ -176,13 +381,13 @@ def get_latest_log_timestamp(engine):
     return True, None, timestamp
 
 
-def _update_courses(engine, eduhub_df):
+def _update_courses(session, eduhub_df):
     """
     Updates the database with the courses eduhub crawl data and returns a
         dictionary containing all courses and their internal id numbers.
 
     Arguments:
-        engine - an sql engine instance
+        session - an active sql session
         eduhub_df - pandas dataframe with the eduhub crawl data
     Returns:
         success - flag if the action was succesful
@@ -200,8 +405,6 @@ def _update_courses(engine, eduhub_df):
     if len(unique_courses) == 0:
         return False, "dataframe does not contain course names", course_dict
 
-    session = session_open(engine)
-
     # get the ids of the courses that are already in the database
     query_result = (
         session.query(CourseClass)
@@ -214,40 +417,41 @@ def _update_courses(engine, eduhub_df):
         course_dict.update({course_name: course_id})
 
     # insert new courses in to the database
-    for course_name in unique_courses:
-        if course_name not in course_dict.keys():
-            # new course -> insert to the database
-            new_course = CourseClass(
-                name=course_name,
-            )
-
-            session.add(new_course)
-            session.flush()
-            # session.commit()
-
-            course_dict.update({course_name: new_course.id})
+    new_courses = [
+        {"name": course_name}
+        for course_name in unique_courses
+        if course_name not in course_dict.keys()
+    ]
+
+    if len(new_courses) > 0:
+        insert_stmt = (
+            pg_insert(CourseClass)
+            .values(new_courses)
+            .returning(CourseClass.name, CourseClass.id)
+        )
 
-    session_close(session)
+        for (course_name, course_id) in session.execute(insert_stmt):
+            course_dict.update({course_name: course_id})
 
     return True, None, course_dict
 
 
-def _update_labs(engine, eduhub_df, course_dict):
+def _update_labs(session, eduhub_df, course_dict):
     """
     Updates the database with the labs eduhub crawl data and returns a
         dictionary containing all labs and their internal id numbers.
 
     Arguments:
-        engine - an sql engine instance
+        session - an active sql session
         eduhub_df - pandas dataframe with the eduhub crawl data
         course_dict - course name/internal id dictionary
     Returns:
         success - flag if the action was succesful
         error - error message
-        lab_dict - lab name/internal id dictionary
+        lab_dict - lab name/internal id dictionary (IdIndex)
     """
 
-    lab_dict = {}
+    lab_dict = IdIndex()
 
     # unique course/lab combinations
     try:
@@ -256,63 +460,73 @@ def _update_labs(engine, eduhub_df, course_dict):
     except KeyError as exception:
         return False, exception, lab_dict
 
-    session = session_open(engine)
+    # get the ids of the labs that are already in the database
+    course_ids = list(
+        set(
+            course_dict[course_name]
+            for course_name in unique_labs[CONST_PD_COL_COURSE_NAME]
+        )
+    )
 
-    # inserting new labs
-    for _, row in unique_labs.iterrows():
-        course_name = row[CONST_PD_COL_COURSE_NAME]
-        lab_name = row[CONST_PD_COL_LAB_NAME]
+    query_result = (
+        session.query(LabClass)
+        .filter(LabClass.course_id.in_(course_ids))
+        .with_entities(LabClass.course_id, LabClass.name, LabClass.id)
+        .all()
+    )
 
-        course_id = course_dict[course_name]
+    db_lab_dict = {}
+    for (course_id, lab_name, lab_id) in query_result:
+        db_lab_dict.update({(course_id, lab_name): lab_id})
 
-        try:
-            lab_id = (
-                session.query(LabClass)
-                .filter(LabClass.course_id == course_id)
-                .filter(LabClass.name == lab_name)
-                .first()
-                .id
-            )
-        except Exception:
-            lab_id = 0
+    new_labs = []
 
-        # create new lab
-        if lab_id == 0:
-            # new lab -> insert to the database
-            new_lab = LabClass(
-                name=lab_name,
-                course_id=course_id,
-            )
+    for course_name, lab_name in unique_labs.itertuples(index=False):
 
-            session.add(new_lab)
-            session.flush()
-            # session.commit()
+        course_id = course_dict[course_name]
 
-            lab_dict.update({(course_name, lab_name): new_lab.id})
+        lab_id = db_lab_dict.get((course_id, lab_name))
+
+        if lab_id is None:
+            # new lab -> insert to the database
+            new_labs.append({"name": lab_name, "course_id": course_id})
         else:
             lab_dict.update({(course_name, lab_name): lab_id})
 
-    session_close(session)
+    # insert new labs in to the database
+    if len(new_labs) > 0:
+        course_names = {}
+        for course_name, course_id in course_dict.items():
+            course_names.update({course_id: course_name})
+
+        insert_stmt = (
+            pg_insert(LabClass)
+            .values(new_labs)
+            .returning(LabClass.course_id, LabClass.name, LabClass.id)
+        )
+
+        for (course_id, lab_name, lab_id) in session.execute(insert_stmt):
+            lab_dict.update({(course_names[course_id], lab_name): lab_id})
 
     return True, None, lab_dict
 
 
-def _update_subscriptions(engine, eduhub_df):
+def _update_subscriptions(session, eduhub_df):
     """
     Updates the database with the subscriptions eduhub crawl data and returns a
         dictionary containing all subscription ids and their internal id
         numbers.
 
     Arguments:
-        engine - an sql engine instance
+        session - an active sql session
         eduhub_df - pandas dataframe with the eduhub crawl data
     Returns:
         success - flag if the action was succesful
         error - error message
-        sub_dict - subscription id/internal id dictionary
+        sub_dict - subscription id/internal id dictionary (IdIndex)
     """
 
-    sub_dict = {}
+    sub_dict = IdIndex()
 
     try:
         unique_subscription_ids = eduhub_df[CONST_PD_COL_SUB_ID].unique()
@@ -322,8 +536,6 @@ def _update_subscriptions(engine, eduhub_df):
     if len(unique_subscription_ids) == 0:
         return False, "dataframe does not contain course names", sub_dict
 
-    session = session_open(engine)
-
     # get the internal ids of the subscriptions that are already in
     #   the database
     query_result = (
@@ -337,32 +549,204 @@ def _update_subscriptions(engine, eduhub_df):
         sub_dict.update({sub_guid: sub_id})
 
     # insert new subscriptions in to the database
-    for sub_guid in unique_subscription_ids:
-        if sub_guid not in sub_dict.keys():
-            # new course -> insert to the database
-            new_subscription = SubscriptionClass(
-                guid=sub_guid,
-            )
+    new_subscriptions = [
+        {"guid": sub_guid}
+        for sub_guid in unique_subscription_ids
+        if sub_guid not in sub_dict.keys()
+    ]
+
+    if len(new_subscriptions) > 0:
+        insert_stmt = (
+            pg_insert(SubscriptionClass)
+            .values(new_subscriptions)
+            .returning(SubscriptionClass.guid, SubscriptionClass.id)
+        )
 
-            session.add(new_subscription)
-            session.flush()
-            # session.commit()
+        for (sub_guid, sub_id) in session.execute(insert_stmt):
+            sub_dict.update({sub_guid: sub_id})
 
-            sub_dict.update({sub_guid: new_subscription.id})
+    return True, None, sub_dict
 
-    session_close(session)
 
-    return True, None, sub_dict
+def _latest_details(session, sub_ids):
+    """
+    Gets the latest details entry of every listed subscription using the
+        subscription_latest table. Subscriptions that are not in the table
+        yet (e.g. ingested before it was introduced) are looked up in the
+        details table.
+
+    Arguments:
+        session - an active sql session
+        sub_ids - a list of subscription internal ids
+    Returns:
+        latest_dict - subscription internal id/latest details dictionary
+        hash_dict - subscription internal id/content hash dictionary
+            (subscriptions without a stored hash are not included)
+    """
+
+    latest_dict = {}
+    hash_dict = {}
+
+    if len(sub_ids) == 0:
+        return latest_dict, hash_dict
+
+    query_result = (
+        session.query(DetailsClass, SubscriptionLatestClass.content_hash)
+        .join(
+            SubscriptionLatestClass,
+            SubscriptionLatestClass.details_id == DetailsClass.id,
+        )
+        .filter(SubscriptionLatestClass.sub_id.in_(sub_ids))
+        .all()
+    )
+
+    for details, content_hash in query_result:
+        latest_dict.update({details.sub_id: details})
+
+        if content_hash is not None:
+            hash_dict.update({details.sub_id: content_hash})
+
+    missing_ids = [x for x in sub_ids if x not in latest_dict.keys()]
+
+    if len(missing_ids) > 0:
+        query_result = (
+            session.query(DetailsClass)
+            .filter(DetailsClass.sub_id.in_(missing_ids))
+            .distinct(DetailsClass.sub_id)
+            .order_by(DetailsClass.sub_id, desc(DetailsClass.timestamp_utc))
+            .all()
+        )
 
+        for details in query_result:
+            latest_dict.update({details.sub_id: details})
 
-def _update_details(engine, eduhub_df, lab_dict, sub_dict):
+    return latest_dict, hash_dict
+
+
+def _details_hash(details):
     """
-    Updates the database with the subscription/handouts details
-        eduhub crawl data.
+    Computes a hash of the content of a details entry (the values of
+        DETAILS_HASH_COLUMNS). The values are formatted the same way whether
+        they come from the crawl data or from the database, so the hash is
+        stable across crawls and processes.
+
+    Arguments:
+        details - a details entry (or an object with the same attributes)
+    Returns:
+        content_hash - hex digest of the content
+    """
+
+    values = []
+
+    for col_name in DETAILS_HASH_COLUMNS:
+        value = getattr(details, col_name)
+
+        if value is None:
+            value = ""
+        elif isinstance(value, datetime):
+            value = value.isoformat()
+        elif isinstance(value, float):
+            value = repr(float(value))
+        else:
+            value = str(value)
+
+        values.append(value)
+
+    return hashlib.sha1("\x1f".join(values).encode("utf-8")).hexdigest()
+
+
+def _update_latest(session, latest_rows):
+    """
+    Points subscriptions at their latest details entries and advances
+        their last seen times. An existing entry is only replaced by a more
+        recent one (or refreshed by the same one), the last seen time never
+        moves back.
+
+    Arguments:
+        session - an active sql session
+        latest_rows - a list of dictionaries with sub_id, details_id,
+            timestamp_utc, subscription_expiry_date, content_hash and
+            last_seen values
+    """
+
+    if len(latest_rows) == 0:
+        return
+
+    insert_stmt = pg_insert(SubscriptionLatestClass).values(latest_rows)
+
+    upsert_stmt = insert_stmt.on_conflict_do_update(
+        index_elements=[SubscriptionLatestClass.sub_id],
+        set_={
+            "details_id": insert_stmt.excluded.details_id,
+            "timestamp_utc": insert_stmt.excluded.timestamp_utc,
+            "subscription_expiry_date": (
+                insert_stmt.excluded.subscription_expiry_date
+            ),
+            "content_hash": insert_stmt.excluded.content_hash,
+            "last_seen": func.greatest(
+                SubscriptionLatestClass.last_seen,
+                insert_stmt.excluded.last_seen,
+            ),
+            "time_updated": func.now(),
+        },
+        where=(
+            SubscriptionLatestClass.timestamp_utc
+            <= insert_stmt.excluded.timestamp_utc
+        ),
+    )
+
+    session.execute(upsert_stmt)
+
+
+def _sort_edu_data(eduhub_df):
+    """
+    Sorts the crawl data by subscription id and crawl time in place.
 
     Arguments:
-        engine - an sql engine instance
         eduhub_df - pandas dataframe with the eduhub crawl data
+    """
+
+    eduhub_df.sort_values(
+        by=[CONST_PD_COL_SUB_ID, CONST_PD_COL_CRAWL_TIME_UTC],
+        kind="mergesort",
+        inplace=True,
+    )
+
+
+def _subscription_row_index(eduhub_df):
+    """
+    Builds an index of row positions for every subscription, so that each
+        subscription's rows can be visited in O(its rows). The rows keep
+        the order of the crawl data, which is sorted by _sort_edu_data.
+
+    Arguments:
+        eduhub_df - pandas dataframe with the eduhub crawl data
+    Returns:
+        records - a list of crawl data rows (as dictionaries)
+        sub_row_index - subscription id / row positions dictionary
+    """
+
+    records = eduhub_df.to_dict("records")
+
+    sub_row_index = eduhub_df.groupby(
+        CONST_PD_COL_SUB_ID, sort=False
+    ).indices
+
+    return records, sub_row_index
+
+
+def _update_details(session, eduhub_df, lab_dict, sub_dict):
+    """
+    Updates the database with the subscription/handouts details
+        eduhub crawl data. All the new entries are written with a single
+        INSERT ... ON CONFLICT DO NOTHING statement. Crawls of a subscription
+        whose content has not changed since its previous entry (the same
+        content hash) are not stored, only its last seen time advances.
+
+    Arguments:
+        session - an active sql session
+        eduhub_df - pandas dataframe with the eduhub crawl data normalised
+            by _normalise_edu_data and sorted by _sort_edu_data
         lab_dict - lab name /internal id dictionary
         sub_dict - subscription id /internal id dictionary
     Returns:
@@ -375,102 +759,160 @@ def _update_details(engine, eduhub_df, lab_dict, sub_dict):
     new_list = []
     update_list = []
 
-    session = session_open(engine)
+    details_rows = []
 
-    for sub_guid in sub_dict.keys():
+    # get the latest details before
+    prev_details_dict, prev_hash_dict = _latest_details(
+        session, list(sub_dict.values())
+    )
+    session.expunge_all()
+
+    # a single pass over the sorted crawl data: rows of every subscription
+    #   are grouped together and ordered by the crawl time
+    records, sub_row_index = _subscription_row_index(eduhub_df)
 
-        # selecting all the entries for a particular subscription and
-        #    sorting them by the crawl time in ascending order
-        sub_eduhub_df = eduhub_df[
-            eduhub_df[CONST_PD_COL_SUB_ID] == sub_guid
-        ].sort_values([CONST_PD_COL_CRAWL_TIME_UTC])
+    last_seen_dict = {}
+
+    for sub_guid in sub_dict.keys():
 
         sub_id = sub_dict[sub_guid]
 
-        # get the latest details before
-        prev_details = (
-            session.query(DetailsClass)
-            .filter(DetailsClass.sub_id == sub_id)
-            .order_by(desc(DetailsClass.timestamp_utc))
-            .first()
-        )
+        prev_details = prev_details_dict.get(sub_id)
 
+        # content hash of the previous entry, entries stored before
+        #   the hashes were introduced are hashed here
+        content_hash = None
         if prev_details is not None:
-            session.expunge(prev_details)
+            content_hash = prev_hash_dict.get(sub_id)
 
-        # appending details
-        for _, row in sub_eduhub_df.iterrows():
+            if content_hash is None:
+                content_hash = _details_hash(prev_details)
+                prev_hash_dict.update({sub_id: content_hash})
 
-            crawl_time = row[CONST_PD_COL_CRAWL_TIME_UTC]
+        # preparing details
+        for row_pos in sub_row_index.get(sub_guid, []):
 
-            if (
-                session.query(DetailsClass)
-                .filter(
-                    DetailsClass.sub_id == sub_id,
-                    DetailsClass.timestamp_utc == crawl_time,
-                )
-                .scalar()
-                is None
-            ):
+            row = records[row_pos]
 
-                if type(row[CONST_PD_COL_SUB_USERS]) is str:
-                    sub_users = ", ".join(eval(row[CONST_PD_COL_SUB_USERS]))
-                elif type(row[CONST_PD_COL_SUB_USERS]) is list:
-                    sub_users = ", ".join(row[CONST_PD_COL_SUB_USERS])
-                else:
-                    sub_users = ""
-
-                # While subscription is "Pending acceptance",
-                #   it doesn't show its expiry date
-                if len(row[CONST_PD_COL_SUB_EXPIRY_DATE]) == 0:
-                    expiry_date = None
-                else:
-                    expiry_date = datetime.strptime(
-                        row[CONST_PD_COL_SUB_EXPIRY_DATE], "%Y-%m-%d"
+            new_sub_detail = dict(
+                sub_id=sub_id,
+                lab_id=lab_dict[
+                    (
+                        row[CONST_PD_COL_COURSE_NAME],
+                        row[CONST_PD_COL_LAB_NAME],
                     )
+                ],
+                handout_name=row[CONST_PD_COL_HANDOUT_NAME],
+                handout_status=row[CONST_PD_COL_HANDOUT_STATUS],
+                handout_budget=row[CONST_PD_COL_HANDOUT_BUDGET],
+                handout_consumed=row[CONST_PD_COL_HANDOUT_CONSUMED],
+                subscription_name=row[CONST_PD_COL_SUB_NAME],
+                subscription_status=row[CONST_PD_COL_SUB_STATUS],
+                subscription_expiry_date=row[CONST_PD_COL_SUB_EXPIRY_DATE],
+                subscription_users=row[CONST_PD_COL_SUB_USERS],
+                timestamp_utc=row[CONST_PD_COL_CRAWL_TIME_UTC],
+                new_flag=(prev_details is None),
+                update_flag=False,
+            )
+
+            # rows are ordered by the crawl time
+            last_seen_dict.update({sub_id: new_sub_detail["timestamp_utc"]})
+
+            new_sub_ns = SimpleNamespace(**new_sub_detail)
+
+            # nothing but the crawl time has changed
+            row_hash = _details_hash(new_sub_ns)
+
+            if row_hash == content_hash:
+                continue
+
+            content_hash = row_hash
+
+            if (prev_details is not None) and details_changed(
+                prev_details, new_sub_ns
+            ):
+                new_sub_detail["update_flag"] = True
+
+            details_rows.append(new_sub_detail)
 
-                # adds new record to the database
-                new_sub_detail = DetailsClass(
+    # adds new records to the database, entries that are already in the
+    #   database are skipped
+    latest_rows = {}
+
+    for sub_id, prev_details in prev_details_dict.items():
+        latest_rows.update(
+            {
+                sub_id: dict(
                     sub_id=sub_id,
-                    lab_id=lab_dict[
-                        (
-                            row[CONST_PD_COL_COURSE_NAME],
-                            row[CONST_PD_COL_LAB_NAME],
-                        )
-                    ],
-                    handout_name=row[CONST_PD_COL_HANDOUT_NAME],
-                    handout_status=row[CONST_PD_COL_HANDOUT_STATUS],
-                    handout_budget=CONVERT_LAMBDA(
-                        row[CONST_PD_COL_HANDOUT_BUDGET]
+                    details_id=prev_details.id,
+                    timestamp_utc=prev_details.timestamp_utc,
+                    subscription_expiry_date=(
+                        prev_details.subscription_expiry_date
                     ),
-                    handout_consumed=CONVERT_LAMBDA(
-                        row[CONST_PD_COL_HANDOUT_CONSUMED]
-                    ),
-                    subscription_name=row[CONST_PD_COL_SUB_NAME],
-                    subscription_status=row[CONST_PD_COL_SUB_STATUS],
-                    subscription_expiry_date=expiry_date,
-                    subscription_users=sub_users,
-                    timestamp_utc=crawl_time,
-                    new_flag=(prev_details is None),
+                    content_hash=prev_hash_dict[sub_id],
+                    last_seen=last_seen_dict.get(sub_id),
                 )
+            }
+        )
 
-                if (prev_details is not None) and details_changed(
-                    prev_details, new_sub_detail
-                ):
-                    new_sub_detail.update_flag = True
+    inserted_sub_ids = set()
+
+    if len(details_rows) > 0:
+        insert_stmt = (
+            pg_insert(DetailsClass)
+            .values(details_rows)
+            .on_conflict_do_nothing(
+                index_elements=[
+                    DetailsClass.sub_id,
+                    DetailsClass.timestamp_utc,
+                ]
+            )
+            .returning(
+                DetailsClass.id,
+                DetailsClass.sub_id,
+                DetailsClass.timestamp_utc,
+                *[getattr(DetailsClass, x) for x in DETAILS_HASH_COLUMNS]
+            )
+        )
 
-                session.add(new_sub_detail)
-                session.flush()
-                # session.commit()
+        for details in session.execute(insert_stmt):
+            inserted_sub_ids.add(details.sub_id)
 
-        # get the latest details after
-        latest_details = (
-            session.query(DetailsClass)
-            .filter(DetailsClass.sub_id == sub_id)
-            .order_by(desc(DetailsClass.timestamp_utc))
-            .first()
-        )
-        session.expunge(latest_details)
+            latest_row = latest_rows.get(details.sub_id)
+
+            if (
+                latest_row is None
+                or latest_row["timestamp_utc"] < details.timestamp_utc
+            ):
+                latest_rows.update(
+                    {
+                        details.sub_id: dict(
+                            sub_id=details.sub_id,
+                            details_id=details.id,
+                            timestamp_utc=details.timestamp_utc,
+                            subscription_expiry_date=(
+                                details.subscription_expiry_date
+                            ),
+                            content_hash=_details_hash(details),
+                            last_seen=last_seen_dict.get(details.sub_id),
+                        )
+                    }
+                )
+
+    # point subscriptions at their latest details
+    _update_latest(session, list(latest_rows.values()))
+
+    # get the latest details after
+    latest_details_dict, _ = _latest_details(session, list(inserted_sub_ids))
+    session.expunge_all()
+
+    reset_usage_ids = []
+    reset_expiry_ids = []
+
+    for sub_id in sub_dict.values():
+
+        prev_details = prev_details_dict.get(sub_id)
+        latest_details = latest_details_dict.get(sub_id, prev_details)
 
         if prev_details is None:
             new_list.append(latest_details)
@@ -480,16 +922,7 @@ def _update_details(engine, eduhub_df, lab_dict, sub_dict):
             # if handout_budget has changed,
             #   nullify usage_code and usage_notice_sent
             if prev_details.handout_budget != latest_details.handout_budget:
-
-                session.query(SubscriptionClass).filter(
-                    SubscriptionClass.id == latest_details.sub_id
-                ).update(
-                    {
-                        "usage_code": None,
-                        "usage_notice_sent": None,
-                    }
-                )
-                session.commit()
+                reset_usage_ids.append(sub_id)
 
             # if subscription_expiry_date has changed,
             #   nullify expiry_code and expiry_notice_sent
@@ -497,17 +930,28 @@ def _update_details(engine, eduhub_df, lab_dict, sub_dict):
                 prev_details.subscription_expiry_date
                 != latest_details.subscription_expiry_date
             ):
+                reset_expiry_ids.append(sub_id)
+
+    if len(reset_usage_ids) > 0:
+        session.query(SubscriptionClass).filter(
+            SubscriptionClass.id.in_(reset_usage_ids)
+        ).update(
+            {
+                "usage_code": None,
+                "usage_notice_sent": None,
+            },
+            synchronize_session=False,
+        )
 
-                session.query(SubscriptionClass).filter(
-                    SubscriptionClass.id == latest_details.sub_id
-                ).update(
-                    {
-                        "expiry_code": None,
-                        "expiry_notice_sent": None,
-                    }
-                )
-                session.commit()
-
-    session_close(session)
+    if len(reset_expiry_ids) > 0:
+        session.query(SubscriptionClass).filter(
+            SubscriptionClass.id.in_(reset_expiry_ids)
+        ).update(
+            {
+                "expiry_code": None,
+                "expiry_notice_sent": None,
+            },
+            synchronize_session=False,
+        )
 
     return True, None, new_list, update_list
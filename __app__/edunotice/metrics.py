@@ -0,0 +1,141 @@
+"""
+Pipeline metrics module.
+
+Records the wall time, the number of database round trips, the number of
+    rows processed and the number of emails of every stage of a run. The
+    records are emitted as structured logging records (the values are passed
+    as custom_dimensions, as read by the Application Insights log exporter)
+    and are kept by the recorder, so they can be inspected afterwards.
+"""
+
+import logging
+import time
+from contextlib import contextmanager, ExitStack
+
+from edunotice.db import QueryProfiler
+
+LOGGER = logging.getLogger(__name__)
+
+# counters of a stage record
+_COUNTERS = ("wall_time", "db_round_trips", "rows", "emails")
+
+
+class Metrics:
+    """
+    Per-stage metrics recorder
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name, engine=None):
+        """
+        Records a stage of a run. The stage's record is yielded, so the
+            number of rows processed and emails can be filled in.
+
+        Arguments:
+            name - stage name
+            engine - an sql engine instance whose round trips are counted
+                (statements issued by other threads within the stage are
+                counted too)
+        Returns:
+            record - stage record dictionary (stage, wall_time,
+                db_round_trips, rows, emails)
+        """
+
+        record = _new_record(name)
+
+        with ExitStack() as stack:
+            queries = None
+
+            if engine is not None:
+                queries = stack.enter_context(
+                    QueryProfiler(engine, num_slowest=0).operation(name)
+                )
+
+            start = time.perf_counter()
+
+            try:
+                yield record
+            finally:
+                record["wall_time"] = time.perf_counter() - start
+
+                if queries is not None:
+                    record["db_round_trips"] = queries["statements"]
+
+                self.stages.append(record)
+                _emit(record)
+
+    def by_stage(self):
+        """
+        Returns the recorded stages.
+
+        Returns:
+            stages - stage name/record dictionary (the records of stages
+                recorded more than once are summed up)
+        """
+
+        stages = {}
+
+        for record in self.stages:
+            total = stages.setdefault(
+                record["stage"], _new_record(record["stage"])
+            )
+
+            for key in _COUNTERS:
+                total[key] += record[key]
+
+        return stages
+
+
+def _new_record(name):
+    """
+    Returns an empty stage record
+    """
+
+    return {
+        "stage": name,
+        "wall_time": 0.0,
+        "db_round_trips": 0,
+        "rows": 0,
+        "emails": 0,
+    }
+
+
+def _emit(record):
+    """
+    Emits a stage record as a structured logging record
+    """
+
+    LOGGER.info(
+        "EduNotice stage %s: wall_time=%.3f db_round_trips=%d rows=%d "
+        "emails=%d",
+        record["stage"],
+        record["wall_time"],
+        record["db_round_trips"],
+        record["rows"],
+        record["emails"],
+        extra={"custom_dimensions": dict(record)},
+    )
+
+
+@contextmanager
+def stage(metrics, name, engine=None):
+    """
+    Records a stage if a metrics recorder is given, otherwise only yields
+        a stage record which is discarded.
+
+    Arguments:
+        metrics - Metrics instance (or None)
+        name - stage name
+        engine - an sql engine instance whose round trips are counted
+    Returns:
+        record - stage record dictionary
+    """
+
+    if metrics is None:
+        yield _new_record(name)
+    else:
+        with metrics.stage(name, engine=engine) as record:
+            yield record
@@ -16,6 +16,33 @@ from edunotice.constants import (
     CONST_TIME_ZONE_NAME,
 )
 
+from edunotice.templates import (
+    CONTACT_US_HTML,
+    DISABLED_HTML,
+    DISABLED_BLOCK_HTML,
+    SEPARATOR_HTML,
+    EMAIL,
+    EMAIL_TOP,
+    EMAIL_MIDDLE,
+    EMAIL_BOTTOM_HTML,
+    VALUE_CHANGED,
+    VALUE_UNCHANGED,
+    EXPIRY_DATE,
+    NEW_SUB_DETAILS,
+    UPD_SUB_DETAILS,
+    NEW_EMAIL_CONTENT,
+    UPD_EMAIL_CONTENT,
+    EXPIRY_EMAIL_CONTENT,
+    USAGE_EMAIL_CONTENT,
+    SUMMARY_PERIOD,
+    SUMMARY_SECTION,
+    SUMMARY_ITEM,
+    SUMMARY_NOTICE,
+    SUMMARY_CODED_NOTICE,
+    SUMMARY_NOTICES_SEPARATOR_HTML,
+)
+from edunotice.utilities import IdIndex
+
 
 def email_top(headline):
     """
@@ -27,27 +54,7 @@ def email_top(headline):
         html_content - html code
     """
 
-    html_content = "<html><body>"
-
-    html_content += '<div dir="ltr" style="font-family:verdana;font-size:12px;'
-    html_content += 'color:#555555;line-height:14pt">'
-
-    html_content += '<div style="width:590px">'
-
-    html_content += "<div style=\"background:url('"
-    html_content += "https://www.gstatic.com/android/"
-    html_content += "market_images/email/email_top.png')"
-    html_content += " no-repeat;width:100%;height:75px;display:block\">"
-
-    html_content += '<div style="padding-top:30px;padding-left:50px;'
-    html_content += 'padding-right:50px;font-size:24px;">'
-
-    html_content += "<div>%s</div>" % (headline)
-
-    html_content += "</div>"
-    html_content += "</div>"
-
-    return html_content
+    return EMAIL_TOP.render(headline=headline)
 
 
 def email_bottom():
@@ -58,14 +65,7 @@ def email_bottom():
         html_content - html code
     """
 
-    html_content = "<div style=\"background:url("
-    html_content += "'https://www.gstatic.com/android/market_images/"
-    html_content += "email/email_bottom.png') no-repeat;width:100%;"
-    html_content += "height:50px;display:block\"></div>"
-
-    html_content += "</div></div></body></html>"
-
-    return html_content
+    return EMAIL_BOTTOM_HTML
 
 
 def email_middle(content):
@@ -78,30 +78,21 @@ def email_middle(content):
         html_content - html code
     """
 
-    html_content = "<div style=\"background:url("
-    html_content += "'https://www.gstatic.com/android/market_images/"
-    html_content += "email/email_mid.png') repeat-y;width:100%;"
-    html_content += "display:block\">"
-
-    html_content += (
-        '<div style="padding-left:50px;padding-right:50px;padding-bottom:1px">'
-    )
-    html_content += '<div style="border-bottom:1px solid #ededed"></div>'
+    return EMAIL_MIDDLE.render(content=content)
 
-    html_content += '<div style="margin:20px 0px;font-size:20px;'
-    html_content += 'line-height:30px;text-align:left">'
 
-    html_content += content
+def email(headline, content):
+    """
+    Generates a whole email: the top, middle and bottom sections.
 
-    html_content += "</div>"
-    html_content += '<div style="text-align:left"></div>'
-    html_content += '<div style="border-bottom:1px solid #ededed"></div>'
-    html_content += "<br>"
-    html_content += "<div>This is an automated email notification sent from "
-    html_content += "the Turing Research Compute Platforms cloud platform -  "
-    html_content += "please do not reply to it.</div></div></div>"
+    Arguments:
+        headline - headline of the top section
+        content - html content of the middle section
+    Returns:
+        html_content - html code
+    """
 
-    return html_content
+    return EMAIL.render(headline=headline, content=content)
 
 
 def value_change(paramter_name, old_value, new_value):
@@ -117,17 +108,28 @@ def value_change(paramter_name, old_value, new_value):
     """
 
     if old_value != new_value:
-        html_content = (
-            "&#9 %s: " % (paramter_name)
-            + "<strike><i>%s</i></strike> " % (old_value)
-            + "&rarr; <strong><i>%s</i></strong><br>" % (new_value)
+        html_content = VALUE_CHANGED.render(
+            name=paramter_name, old_value=old_value, new_value=new_value
         )
     else:
-        html_content = "&#9 %s: <i>%s</i><br>" % (paramter_name, new_value)
+        html_content = VALUE_UNCHANGED.render(
+            name=paramter_name, value=new_value
+        )
 
     return html_content
 
 
+# main details compared by details_changed
+DETAILS_CHANGED_COLUMNS = (
+    "handout_status",
+    "subscription_name",
+    "subscription_status",
+    "subscription_expiry_date",
+    "handout_budget",
+    "subscription_users",
+)
+
+
 def details_changed(prev_details, new_details):
     """
     Checks if at least one of the main details from a subscriptions
@@ -175,31 +177,16 @@ def new_sub_details_html(lab_dict, sub_dict, new_sub, show_expiry_date=False):
         new_sub_html - html content
     """
 
-    course_name, lab_name = list(lab_dict.keys())[
-        list(lab_dict.values()).index(new_sub.lab_id)
-    ]
+    # inverted indices for the id -> name lookups, callers rendering many
+    #   subscriptions pass IdIndex instances, so they are not built per call
+    lab_dict = IdIndex.of(lab_dict)
+    sub_dict = IdIndex.of(sub_dict)
 
-    sub_guid = list(sub_dict.keys())[
-        list(sub_dict.values()).index(new_sub.sub_id)
-    ]
+    course_name, lab_name = lab_dict.name_of(new_sub.lab_id)
 
-    new_sub_html = "&#9 Course: <i>%s</i><br>" % (course_name)
-    new_sub_html += "&#9 Lab: <i>%s</i><br>" % (lab_name)
-    new_sub_html += "&#9 Handout status: <i>%s</i><br>" % (
-        new_sub.handout_status
-    )
+    sub_guid = sub_dict.name_of(new_sub.sub_id)
 
-    new_sub_html += "<br>"
-
-    new_sub_html += "&#9 Subscription name: <i>%s</i><br>" % (
-        new_sub.subscription_name
-    )
-    new_sub_html += "&#9 Subscription ID: <i>%s</i><br>" % (sub_guid)
-    new_sub_html += "&#9 Subscription status: <i>%s</i><br>" % (
-        new_sub.subscription_status
-    )
-
-    new_sub_html += "<br>"
+    expiry_date_html = ""
 
     if (
         new_sub.subscription_status.lower() != CONST_SUB_CANCELLED.lower()
@@ -207,28 +194,25 @@ def new_sub_details_html(lab_dict, sub_dict, new_sub, show_expiry_date=False):
     ):
 
         if isinstance(new_sub.subscription_expiry_date, datetime.datetime):
-            new_sub_html += "&#9 Expiry date: <i>%s</i><br>" % (
-                new_sub.subscription_expiry_date.date()
-            )
+            expiry_date = new_sub.subscription_expiry_date.date()
         else:
-            new_sub_html += "&#9 Expiry date: <i>%s</i><br>" % (
-                new_sub.subscription_expiry_date
-            )
-
-    new_sub_html += "&#9 Budget: <i>${:,.2f}</i> <br>".format(
-        new_sub.handout_budget
+            expiry_date = new_sub.subscription_expiry_date
+
+        expiry_date_html = EXPIRY_DATE.render(expiry_date=expiry_date)
+
+    return NEW_SUB_DETAILS.render(
+        course_name=course_name,
+        lab_name=lab_name,
+        handout_status=new_sub.handout_status,
+        subscription_name=new_sub.subscription_name,
+        sub_guid=sub_guid,
+        subscription_status=new_sub.subscription_status,
+        expiry_date=expiry_date_html,
+        budget="${:,.2f}".format(new_sub.handout_budget),
+        consumed="${:,.2f}".format(new_sub.handout_consumed),
+        users=new_sub.subscription_users,
     )
 
-    new_sub_html += "&#9 Consumed: <i>%s</i><br>" % (
-        "${:,.2f}".format(new_sub.handout_consumed)
-    )
-
-    new_sub_html += "&#9 Users: <i>%s</i><br><br>" % (
-        new_sub.subscription_users
-    )
-
-    return new_sub_html
-
 
 def upd_sub_details_html(lab_dict, sub_dict, upd_sub, show_expiry_date=False):
     """
@@ -246,91 +230,70 @@ def upd_sub_details_html(lab_dict, sub_dict, upd_sub, show_expiry_date=False):
     prev_details = upd_sub[0]
     new_details = upd_sub[1]
 
-    course_name, lab_name = list(lab_dict.keys())[
-        list(lab_dict.values()).index(new_details.lab_id)
-    ]
+    # inverted indices for the id -> name lookups, callers rendering many
+    #   subscriptions pass IdIndex instances, so they are not built per call
+    lab_dict = IdIndex.of(lab_dict)
+    sub_dict = IdIndex.of(sub_dict)
 
-    sub_guid = list(sub_dict.keys())[
-        list(sub_dict.values()).index(new_details.sub_id)
-    ]
+    course_name, lab_name = lab_dict.name_of(new_details.lab_id)
 
-    upd_sub_html = "&#9 Course: <i>%s</i><br>" % (course_name)
-    upd_sub_html += "&#9 Lab: <i>%s</i><br>" % (lab_name)
+    sub_guid = sub_dict.name_of(new_details.sub_id)
 
-    upd_sub_html += value_change(
-        "Handout status",
-        prev_details.handout_status,
-        new_details.handout_status,
-    )
-
-    upd_sub_html += "<br>"
-
-    upd_sub_html += value_change(
-        "Subscription name",
-        prev_details.subscription_name,
-        new_details.subscription_name,
-    )
-
-    upd_sub_html += "&#9 Subscription ID: <i>%s</i><br>" % (sub_guid)
-
-    upd_sub_html += value_change(
-        "Subscription status",
-        prev_details.subscription_status,
-        new_details.subscription_status,
-    )
-
-    upd_sub_html += "<br>"
-
-    prev_expiry_date = prev_details.subscription_expiry_date.strftime(
-        "%Y-%m-%d"
-    )
-    new_expiry_date = new_details.subscription_expiry_date.strftime("%Y-%m-%d")
+    expiry_date_html = ""
 
     if (
         new_details.subscription_status.lower() != CONST_SUB_CANCELLED.lower()
         or show_expiry_date
     ):
-        upd_sub_html += value_change(
-            "Expiry date", prev_expiry_date, new_expiry_date
+        expiry_date_html = value_change(
+            "Expiry date",
+            prev_details.subscription_expiry_date.strftime("%Y-%m-%d"),
+            new_details.subscription_expiry_date.strftime("%Y-%m-%d"),
         )
 
-    prev_budget = "${:,.2f}".format(prev_details.handout_budget)
-    new_budget = "${:,.2f}".format(new_details.handout_budget)
-
-    upd_sub_html += value_change("Budget", prev_budget, new_budget)
-
-    upd_sub_html += "&#9 Consumed: <i>%s</i><br>" % (
-        "${:,.2f}".format(new_details.handout_consumed)
-    )
-
     prev_users = prev_details.subscription_users.split(",")
     new_users = new_details.subscription_users.split(",")
 
-    upd_sub_html += "&#9 Users:"
+    users = []
 
-    user_cnt = 0
     for user in prev_users:
         if user in new_users:
-            if user_cnt > 0:
-                upd_sub_html += ","
-            upd_sub_html += " <i>%s</i>" % (user)
+            users.append(" <i>%s</i>" % (user))
         else:
-            if user_cnt > 0:
-                upd_sub_html += ","
-            upd_sub_html += " <strike><i>%s</i></strike>" % (user)
-        user_cnt += 1
+            users.append(" <strike><i>%s</i></strike>" % (user))
 
     for user in new_users:
         if user not in prev_users:
-            if user_cnt > 0:
-                upd_sub_html += ","
-            upd_sub_html += " <strong><i>%s</i></strong>" % (user)
-        user_cnt += 1
-
-    upd_sub_html += "<br>"
-    upd_sub_html += "<br>"
-
-    return upd_sub_html
+            users.append(" <strong><i>%s</i></strong>" % (user))
+
+    return UPD_SUB_DETAILS.render(
+        course_name=course_name,
+        lab_name=lab_name,
+        handout_status=value_change(
+            "Handout status",
+            prev_details.handout_status,
+            new_details.handout_status,
+        ),
+        subscription_name=value_change(
+            "Subscription name",
+            prev_details.subscription_name,
+            new_details.subscription_name,
+        ),
+        sub_guid=sub_guid,
+        subscription_status=value_change(
+            "Subscription status",
+            prev_details.subscription_status,
+            new_details.subscription_status,
+        ),
+        expiry_date=expiry_date_html,
+        budget=value_change(
+            "Budget",
+            "${:,.2f}".format(prev_details.handout_budget),
+            "${:,.2f}".format(new_details.handout_budget),
+        ),
+        consumed="${:,.2f}".format(new_details.handout_consumed),
+        users=",".join(users),
+    )
 
 
 def contact_us_html():
@@ -339,17 +302,7 @@ def contact_us_html():
 
     """
 
-    # Contact us
-    return (
-        "<div>If the information presented in this email does not match your"
-        + " expectations or if you have questions related to this service, "
-        + "please contact us by submiting a ticket on "
-        + '<a href="https://turingcomplete.topdesk.net/tas/public/'
-        + "ssp/content/serviceflow?unid=0d44e83330e54fac9984742ab85b4e8f"
-        + "&from=7edfe644-ac0d-4895"
-        + '-af98-acd425ee0b19&openedFromService=true">'
-        + 'Turing Complete</a>.</div>'
-    )
+    return CONTACT_US_HTML
 
 
 def disabled_html():
@@ -357,348 +310,326 @@ def disabled_html():
     Generates contact us html content.
 
     """
-    return (
-        "<div>Once a subscription is cancelled (i.e. expires) Microsoft "
-        + "will <b>"
-        + '<a href="https://docs.microsoft.com/en-us/microsoft-365/'
-        + 'commerce/subscriptions/what-if-my-subscription-expires?'
-        + 'view=o365-worldwide"'
-        + ">permanently delete all data after 90 days</a></b>. "
-        + "If you wish to access data on your cancelled subscription, "
-        + "you should get in touch with us via "
-        + '<a href="https://turingcomplete.topdesk.net/tas/public/'
-        + "ssp/content/serviceflow?"
-        + "unid=0d44e83330e54fac9984742ab85b4e8f&from=7edfe644-ac0d-4895"
-        + '-af98-acd425ee0b19&openedFromService=true">Turing Complete</a> '
-        + "as soon as possible.<br><br>Please also note that<b> "
-        + "the final $1million 2020/21 Microsoft gift will expire on the "
-        + "11th of October 2021</b>. If this subscription is being "
-        + "supported by the Microsoft gift and you would like to continue "
-        + "using it beyond the 11th of October 2021, you <b>need to "
-        + "register your subscription for migration to an Enterprise "
-        + "Agreement enrolment</b>, paid for by the Turing Institute. "
-        + "Otherwise you risk of losing access to data and Azure "
-        + "resources associated with the subscription.<br><br>"
-        + "If you haven't received an email about the Azure Enterprise "
-        + "Agreement Migration, please email "
-        + '<a href="ResearchComputePlatforms@turing.ac.uk">'
-        + "ResearchComputePlatforms@turing.ac.uk</a> as soon as possible "
-        + 'and include "EA Migration" in the subject.</div>'
-    )
 
+    return DISABLED_HTML
 
-def summary(
-    lab_dict,
-    sub_dict,
-    new_sub_list,
-    upd_sub_list,
-    sent_noti_list,
-    from_date,
-    to_date,
-):
+
+def _summary_new_items(lab_dict, sub_dict, new_subs):
     """
-    Generates summary email content as an html document. It includes
-        information about new and updated subscriptions.
+    Generates html chunks of the new subscriptions section.
 
     Arguments:
-        lab_dict - lab name /internal id dictionary
-        sub_dict - subscription id /internal id dictionary
-        new_sub_list - a list of details of new subscriptions
-        upd_sub_list - a list of tuple (before, after) of subscription details
-        sent_noti_list - a list of sent notifications as details entries
-        from_date - timestamp of the previous successful eduhub log update
-        to_date - timestamp of the current successful eduhub log update
+        lab_dict - lab name /internal id dictionary (IdIndex)
+        sub_dict - subscription id /internal id dictionary (IdIndex)
+        new_subs - an iterable of details of new subscriptions
     Returns:
-        success - flag if the action was succesful
-        error - error message
-        html_content - summary as an html text
+        chunks - a generator of html chunks
     """
 
-    sub_update_details_list = []
-
-    # check which subsciptions have chaged details
-    for _, sub_update in enumerate(upd_sub_list):
-
-        prev_details = sub_update[0]
-        new_details = sub_update[1]
-
-        if details_changed(prev_details, new_details):
-            sub_update_details_list.append((prev_details, new_details))
+    for new_sub in new_subs:
 
-    html_content = email_top("EduHub Activity Update")
+        sub_guid = sub_dict.name_of(new_sub.sub_id)
 
-    html_middle = (
-        '<div style="font-size:18px;line-height:16px;text-align:left">'
-    )
-
-    to_date_str = to_date.astimezone(tzlocal()).strftime("%Y-%m-%d %H:%M")
-    if from_date is None:
-        html_middle += "%s" % (to_date_str)
-    else:
-        from_date_str = from_date.astimezone(tzlocal()).strftime(
-            "%Y-%m-%d %H:%M"
+        yield SUMMARY_ITEM.render(
+            name=new_sub.subscription_name, sub_guid=sub_guid
         )
-        html_middle += "%s - %s" % (from_date_str, to_date_str)
-
-    html_middle += " (%s)</div><br>" % (CONST_TIME_ZONE_NAME)
-    html_middle += '<div style="border-bottom:1px solid #ededed"></div>'
 
-    # no updates
-    if len(new_sub_list) == 0 and len(sub_update_details_list) == 0:
-        html_middle += "No new subscriptions or updates."
-
-    # new subscriptions
-    if len(new_sub_list) > 0:
-
-        html_middle += "New subscriptions (%d):" % (len(new_sub_list))
-        html_middle += (
-            '<div style="font-size:12px;line-height:16px;text-align:left">'
+        yield new_sub_details_html(
+            lab_dict, sub_dict, new_sub, show_expiry_date=True
         )
 
-        new_subs = ""
 
-        for _, new_sub in enumerate(new_sub_list):
+def _summary_upd_items(lab_dict, sub_dict, upd_subs):
+    """
+    Generates html chunks of the updated subscriptions section.
 
-            sub_guid = list(sub_dict.keys())[
-                list(sub_dict.values()).index(new_sub.sub_id)
-            ]
+    Arguments:
+        lab_dict - lab name /internal id dictionary (IdIndex)
+        sub_dict - subscription id /internal id dictionary (IdIndex)
+        upd_subs - an iterable of tuples (before, after) of subscription
+            details
+    Returns:
+        chunks - a generator of html chunks
+    """
 
-            new_subs += "<li><b>%s</b> (%s)</li><br>" % (
-                new_sub.subscription_name,
-                sub_guid,
-            )
+    for sub_update in upd_subs:
 
-            new_subs += new_sub_details_html(
-                lab_dict, sub_dict, new_sub, show_expiry_date=True
-            )
+        new_details = sub_update[1]
 
-        html_middle += "<p><ul>" + new_subs + "</ul></p>"
+        sub_guid = sub_dict.name_of(new_details.sub_id)
 
-        html_middle += "</div>"
+        yield SUMMARY_ITEM.render(
+            name=new_details.subscription_name, sub_guid=sub_guid
+        )
 
-    # middle line between new subscriptions and updates
-    if len(new_sub_list) > 0 and len(sub_update_details_list) > 0:
-        html_middle += '<div style="border-bottom:1px solid #ededed"></div>'
+        yield upd_sub_details_html(
+            lab_dict, sub_dict, sub_update, show_expiry_date=True
+        )
 
-    # updates
-    if len(sub_update_details_list) > 0:
 
-        html_middle += "Updates (%d):" % (len(sub_update_details_list))
-        html_middle += (
-            '<div style="font-size:12px;line-height:16px;text-align:left">'
-        )
+def _summary_sent_items(sub_dict, sent_notis):
+    """
+    Generates html chunks of the sent notifications section.
 
-        sub_updates = ""
+    Arguments:
+        sub_dict - subscription id /internal id dictionary (IdIndex)
+        sent_notis - an iterable of sent notifications (summary rows)
+    Returns:
+        chunks - a generator of html chunks
+    """
 
-        for _, sub_update in enumerate(sub_update_details_list):
+    prev_sub_guid = None
 
-            prev_details = sub_update[0]
-            new_details = sub_update[1]
+    for sent_noti in sent_notis:
 
-            sub_guid = list(sub_dict.keys())[
-                list(sub_dict.values()).index(new_details.sub_id)
-            ]
+        sub_guid = sub_dict.name_of(sent_noti.sub_id)
 
-            sub_updates += "<li><b>%s</b> (%s)</li><br>" % (
-                new_details.subscription_name,
-                sub_guid,
+        if sub_guid != prev_sub_guid:
+            yield SUMMARY_ITEM.render(
+                name=sent_noti.subscription_name, sub_guid=sub_guid
             )
 
-            sub_updates += upd_sub_details_html(
-                lab_dict, sub_dict, sub_update, show_expiry_date=True
+        if sent_noti.new_notice_sent:
+            yield SUMMARY_NOTICE.render(
+                subject=CONST_EMAIL_SUBJECT_NEW,
+                sent=sent_noti.new_notice_sent.strftime("%Y-%m-%d %H:%M:%S"),
+                time_zone=CONST_TIME_ZONE_NAME,
             )
 
-        html_middle += "<p><ul>" + sub_updates + "</ul></p>"
+        if sent_noti.update_notice_sent:
+            yield SUMMARY_NOTICE.render(
+                subject=CONST_EMAIL_SUBJECT_UPD,
+                sent=sent_noti.update_notice_sent.strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                ),
+                time_zone=CONST_TIME_ZONE_NAME,
+            )
 
-        html_middle += "</div>"
+        if sent_noti.expiry_notice_sent:
+            yield SUMMARY_CODED_NOTICE.render(
+                subject=CONST_EMAIL_SUBJECT_EXPIRE,
+                code="%d" % (sent_noti.expiry_code),
+                sent=sent_noti.expiry_notice_sent.strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                ),
+                time_zone=CONST_TIME_ZONE_NAME,
+            )
 
-    # Notifications sent
-    if len(sent_noti_list) > 0:
-        noti_sent_html = ""
-
-        html_middle += '<div style="border-bottom:1px solid #ededed">'
-        html_middle += '</div><br>'
-        html_middle += "Notifications sent (%d):" % (len(sent_noti_list))
-        html_middle += (
-            '<div style="font-size:12px;line-height:16px;text-align:left">'
-        )
+        if sent_noti.usage_notice_sent:
+            yield SUMMARY_CODED_NOTICE.render(
+                subject=CONST_EMAIL_SUBJECT_USAGE,
+                code="%d" % (sent_noti.usage_code),
+                sent=sent_noti.usage_notice_sent.strftime(
+                    "%Y-%m-%d %H:%M:%S"
+                ),
+                time_zone=CONST_TIME_ZONE_NAME,
+            )
 
-        prev_sub_guid = None
+        prev_sub_guid = sub_guid
 
-        for _, sent_noti in enumerate(sent_noti_list):
 
-            sub_guid = list(sub_dict.keys())[
-                list(sub_dict.values()).index(sent_noti.sub_id)
-            ]
+def _summary_content(
+    lab_dict, sub_dict, new_subs, upd_subs, sent_notis, counts, from_date,
+    to_date,
+):
+    """
+    Generates html chunks of the summary middle section.
+    """
 
-            if sub_guid != prev_sub_guid:
-                noti_sent_html += "<li><b>%s</b> (%s)</li><br>" % (
-                    sent_noti.subscription_name,
-                    sub_guid,
-                )
+    new_count, upd_count, sent_count = counts
 
-            if sent_noti.new_notice_sent:
-                noti_sent_html += "<div>%s: %s (%s)</div><br>" % (
-                    CONST_EMAIL_SUBJECT_NEW,
-                    sent_noti.new_notice_sent.strftime("%Y-%m-%d %H:%M:%S"),
-                    CONST_TIME_ZONE_NAME,
-                )
+    to_date_str = to_date.astimezone(tzlocal()).strftime("%Y-%m-%d %H:%M")
+    if from_date is None:
+        period = to_date_str
+    else:
+        from_date_str = from_date.astimezone(tzlocal()).strftime(
+            "%Y-%m-%d %H:%M"
+        )
+        period = "%s - %s" % (from_date_str, to_date_str)
 
-            if sent_noti.update_notice_sent:
-                noti_sent_html += "<div>%s: %s (%s)</div><br>" % (
-                    CONST_EMAIL_SUBJECT_UPD,
-                    sent_noti.update_notice_sent.strftime("%Y-%m-%d %H:%M:%S"),
-                    CONST_TIME_ZONE_NAME,
-                )
+    yield SUMMARY_PERIOD.render(period=period, time_zone=CONST_TIME_ZONE_NAME)
 
-            if sent_noti.expiry_notice_sent:
-                noti_sent_html += "<div>%s (%d): %s (%s)</div><br>" % (
-                    CONST_EMAIL_SUBJECT_EXPIRE,
-                    sent_noti.expiry_code,
-                    sent_noti.expiry_notice_sent.strftime("%Y-%m-%d %H:%M:%S"),
-                    CONST_TIME_ZONE_NAME,
-                )
+    # no updates
+    if new_count == 0 and upd_count == 0:
+        yield "No new subscriptions or updates."
 
-            if sent_noti.usage_notice_sent:
-                noti_sent_html += "<div>%s (%d): %s (%s)</div><br>" % (
-                    CONST_EMAIL_SUBJECT_USAGE,
-                    sent_noti.usage_code,
-                    sent_noti.usage_notice_sent.strftime("%Y-%m-%d %H:%M:%S"),
-                    CONST_TIME_ZONE_NAME,
-                )
+    # new subscriptions
+    if new_count > 0:
+        yield from SUMMARY_SECTION.stream(
+            title="New subscriptions",
+            count=new_count,
+            items=_summary_new_items(lab_dict, sub_dict, new_subs),
+        )
 
-            prev_sub_guid = sub_guid
+    # middle line between new subscriptions and updates
+    if new_count > 0 and upd_count > 0:
+        yield SEPARATOR_HTML
 
-        html_middle += "<p><ul>" + noti_sent_html + "</ul></p>"
+    # updates
+    if upd_count > 0:
+        yield from SUMMARY_SECTION.stream(
+            title="Updates",
+            count=upd_count,
+            items=_summary_upd_items(lab_dict, sub_dict, upd_subs),
+        )
 
-        html_middle += "</div>"
+    # Notifications sent
+    if sent_count > 0:
+        yield SUMMARY_NOTICES_SEPARATOR_HTML
+        yield from SUMMARY_SECTION.stream(
+            title="Notifications sent",
+            count=sent_count,
+            items=_summary_sent_items(sub_dict, sent_notis),
+        )
 
-    html_content += email_middle(html_middle)
 
-    html_content += email_bottom()
+def summary_stream(
+    lab_dict,
+    sub_dict,
+    new_subs,
+    upd_subs,
+    sent_notis,
+    counts,
+    from_date,
+    to_date,
+):
+    """
+    Generates summary email content as a stream of html chunks. The
+        entries are consumed one by one, so they can be iterated straight
+        from a database cursor.
 
-    return True, None, html_content
+    Arguments:
+        lab_dict - lab name /internal id dictionary
+        sub_dict - subscription id /internal id dictionary
+        new_subs - an iterable of details of new subscriptions
+        upd_subs - an iterable of tuples (before, after) of subscription
+            details, only the subscriptions with changed details
+        sent_notis - an iterable of sent notifications (summary rows)
+        counts - numbers of entries in new_subs, upd_subs and sent_notis
+        from_date - timestamp of the previous successful eduhub log update
+        to_date - timestamp of the current successful eduhub log update
+    Returns:
+        chunks - a generator of html chunks
+    """
+
+    # inverted indices for the id -> name lookups, built once for the
+    #   whole summary
+    lab_dict = IdIndex.of(lab_dict)
+    sub_dict = IdIndex.of(sub_dict)
+
+    yield from EMAIL.stream(
+        headline="EduHub Activity Update",
+        content=_summary_content(
+            lab_dict,
+            sub_dict,
+            new_subs,
+            upd_subs,
+            sent_notis,
+            counts,
+            from_date,
+            to_date,
+        ),
+    )
 
 
-def indiv_email_new(lab_dict, sub_dict, new_sub):
+def summary(
+    lab_dict,
+    sub_dict,
+    new_sub_list,
+    upd_sub_list,
+    sent_noti_list,
+    from_date,
+    to_date,
+):
     """
-    Generates new subscription email content as an html document.
+    Generates summary email content as an html document. It includes
+        information about new and updated subscriptions.
 
     Arguments:
         lab_dict - lab name /internal id dictionary
         sub_dict - subscription id /internal id dictionary
-        new_sub - details of a new subscription
+        new_sub_list - a list of details of new subscriptions
+        upd_sub_list - a list of tuple (before, after) of subscription details
+        sent_noti_list - a list of sent notifications (summary rows)
+        from_date - timestamp of the previous successful eduhub log update
+        to_date - timestamp of the current successful eduhub log update
     Returns:
         success - flag if the action was succesful
         error - error message
         html_content - summary as an html text
     """
 
-    # # Check if the subscription is cancelled
-    # if new_sub.subscription_status.lower() == CONST_SUB_CANCELLED.lower():
-    #     html_content = email_top(CONST_EMAIL_SUBJECT_CANCELLED)
-    # else:
-    html_content = email_top(CONST_EMAIL_SUBJECT_NEW)
+    # check which subsciptions have chaged details
+    sub_update_details_list = [
+        sub_update
+        for sub_update in upd_sub_list
+        if details_changed(sub_update[0], sub_update[1])
+    ]
 
-    html_middle = (
-        '<div style="font-size:12px;line-height:16px;text-align:left">'
+    counts = (
+        len(new_sub_list),
+        len(sub_update_details_list),
+        len(sent_noti_list),
     )
-    html_middle += (
-        "<div>You are receiving this email because a subscription has been"
-        + " registered on EduHub notification service (<b>EduNotice</b>)"
-    )
-
-    if new_sub.subscription_status.lower() == CONST_SUB_CANCELLED.lower():
-        html_middle += " as <b>cancelled</b>"
-
-    html_middle += " and you are listed as its user.</div>"
-    html_middle += '<br><div style="border-bottom:1px solid #ededed">'
-    html_middle += '</div><br>'
-
-    # Subscription details
-    html_middle += "<div><b>Subscription details:</b></div><br>"
-    html_middle += new_sub_details_html(lab_dict, sub_dict, new_sub)
-    html_middle += '<div style="border-bottom:1px solid #ededed"></div><br>'
 
-    # Check if the subscription is cancelled
-    if new_sub.subscription_status.lower() == CONST_SUB_CANCELLED.lower():
-        html_middle += disabled_html()
-        html_middle += (
-            '<br><div style="border-bottom:1px solid #ededed"></div><br>'
+    html_content = "".join(
+        summary_stream(
+            lab_dict,
+            sub_dict,
+            new_sub_list,
+            sub_update_details_list,
+            sent_noti_list,
+            counts,
+            from_date,
+            to_date,
         )
+    )
 
-    # Communications
-    html_middle += "<div><b>Communications:</b> EduNotice will send "
-    html_middle += "the following communications</div>"
-
-    html_middle += "<div><ul>"
-
-    html_middle += "<li><b>Confirmation:</b> an email denoting the "
-    html_middle += "registration of the subscription.</li><br>"
-
-    html_middle += "<li><b>Updates:</b> notification emails denoting"
-    html_middle += " changes in the subscription details.</li><br>"
+    return True, None, html_content
 
-    html_middle += "<li><b>Time-based:</b> notification emails "
-    html_middle += "denoting the amount of time remaining in the"
-    html_middle += " subscription duration according to the "
-    html_middle += "following schedule.</li>"
 
-    html_middle += "<ul>"
-    html_middle += "<li>Notification 1: 30 days before end</li>"
-    html_middle += "<li>Notification 2: 7 days before end</li>"
-    html_middle += "<li>Notification 3: 1 day before end</li>"
-    html_middle += "</ul><br>"
+def indiv_email_new(lab_dict, sub_dict, new_sub, details_html=None):
+    """
+    Generates new subscription email content as an html document.
 
-    html_middle += "<li><b>Usage-based:</b> notification emails "
-    html_middle += "denoting the monetary amount remaining in the "
-    html_middle += "subscription according to the following schedule.</li>"
+    Arguments:
+        lab_dict - lab name /internal id dictionary
+        sub_dict - subscription id /internal id dictionary
+        new_sub - details of a new subscription
+        details_html - html of the subscription details block (default:
+            rendered from the details), e.g. a substitution tag of
+            a batched email
+    Returns:
+        success - flag if the action was succesful
+        error - error message
+        html_content - summary as an html text
+    """
 
-    html_middle += "<ul>"
-    html_middle += (
-        "<li>Notification 1: 50% of monetary credit has been used</li>"
-    )
-    html_middle += (
-        "<li>Notification 2: 75% of monetary credit has been used</li>"
-    )
-    html_middle += (
-        "<li>Notification 3: 90% of monetary credit has been used</li>"
-    )
-    html_middle += (
-        "<li>Notification 4: 95% of monetary credit has been used</li>"
-    )
-    html_middle += "</ul>"
-    html_middle += "</ul></div>"
-    html_middle += '<br><div style="border-bottom:1px solid #ededed">'
-    html_middle += '</div><br>'
-
-    # Disclaimer
-    html_middle += (
-        "<div><b>Disclaimer:</b> EduNotice is only for"
-        + " demonstration purposes and we make no warranties of any "
-        + "kind, express or implied, about the completeness, accuracy,"
-        + " reliability, suitability or availability with respect to "
-        + "the information and service. However, we endeavour to make"
-        + " reasonable effort to keep the information and service up "
-        + "to date and correct. </div>"
+    cancelled = (
+        new_sub.subscription_status.lower() == CONST_SUB_CANCELLED.lower()
     )
 
-    html_middle += '<br><div style="border-bottom:1px solid #ededed">'
-    html_middle += '</div><br>'
-
-    # Contact us
-    html_middle += contact_us_html()
+    # # Check if the subscription is cancelled
+    # if cancelled:
+    #     headline = CONST_EMAIL_SUBJECT_CANCELLED
+    # else:
+    headline = CONST_EMAIL_SUBJECT_NEW
 
-    html_middle += "</div>"
+    if details_html is None:
+        details_html = new_sub_details_html(lab_dict, sub_dict, new_sub)
 
-    html_content += email_middle(html_middle)
+    html_middle = NEW_EMAIL_CONTENT.render(
+        cancelled=" as <b>cancelled</b>" if cancelled else "",
+        details=details_html,
+        disabled=DISABLED_BLOCK_HTML if cancelled else "",
+    )
 
-    html_content += email_bottom()
+    html_content = email(headline, html_middle)
 
     return True, None, html_content
 
 
-def indiv_email_upd(lab_dict, sub_dict, upd_sub):
+def indiv_email_upd(lab_dict, sub_dict, upd_sub, details_html=None):
     """
     Generates subscription update email content as an html document.
 
@@ -706,59 +637,40 @@ def indiv_email_upd(lab_dict, sub_dict, upd_sub):
         lab_dict - lab name /internal id dictionary
         sub_dict - subscription id /internal id dictionary
         upd_sub - tuple (before, after) of subscription details
+        details_html - html of the subscription details block (default:
+            rendered from the details), e.g. a substitution tag of
+            a batched email
     Returns:
         success - flag if the action was succesful
         error - error message
         html_content - summary as an html text
     """
 
-    # if upd_sub[1].subscription_status.lower() == CONST_SUB_CANCELLED.lower():
-    #     html_content = email_top(CONST_EMAIL_SUBJECT_CANCELLED)
-    # else:
-    html_content = email_top(CONST_EMAIL_SUBJECT_UPD)
-
-    html_middle = (
-        '<div style="font-size:12px;line-height:16px;text-align:left">'
-    )
-    html_middle += (
-        "<div>You are receiving this email because a subscription has been "
+    cancelled = (
+        upd_sub[1].subscription_status.lower() == CONST_SUB_CANCELLED.lower()
     )
 
-    if upd_sub[1].subscription_status.lower() == CONST_SUB_CANCELLED.lower():
-        html_middle += "<b>cancelled</b>"
-    else:
-        html_middle += "updated"
-
-    html_middle += " and you are listed as its user.</div>"
-    html_middle += '<br><div style="border-bottom:1px solid #ededed">'
-    html_middle += '</div><br>'
-
-    # Details
-    html_middle += upd_sub_details_html(lab_dict, sub_dict, upd_sub)
-    html_middle += '<br><div style="border-bottom:1px solid #ededed">'
-    html_middle += '</div><br>'
-
-    # Check if the subscription is cancelled
-    if upd_sub[1].subscription_status.lower() == CONST_SUB_CANCELLED.lower():
-        html_middle += disabled_html()
-        html_middle += (
-            '<br><div style="border-bottom:1px solid #ededed"></div><br>'
-        )
-
-    # Contact us
-    html_middle += contact_us_html()
+    # if cancelled:
+    #     headline = CONST_EMAIL_SUBJECT_CANCELLED
+    # else:
+    headline = CONST_EMAIL_SUBJECT_UPD
 
-    html_middle += "</div>"
+    if details_html is None:
+        details_html = upd_sub_details_html(lab_dict, sub_dict, upd_sub)
 
-    html_content += email_middle(html_middle)
+    html_middle = UPD_EMAIL_CONTENT.render(
+        action="<b>cancelled</b>" if cancelled else "updated",
+        details=details_html,
+        disabled=DISABLED_BLOCK_HTML if cancelled else "",
+    )
 
-    html_content += email_bottom()
+    html_content = email(headline, html_middle)
 
     return True, None, html_content
 
 
 def indiv_email_expiry_notification(
-    lab_dict, sub_dict, sub_details, remain_days
+    lab_dict, sub_dict, sub_details, remain_days, details_html=None
 ):
     """
     Generates time-based notification content as an html document.
@@ -768,55 +680,33 @@ def indiv_email_expiry_notification(
         sub_dict - subscription id /internal id dictionary
         sub_details - subscription details
         remain_days - number of remaining days
+        details_html - html of the subscription details block (default:
+            rendered from the details), e.g. a substitution tag of
+            a batched email
     Returns:
         success - flag if the action was succesful
         error - error message
         html_content - summary as an html text
     """
 
-    html_content = email_top(
-        "%s %d day(s)" % (CONST_EMAIL_SUBJECT_EXPIRE, remain_days)
-    )
+    if details_html is None:
+        details_html = new_sub_details_html(lab_dict, sub_dict, sub_details)
 
-    html_middle = (
-        '<div style="font-size:12px;line-height:16px;text-align:left">'
+    html_middle = EXPIRY_EMAIL_CONTENT.render(
+        remain_days="%d" % (remain_days),
+        details=details_html,
     )
 
-    html_middle += (
-        "<div>You are receiving this email because a subscription will expire "
-        + "in %d days and you are listed as its user.</div>" % (remain_days)
+    html_content = email(
+        "%s %d day(s)" % (CONST_EMAIL_SUBJECT_EXPIRE, remain_days),
+        html_middle,
     )
 
-    html_middle += '<br><div style="border-bottom:1px solid #ededed">'
-    html_middle += '</div><br>'
-
-    # Important notice
-    html_middle += disabled_html()
-
-    html_middle += '<br><div style="border-bottom:1px solid #ededed">'
-    html_middle += '</div><br>'
-
-    # Subscription details
-    html_middle += "<div><b>Subscription details:</b></div><br>"
-
-    html_middle += new_sub_details_html(lab_dict, sub_dict, sub_details)
-
-    html_middle += '<div style="border-bottom:1px solid #ededed"></div><br>'
-
-    # Contact us
-    html_middle += contact_us_html()
-
-    html_middle += "</div>"
-
-    html_content += email_middle(html_middle)
-
-    html_content += email_bottom()
-
     return True, None, html_content
 
 
 def indiv_email_usage_notification(lab_dict, sub_dict, sub_details,
-                                   usage_code):
+                                   usage_code, details_html=None):
     """
     Generates usage-based notification content as an html document.
 
@@ -825,50 +715,25 @@ def indiv_email_usage_notification(lab_dict, sub_dict, sub_details,
         sub_dict - subscription id /internal id dictionary
         sub_details - subscription details
         usage_code - usage code
+        details_html - html of the subscription details block (default:
+            rendered from the details), e.g. a substitution tag of
+            a batched email
     Returns:
         success - flag if the action was succesful
         error - error message
         html_content - summary as an html text
     """
 
-    html_content = email_top(
-        "%s %d%%" % (CONST_EMAIL_SUBJECT_USAGE, usage_code)
-    )
+    if details_html is None:
+        details_html = new_sub_details_html(lab_dict, sub_dict, sub_details)
 
-    html_middle = (
-        '<div style="font-size:12px;line-height:16px;text-align:left">'
+    html_middle = USAGE_EMAIL_CONTENT.render(
+        usage_code="%d" % (usage_code),
+        details=details_html,
     )
 
-    html_middle += (
-        "<div>You are receiving this email because a subscription has "
-        + "reached &#8805; %d%% utilisation and " % (usage_code)
-        + "you are listed as its user. Once a subscription utilises "
-        + "its budget, it will be cancelled.</div>"
+    html_content = email(
+        "%s %d%%" % (CONST_EMAIL_SUBJECT_USAGE, usage_code), html_middle
     )
 
-    html_middle += '<br><div style="border-bottom:1px solid #ededed">'
-    html_middle += '</div><br>'
-
-    # Important notice
-    html_middle += disabled_html()
-
-    html_middle += '<br><div style="border-bottom:1px solid #ededed">'
-    html_middle += '</div><br>'
-
-    # Subscription details
-    html_middle += "<div><b>Subscription details:</b></div><br>"
-
-    html_middle += new_sub_details_html(lab_dict, sub_dict, sub_details)
-
-    html_middle += '<div style="border-bottom:1px solid #ededed"></div><br>'
-
-    # Contact us
-    html_middle += contact_us_html()
-
-    html_middle += "</div>"
-
-    html_content += email_middle(html_middle)
-
-    html_content += email_bottom()
-
     return True, None, html_content
@@ -0,0 +1,296 @@
+"""
+Notification outbox module.
+
+Notification emails are rendered and queued in the outbox table within the
+    ingest transaction. drain_outbox sends them out afterwards, marks the
+    entries as delivered and notes the sent notifications in the details and
+    subscription tables. The delivered entries are the record of every sent
+    notification (consecutive notifications about an unchanged subscription
+    share a details entry, which only notes the latest of every kind).
+
+The expiry and usage codes of a subscription are set when their
+    notifications are queued, so the following crawls do not queue them
+    again. When a notification runs out of attempts, the code is reset,
+    so the notification is queued again by the next crawl.
+"""
+
+from datetime import datetime, timezone
+
+from edunotice.sender import send_emails
+from edunotice.utilities import log
+from edunotice.db import session_open, session_close
+from edunotice.structure import OutboxClass, DetailsClass, SubscriptionClass
+
+from edunotice.constants import (
+    CONST_NOTICE_NEW,
+    CONST_NOTICE_UPD,
+    CONST_NOTICE_EXPIRY,
+    CONST_NOTICE_USAGE,
+    SG_OUTBOX_DRAIN_LIMIT,
+    SG_OUTBOX_MAX_ATTEMPTS,
+)
+
+# columns noting a sent notification of every kind
+#   (sent timestamp column, code column)
+NOTICE_COLUMNS = {
+    CONST_NOTICE_NEW: ("new_notice_sent", None),
+    CONST_NOTICE_UPD: ("update_notice_sent", None),
+    CONST_NOTICE_EXPIRY: ("expiry_notice_sent", "expiry_code"),
+    CONST_NOTICE_USAGE: ("usage_notice_sent", "usage_code"),
+}
+
+
+def enqueue(session, notice, details, message, notice_code=None,
+            timestamp_utc=None):
+    """
+    Queues a rendered notification email in the outbox. The entry is
+        committed together with the caller's session.
+
+    Arguments:
+        session - an active sql session
+        notice - notification kind (CONST_NOTICE_*)
+        details - subscription details the notification is about
+        message - tuple (to_str, subject, html_content [, substitutions])
+        notice_code - expiry or usage code of the notification
+        timestamp_utc - timestamp when the email was queued
+    Returns:
+        success - flag if the action was succesful
+        error - error message
+    """
+
+    if timestamp_utc is None:
+        timestamp_utc = datetime.now(timezone.utc)
+
+    session.add(
+        OutboxClass(
+            details_id=details.id,
+            sub_id=details.sub_id,
+            notice=notice,
+            notice_code=notice_code,
+            to_str=message[0],
+            subject=message[1],
+            html_content=message[2],
+            substitutions=message[3] if len(message) > 3 else None,
+            timestamp_utc=timestamp_utc,
+            attempts=0,
+        )
+    )
+
+    return True, None
+
+
+def _notice_mappings(entry, notice_sent_timestamp):
+    """
+    Prepares the details and subscription updates noting a sent
+        notification.
+
+    Arguments:
+        entry - outbox entry
+        notice_sent_timestamp - timestamp when the email was sent
+    Returns:
+        details_mapping - details update
+        sub_mapping - subscription update (None for new/update notices)
+    """
+
+    sent_col, code_col = NOTICE_COLUMNS[entry.notice]
+
+    details_mapping = {"id": entry.details_id, sent_col: notice_sent_timestamp}
+    sub_mapping = None
+
+    if code_col is not None:
+        details_mapping[code_col] = entry.notice_code
+
+        # the subscription code was already set when the email was queued
+        sub_mapping = {"id": entry.sub_id, sent_col: notice_sent_timestamp}
+
+    return details_mapping, sub_mapping
+
+
+def _reset_codes(session, exhausted):
+    """
+    Resets the expiry and usage codes of the subscriptions whose
+        notifications ran out of attempts, so they are queued again. A code
+        is only reset if it is still the code of the notification (and not
+        of a later one).
+
+    Arguments:
+        session - an active sql session (changes are committed by the
+            caller)
+        exhausted - a list of outbox entries that ran out of attempts
+            (their errors are logged by the caller)
+    """
+
+    # subscription ids of every (code column, code)
+    reset_ids = {}
+
+    for entry in exhausted:
+        log(
+            "Outbox %d (%s notification of subscription %d) ran out of "
+            "attempts" % (entry.id, entry.notice, entry.sub_id),
+            level=0,
+        )
+
+        _, code_col = NOTICE_COLUMNS[entry.notice]
+
+        if code_col is not None:
+            reset_ids.setdefault((code_col, entry.notice_code), []).append(
+                entry.sub_id
+            )
+
+    for (code_col, code), sub_ids in reset_ids.items():
+        session.query(SubscriptionClass).filter(
+            SubscriptionClass.id.in_(sub_ids),
+            getattr(SubscriptionClass, code_col) == code,
+        ).update({code_col: None}, synchronize_session=False)
+
+
+def _drain_round(engine, after_id, limit, max_workers, timestamp_utc):
+    """
+    Sends a round of undelivered outbox entries and notes the results.
+        The entries are locked for the duration of the round, so concurrent
+        drains skip them.
+
+    Arguments:
+        engine - an sql engine instance
+        after_id - only entries with a larger id are sent
+        limit - maximum number of entries sent
+        max_workers - maximum number of requests sent concurrently
+        timestamp_utc - timestamp when emails were sent (for testing purposes)
+    Returns:
+        last_id - id of the last entry of the round (None if there were none)
+        counts - dictionary of the number of notifications sent by kind
+    """
+
+    counts = {}
+
+    session = session_open(engine)
+
+    entries = (
+        session.query(OutboxClass)
+        .filter(
+            OutboxClass.sent.is_(None),
+            OutboxClass.attempts < SG_OUTBOX_MAX_ATTEMPTS,
+            OutboxClass.id > after_id,
+        )
+        .order_by(OutboxClass.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+
+    if len(entries) == 0:
+        session_close(session)
+        return None, counts
+
+    messages = [
+        (entry.to_str, entry.subject, entry.html_content)
+        + ((entry.substitutions,) if entry.substitutions else ())
+        for entry in entries
+    ]
+
+    results = send_emails(messages, max_workers=max_workers)
+
+    if timestamp_utc is not None:
+        notice_sent_timestamp = timestamp_utc
+    else:
+        notice_sent_timestamp = datetime.now(timezone.utc)
+
+    outbox_mappings = []
+    details_mappings = []
+    sub_mappings = []
+    exhausted = []
+
+    for entry, (success, error) in zip(entries, results):
+
+        if not success:
+            log(
+                "Failed to send an email (outbox %d): %s" % (entry.id, error),
+                level=0,
+            )
+
+            outbox_mappings.append(
+                {
+                    "id": entry.id,
+                    "attempts": entry.attempts + 1,
+                    "error": str(error)[:1000],
+                }
+            )
+
+            if entry.attempts + 1 >= SG_OUTBOX_MAX_ATTEMPTS:
+                exhausted.append(entry)
+
+            continue
+
+        outbox_mappings.append(
+            {
+                "id": entry.id,
+                "attempts": entry.attempts + 1,
+                "error": None,
+                "sent": notice_sent_timestamp,
+            }
+        )
+
+        details_mapping, sub_mapping = _notice_mappings(
+            entry, notice_sent_timestamp
+        )
+
+        details_mappings.append(details_mapping)
+
+        if sub_mapping is not None:
+            sub_mappings.append(sub_mapping)
+
+        counts[entry.notice] = counts.get(entry.notice, 0) + 1
+
+    last_id = entries[-1].id
+
+    session.bulk_update_mappings(OutboxClass, outbox_mappings)
+    session.bulk_update_mappings(DetailsClass, details_mappings)
+    session.bulk_update_mappings(SubscriptionClass, sub_mappings)
+
+    _reset_codes(session, exhausted)
+
+    session_close(session)
+
+    return last_id, counts
+
+
+def drain_outbox(engine, max_workers=None, limit=None, timestamp_utc=None):
+    """
+    Sends out the undelivered notification emails queued in the outbox,
+        in rounds of at most limit entries. Sent entries are marked as
+        delivered and the notifications are noted in the details and
+        subscription tables. Failed entries are retried by later drains
+        (up to SG_OUTBOX_MAX_ATTEMPTS attempts), the expiry and usage
+        notifications that run out of attempts are queued again by the next
+        crawl.
+
+    Arguments:
+        engine - an sql engine instance
+        max_workers - maximum number of requests sent concurrently
+            (default: SG_EMAIL_WORKERS)
+        limit - number of entries sent per round
+            (default: SG_OUTBOX_DRAIN_LIMIT)
+        timestamp_utc - timestamp when emails were sent (for testing purposes)
+    Returns:
+        success - flag if the action was succesful
+        error - error message
+        counts - dictionary of the number of notifications sent by kind
+    """
+
+    if limit is None:
+        limit = SG_OUTBOX_DRAIN_LIMIT
+
+    counts = {}
+
+    # every entry is attempted at most once per drain
+    last_id = 0
+
+    while last_id is not None:
+        last_id, round_counts = _drain_round(
+            engine, last_id, limit, max_workers, timestamp_utc
+        )
+
+        for notice, count in round_counts.items():
+            counts[notice] = counts.get(notice, 0) + count
+
+    return True, None, counts
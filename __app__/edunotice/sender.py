@@ -2,21 +2,270 @@
 Email sending module
 """
 
-import sendgrid
-from sendgrid.helpers.mail import Email, To, Content, Mail
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.error import URLError
 
 from edunotice.constants import (
     SG_FROM_EMAIL,
     SG_SUMMARY_RECIPIENTS,
     SG_API_KEY,
+    SG_API_HOST,
     SG_TEST_EMAIL,
     SG_TEST_FROM,
     SG_TEST_TO,
     SG_EMAIL_DISABLE,
     SG_EMAIL_EXCL,
+    SG_EMAIL_WORKERS,
+    SG_EMAIL_RATE,
+    SG_EMAIL_BURST,
+    SG_EMAIL_MAX_RETRIES,
+    SG_EMAIL_BACKOFF_BASE,
+    SG_EMAIL_BACKOFF_MAX,
+    SG_EMAIL_BATCH,
+    SG_BATCH_MAX_RECIPIENTS,
+    SG_SUBSTITUTIONS_MAX_BYTES,
 )
 
-SG_CLIENT = sendgrid.SendGridAPIClient(api_key=SG_API_KEY)
+# sendgrid is imported and the client is created on first use, keeping
+#   them off the cold start of the functions that do not send emails
+SG_CLIENT = None
+_CLIENT_LOCK = threading.Lock()
+
+
+def _sg_client():
+    """
+    Returns the SendGrid client, creates it on first use
+    """
+
+    global SG_CLIENT
+
+    with _CLIENT_LOCK:
+        if SG_CLIENT is None:
+            import sendgrid
+
+            SG_CLIENT = sendgrid.SendGridAPIClient(
+                api_key=SG_API_KEY, host=SG_API_HOST
+            )
+
+    return SG_CLIENT
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter shared by the sending threads: a request takes
+        a token, tokens are refilled at a constant rate up to the bucket's
+        capacity.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Arguments:
+            rate - tokens added per second (0 - unlimited)
+            capacity - maximum number of tokens (burst size)
+        """
+
+        self.rate = rate
+        self.capacity = max(capacity or rate, 1)
+
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._not_before = 0.0
+        self._lock = threading.Lock()
+
+    def defer(self, seconds):
+        """
+        Holds back all the requests for the given number of seconds
+            (e.g. after a 429 response)
+        """
+
+        with self._lock:
+            self._not_before = max(
+                self._not_before, time.monotonic() + seconds
+            )
+
+    def acquire(self):
+        """
+        Takes a token, waits for it if the bucket is empty
+
+        Returns:
+            waited - seconds spent waiting
+        """
+
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+
+                if now < self._not_before:
+                    wait = self._not_before - now
+                elif self.rate <= 0:
+                    return waited
+                else:
+                    self._tokens = min(
+                        self.capacity,
+                        self._tokens + (now - self._updated) * self.rate,
+                    )
+                    self._updated = now
+
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return waited
+
+                    wait = (1 - self._tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+class SendCounters:
+    """
+    Thread-safe counters of the messages sent, retried, throttled (429)
+        and failed
+    """
+
+    NAMES = ("sent", "retried", "throttled", "failed")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(self.NAMES, 0)
+
+    def add(self, name, value=1):
+        with self._lock:
+            self._counts[name] += value
+
+    def snapshot(self):
+        """
+        Returns a copy of the counters
+        """
+
+        with self._lock:
+            return dict(self._counts)
+
+    def reset(self):
+        with self._lock:
+            self._counts = dict.fromkeys(self.NAMES, 0)
+
+
+SG_BUCKET = TokenBucket(SG_EMAIL_RATE, SG_EMAIL_BURST)
+SEND_COUNTERS = SendCounters()
+
+
+def _retry_after(headers):
+    """
+    Parses the Retry-After header (seconds or an http date)
+
+    Arguments:
+        headers - response headers
+    Returns:
+        seconds - seconds to wait (None if the header is missing/invalid)
+    """
+
+    value = headers.get("Retry-After") if headers is not None else None
+
+    if value is None:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        retry_date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(retry_date.timestamp() - time.time(), 0.0)
+
+
+def _backoff(attempt, retry_after=None):
+    """
+    Delay before the next attempt: the server's Retry-After if given,
+        otherwise an exponential backoff with full jitter (both capped at
+        SG_EMAIL_BACKOFF_MAX)
+
+    Arguments:
+        attempt - number of the failed attempt (0 - the first one)
+        retry_after - Retry-After value (seconds)
+    Returns:
+        delay - seconds to wait
+    """
+
+    if retry_after is not None:
+        return min(retry_after, SG_EMAIL_BACKOFF_MAX)
+
+    return random.uniform(
+        0, min(SG_EMAIL_BACKOFF_MAX, SG_EMAIL_BACKOFF_BASE * 2 ** attempt)
+    )
+
+
+def _post(request_body, num_messages=1):
+    """
+    Posts a mail/send request within the rate limit (SG_BUCKET).
+        Throttled (429), failed (5xx) and unreachable requests are retried
+        up to SG_EMAIL_MAX_RETRIES times, other errors are not.
+
+    Arguments:
+        request_body - mail/send request body
+        num_messages - number of messages in the request (counters)
+    Returns:
+        success - flag if the action was succesful
+        error - response status code or exception
+    """
+
+    from python_http_client.exceptions import HTTPError
+
+    client = _sg_client()
+
+    attempt = 0
+
+    while True:
+        SG_BUCKET.acquire()
+
+        retry_after = None
+
+        try:
+            response = client.client.mail.send.post(
+                request_body=request_body
+            )
+            status_code = response.status_code
+            error = status_code
+        except HTTPError as exception:
+            status_code = exception.status_code
+            retry_after = _retry_after(exception.headers)
+            error = status_code
+        except (URLError, OSError) as exception:
+            status_code = None
+            error = exception
+
+        if status_code is not None and 200 <= status_code < 300:
+            SEND_COUNTERS.add("sent", num_messages)
+            return True, status_code
+
+        if status_code == 429:
+            SEND_COUNTERS.add("throttled", num_messages)
+
+        retry = status_code is None or status_code == 429 or status_code >= 500
+
+        if not retry or attempt >= SG_EMAIL_MAX_RETRIES:
+            SEND_COUNTERS.add("failed", num_messages)
+            return False, error
+
+        delay = _backoff(attempt, retry_after)
+
+        if status_code == 429:
+            # the limit is shared, all the sending threads hold back
+            SG_BUCKET.defer(delay)
+        else:
+            time.sleep(delay)
+
+        SEND_COUNTERS.add("retried", num_messages)
+        attempt += 1
 
 
 def _prep_to_list(to_str):
@@ -29,6 +278,8 @@ def _prep_to_list(to_str):
         to_list - unique list of recipients
     """
 
+    from sendgrid.helpers.mail import To
+
     if isinstance(to_str, list):
         to_arr = to_str
     elif to_str is None:
@@ -45,22 +296,19 @@ def _prep_to_list(to_str):
     return to_list
 
 
-def send_email(to_str, subject, html_content):
+def _from_and_to(to_str):
     """
-    A function to send an email
+    Prepares the sender and the recipients of an email, taking the test mode
+        and the excluded emails into account.
 
     Arguments:
         to_str - email receivers (comma separated)
-        subject - email subject
-        html_content - email content
     Returns:
-        success - flag if the action was succesful
-        error - error message
+        from_email - sender
+        to_emails - a list of recipients
     """
 
-    if SG_EMAIL_DISABLE:
-        print("!!! SendGrid DISABLED !!!")
-        return True, None
+    from sendgrid.helpers.mail import Email
 
     # if we are testing functionality - ovewrite from/to
     if SG_TEST_EMAIL:
@@ -73,11 +321,61 @@ def send_email(to_str, subject, html_content):
         to_emails_ = _prep_to_list(to_str)
 
     # excluding emails
-    to_emails = [x for x in to_emails_ if x not in SG_EMAIL_EXCL]
+    to_emails = [x for x in to_emails_ if x.email not in (SG_EMAIL_EXCL or [])]
+
+    return from_email, to_emails
+
+
+def _substitute(html_content, substitutions):
+    """
+    Replaces the substitution tags in an html document
+
+    Arguments:
+        html_content - html content with substitution tags
+        substitutions - a dictionary of tag / value pairs
+    Returns:
+        html_content - html content with the tags replaced
+    """
+
+    for tag, value in substitutions.items():
+        html_content = html_content.replace(tag, value)
+
+    return html_content
+
+
+def send_email(to_str, subject, html_content, substitutions=None):
+    """
+    A function to send an email
+
+    Arguments:
+        to_str - email receivers (comma separated)
+        subject - email subject
+        html_content - email content, a string or an iterable of html
+            chunks (e.g. a generator streaming the content)
+        substitutions - a dictionary of tag / value pairs replaced in
+            html_content (see send_emails)
+    Returns:
+        success - flag if the action was succesful
+        error - error message
+    """
+
+    if not isinstance(html_content, str):
+        html_content = "".join(html_content)
+
+    if substitutions:
+        html_content = _substitute(html_content, substitutions)
+
+    if SG_EMAIL_DISABLE:
+        print("!!! SendGrid DISABLED !!!")
+        return True, None
+
+    from_email, to_emails = _from_and_to(to_str)
 
     if len(to_emails) == 0:
         return False, "Empty recipient list"
 
+    from sendgrid.helpers.mail import Content, Mail
+
     content = Content("text/html", html_content)
 
     mail = Mail(
@@ -87,11 +385,242 @@ def send_email(to_str, subject, html_content):
         html_content=content,
     )
 
-    response = SG_CLIENT.client.mail.send.post(request_body=mail.get())
+    success, error = _post(mail.get())
+
+    return success, error
+
+
+def _send_batch(subject, html_content, batch):
+    """
+    Sends emails sharing a subject and an html template in a single
+        request, one personalization (recipients and substitutions) per
+        email. If the request is rejected with a client error (4xx, e.g.
+        an invalid address), the emails are sent one by one, so only the
+        rejected ones fail.
+
+    Arguments:
+        subject - email subject
+        html_content - html template with substitution tags
+        batch - a list of tuples (to_str, substitutions)
+    Returns:
+        results - a list of tuples (success, error), one per email in the
+            order of batch
+    """
+
+    if SG_EMAIL_DISABLE:
+        print("!!! SendGrid DISABLED !!!")
+        return [(True, None)] * len(batch)
+
+    from sendgrid.helpers.mail import (
+        Content,
+        Mail,
+        Personalization,
+        Substitution,
+    )
+
+    results = [None] * len(batch)
+
+    mail = None
+
+    for i, (to_str, substitutions) in enumerate(batch):
+
+        from_email, to_emails = _from_and_to(to_str)
+
+        if len(to_emails) == 0:
+            results[i] = (False, "Empty recipient list")
+            continue
+
+        if mail is None:
+            mail = Mail(
+                from_email=from_email,
+                subject=subject,
+                html_content=Content("text/html", html_content),
+            )
+
+        personalization = Personalization()
+
+        for to_email in to_emails:
+            personalization.add_to(to_email)
+
+        for tag, value in substitutions.items():
+            personalization.add_substitution(Substitution(tag, value))
+
+        # personalizations are kept in the order of the batch
+        mail.add_personalization(
+            personalization, index=len(mail.personalizations or [])
+        )
+
+    if mail is None:
+        return results
+
+    num_messages = results.count(None)
+
+    success, error = _post(mail.get(), num_messages=num_messages)
+
+    if (
+        not success
+        and num_messages > 1
+        and isinstance(error, int)
+        and 400 <= error < 500
+    ):
+        # the messages are counted when sent on their own
+        SEND_COUNTERS.add("failed", -num_messages)
+
+        return [
+            send_email(to_str, subject, html_content, substitutions)
+            if result is None
+            else result
+            for (to_str, substitutions), result in zip(batch, results)
+        ]
+
+    return [
+        (success, error) if result is None else result for result in results
+    ]
+
+
+def _substitutions_size(substitutions):
+    """
+    Returns the total size of substitution tags and values (bytes)
+    """
+
+    return sum(
+        len(tag.encode("utf-8")) + len(value.encode("utf-8"))
+        for tag, value in substitutions.items()
+    )
+
+
+def _batch_jobs(messages):
+    """
+    Groups messages by subject and html template. Each group is split into
+        batches within the SendGrid per request recipient limit
+        (SG_BATCH_MAX_RECIPIENTS).
+
+        Messages without substitutions (or streamed content), or whose
+        substitutions exceed SG_SUBSTITUTIONS_MAX_BYTES, are sent on their
+        own.
+
+    Arguments:
+        messages - a list of tuples (to_str, subject, html_content
+            [, substitutions])
+    Returns:
+        jobs - a list of lists of message indices, one per request
+    """
+
+    jobs = []
+
+    # open batch of every (subject, html template): indices, recipients
+    open_batches = {}
+
+    for i, message in enumerate(messages):
+
+        substitutions = message[3] if len(message) > 3 else None
+
+        if (
+            not substitutions
+            or not isinstance(message[2], str)
+            or _substitutions_size(substitutions) > SG_SUBSTITUTIONS_MAX_BYTES
+        ):
+            jobs.append([i])
+            continue
+
+        num_recipients = max(len(_prep_to_list(message[0])), 1)
+
+        key = (message[1], message[2])
+
+        if key in open_batches:
+            job, batch_recipients = open_batches[key]
+
+            if batch_recipients + num_recipients <= SG_BATCH_MAX_RECIPIENTS:
+                job.append(i)
+                open_batches[key] = (job, batch_recipients + num_recipients)
+                continue
+
+        job = [i]
+        jobs.append(job)
+        open_batches[key] = (job, num_recipients)
+
+    return jobs
+
+
+def _send_job(messages, job):
+    """
+    Sends the messages of a job, any exception is returned as an error
+
+    Arguments:
+        messages - a list of tuples (to_str, subject, html_content
+            [, substitutions])
+        job - a list of message indices
+    Returns:
+        results - a list of tuples (success, error), one per message of the
+            job
+    """
+
+    try:
+        if len(job) == 1:
+            return [send_email(*messages[job[0]])]
+
+        _, subject, html_content, _ = messages[job[0]]
+
+        return _send_batch(
+            subject,
+            html_content,
+            [(messages[i][0], messages[i][3]) for i in job],
+        )
+    except Exception as exception:
+        return [(False, exception)] * len(job)
+
+
+def send_emails(messages, max_workers=None, batch=None):
+    """
+    Sends a batch of emails concurrently through a bounded thread pool.
+
+        In the batch mode, emails sharing a subject and an html template
+        that differ in recipients and substitutions only are sent in a
+        single request (see _batch_jobs).
+
+    Arguments:
+        messages - a list of tuples (to_str, subject, html_content
+            [, substitutions]), substitutions is a dictionary of
+            tag / value pairs replaced in html_content
+        max_workers - maximum number of requests sent concurrently
+            (default: SG_EMAIL_WORKERS)
+        batch - flag whether to batch the emails (default: SG_EMAIL_BATCH)
+    Returns:
+        results - a list of tuples (success, error), one per message in the
+            order of messages
+    """
+
+    if max_workers is None:
+        max_workers = SG_EMAIL_WORKERS
+
+    if batch is None:
+        batch = SG_EMAIL_BATCH
+
+    if len(messages) == 0:
+        return []
+
+    if batch:
+        jobs = _batch_jobs(messages)
+    else:
+        jobs = [[i] for i in range(len(messages))]
+
+    if max_workers <= 1 or len(jobs) == 1:
+        job_results = [_send_job(messages, job) for job in jobs]
+    else:
+        with ThreadPoolExecutor(
+            max_workers=min(max_workers, len(jobs))
+        ) as executor:
+            job_results = list(
+                executor.map(lambda job: _send_job(messages, job), jobs)
+            )
+
+    results = [None] * len(messages)
 
-    success = str(response.status_code).startswith("2")
+    for job, job_result in zip(jobs, job_results):
+        for i, result in zip(job, job_result):
+            results[i] = result
 
-    return success, response.status_code
+    return results
 
 
 def send_summary_email(html_content, upd_timestamp):
@@ -100,7 +629,8 @@ def send_summary_email(html_content, upd_timestamp):
 
     Arguments:
         upd_timestamp - timestamp when eduhub data has been updated
-        html_content - email content
+        html_content - email content, a string or an iterable of html
+            chunks
     Returns:
         success - flag if the action was succesful
         error - error message
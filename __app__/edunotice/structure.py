@@ -8,28 +8,30 @@ from sqlalchemy import (
     Integer,
     Float,
     String,
+    Text,
+    JSON,
     DateTime,
     UniqueConstraint,
     Boolean,
+    Index,
 )
 
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import declarative_base, relationship
 from sqlalchemy.sql import func
 
-from flask_sqlalchemy import SQLAlchemy
-
 from edunotice.constants import (
     COURSES_TABLE_NAME,
     LABS_TABLE_NAME,
     SUBSCRIPTIONS_TABLE_NAME,
     DETAILS_TABLE_NAME,
+    SUBSCRIPTION_LATEST_TABLE_NAME,
     LOGS_TABLE_NAME,
+    OUTBOX_TABLE_NAME,
     ID_COL_NAME,
 )
 
 
-SQLA = SQLAlchemy()
-BASE = SQLA.Model
+BASE = declarative_base()
 
 
 class CourseClass(BASE):
@@ -153,7 +155,67 @@ class DetailsClass(BASE):
     time_updated = Column(DateTime(), onupdate=func.now())
 
     # arguments
-    __table_args__ = (UniqueConstraint("sub_id", "timestamp_utc"),)
+    #   the unique constraint also serves (sub_id, timestamp_utc) lookups,
+    #   partial indexes serve the summary queries of new and updated
+    #   subscriptions
+    __table_args__ = (
+        UniqueConstraint("sub_id", "timestamp_utc"),
+        Index(
+            "ix_details_new_flag_timestamp_utc",
+            timestamp_utc,
+            postgresql_where=new_flag,
+        ),
+        Index(
+            "ix_details_update_flag_timestamp_utc",
+            timestamp_utc,
+            postgresql_where=update_flag,
+        ),
+    )
+
+
+class SubscriptionLatestClass(BASE):
+    """
+    Latest subscription details class: points at the current details entry
+        of a subscription
+    """
+
+    __tablename__ = SUBSCRIPTION_LATEST_TABLE_NAME
+
+    sub_id = Column(
+        Integer,
+        ForeignKey("{}.{}".format(SUBSCRIPTIONS_TABLE_NAME, ID_COL_NAME)),
+        primary_key=True,
+    )
+
+    details_id = Column(
+        Integer,
+        ForeignKey("{}.{}".format(DETAILS_TABLE_NAME, ID_COL_NAME)),
+        nullable=False,
+    )
+
+    timestamp_utc = Column(DateTime, nullable=False)
+
+    # expiry date of the current details entry
+    subscription_expiry_date = Column(DateTime)
+
+    # hash of the content of the current details entry, crawls with
+    #   the same content are not stored again
+    content_hash = Column(String(40))
+
+    # crawl time of the latest crawl the subscription was seen in
+    last_seen = Column(DateTime)
+
+    time_created = Column(DateTime(), server_default=func.now())
+    time_updated = Column(DateTime(), onupdate=func.now())
+
+    # arguments
+    #   the expiry sweep looks up subscriptions by their expiry dates
+    __table_args__ = (
+        Index(
+            "ix_subscription_latest_expiry_date",
+            subscription_expiry_date,
+        ),
+    )
 
 
 class LogsClass(BASE):
@@ -170,3 +232,62 @@ class LogsClass(BASE):
 
     time_created = Column(DateTime(), server_default=func.now())
     time_updated = Column(DateTime(), onupdate=func.now())
+
+
+class OutboxClass(BASE):
+    """
+    Notification outbox class: rendered notification emails queued within
+        the ingest transaction and sent out by drain_outbox
+    """
+
+    __tablename__ = OUTBOX_TABLE_NAME
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+
+    details_id = Column(
+        Integer,
+        ForeignKey("{}.{}".format(DETAILS_TABLE_NAME, ID_COL_NAME)),
+        nullable=False,
+    )
+
+    sub_id = Column(
+        Integer,
+        ForeignKey("{}.{}".format(SUBSCRIPTIONS_TABLE_NAME, ID_COL_NAME)),
+        nullable=False,
+    )
+
+    # notification kind (new, update, expiry, usage) and its code
+    notice = Column(String(25), nullable=False)
+    notice_code = Column(Integer)
+
+    # email
+    to_str = Column(String(10000), nullable=False)
+    subject = Column(String(255), nullable=False)
+    html_content = Column(Text, nullable=False)
+    substitutions = Column(JSON)
+
+    timestamp_utc = Column(DateTime, nullable=False)
+
+    # delivery
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String(1000))
+    sent = Column(DateTime)
+
+    time_created = Column(DateTime(), server_default=func.now())
+    time_updated = Column(DateTime(), onupdate=func.now())
+
+    # arguments
+    #   undelivered entries are looked up by the drain, delivered ones by
+    #   the summary (notifications sent since the previous summary)
+    __table_args__ = (
+        Index(
+            "ix_outbox_undelivered",
+            id,
+            postgresql_where=sent.is_(None),
+        ),
+        Index(
+            "ix_outbox_sent",
+            sent,
+            postgresql_where=sent.isnot(None),
+        ),
+    )
@@ -5,115 +5,251 @@ Summary notifications module.
 
 from datetime import datetime, timezone
 
-from sqlalchemy import desc, or_
+from sqlalchemy import case, desc, func, or_
+from sqlalchemy.orm import aliased
 
-from edunotice.notifications import summary
+from edunotice.constants import CONST_SUMMARY_YIELD_PER
+from edunotice.notifications import summary_stream, DETAILS_CHANGED_COLUMNS
 from edunotice.sender import send_summary_email
 from edunotice.ingress import get_latest_log_timestamp, new_log
+from edunotice.outbox import NOTICE_COLUMNS
 from edunotice.utilities import log
 from edunotice.db import session_open, session_close
-from edunotice.structure import DetailsClass
+from edunotice.structure import DetailsClass, OutboxClass
 from edunotice.data import get_labs_dict, get_subs_dict
 
 
-def _find_new_subs(engine, prev_timestamp_utc):
+def _timestamp_wh(prev_timestamp_utc):
     """
-    Looks for new subscriptions to be included in the summary since
-        the last summary.
+    Returns the where clause selecting details entries since the last summary
+    """
+
+    if prev_timestamp_utc is not None:
+        return DetailsClass.timestamp_utc >= prev_timestamp_utc
+
+    return True
+
+
+def _new_subs_query(session, prev_timestamp_utc):
+    """
+    Builds the query of new subscriptions since the last summary.
 
     Arguments:
-        engine - an sql engine instance
+        session - an active sql session
         prev_timestamp_utc - timestamp of the previous summary
     Returns:
-        success - flag if the action was succesful
-        error - error message
-        new_subs - a lits of new subscriptions to be included in the summary
+        query - details of new subscriptions query
     """
 
-    if prev_timestamp_utc is not None:
-        timestamp_wh = DetailsClass.timestamp_utc >= prev_timestamp_utc
-    else:
-        timestamp_wh = True
-
-    session = session_open(engine)
-
-    new_subs = (
+    return (
         session.query(DetailsClass)
         .filter(
             DetailsClass.new_flag,
-            timestamp_wh,
+            _timestamp_wh(prev_timestamp_utc),
         )
         .order_by(
             DetailsClass.subscription_name.asc(),
             DetailsClass.timestamp_utc.asc(),
         )
-        .all()
     )
 
-    if len(new_subs) > 0:
-        session.expunge_all()
 
-    session_close(session)
+def _upd_subs_query(session, prev_timestamp_utc, changed_only=False):
+    """
+    Builds the query of updated subscriptions since the last summary.
+        Updated details and the details before the update are fetched with
+        a single query: the previous entry is found with LAG() over the
+        subscription's entries since the last summary, or, for the first of
+        them, with a correlated lookup.
 
-    return True, None, new_subs
+    Arguments:
+        session - an active sql session
+        prev_timestamp_utc - timestamp of the previous summary
+        changed_only - only the updates where the main details (see
+            notifications.details_changed) differ
+    Returns:
+        query - (before, after) subscription details query
+    """
 
+    timestamp_wh = _timestamp_wh(prev_timestamp_utc)
 
-def _find_upd_subs(engine, prev_timestamp_utc):
+    # subscriptions updated since the last summary
+    upd_sub_ids = session.query(DetailsClass.sub_id).filter(
+        DetailsClass.update_flag,
+        timestamp_wh,
+    )
+
+    # entries of the updated subscriptions and their previous entries
+    window_q = (
+        session.query(
+            DetailsClass.id,
+            DetailsClass.sub_id,
+            DetailsClass.timestamp_utc,
+            DetailsClass.update_flag,
+            func.lag(DetailsClass.id)
+            .over(
+                partition_by=DetailsClass.sub_id,
+                order_by=DetailsClass.timestamp_utc,
+            )
+            .label("prev_id"),
+        )
+        .filter(
+            DetailsClass.sub_id.in_(upd_sub_ids),
+            timestamp_wh,
+        )
+        .subquery()
+    )
+
+    # the first entry in the window has its previous entry before the
+    #   last summary
+    earlier_details = aliased(DetailsClass)
+
+    earlier_id = (
+        session.query(earlier_details.id)
+        .filter(
+            earlier_details.sub_id == window_q.c.sub_id,
+            earlier_details.timestamp_utc < window_q.c.timestamp_utc,
+        )
+        .order_by(desc(earlier_details.timestamp_utc))
+        .limit(1)
+        .correlate(window_q)
+        .scalar_subquery()
+    )
+
+    pairs_q = (
+        session.query(
+            window_q.c.id,
+            func.coalesce(window_q.c.prev_id, earlier_id).label("prev_id"),
+        )
+        .filter(window_q.c.update_flag)
+        .subquery()
+    )
+
+    prev_details = aliased(DetailsClass)
+
+    query = (
+        session.query(prev_details, DetailsClass)
+        .select_from(pairs_q)
+        .join(DetailsClass, DetailsClass.id == pairs_q.c.id)
+        .join(prev_details, prev_details.id == pairs_q.c.prev_id)
+    )
+
+    if changed_only:
+        query = query.filter(
+            or_(
+                *[
+                    getattr(DetailsClass, col_name).is_distinct_from(
+                        getattr(prev_details, col_name)
+                    )
+                    for col_name in DETAILS_CHANGED_COLUMNS
+                ]
+            )
+        )
+
+    return query.order_by(
+        DetailsClass.subscription_name.asc(),
+        DetailsClass.timestamp_utc.asc(),
+    )
+
+
+def _sent_notifications_query(session, prev_timestamp_utc):
     """
-    Looks for updated subscriptions to be included in the summary since
-        the last summary.
+    Builds the query of notifications sent since the last summary. Every
+        delivered outbox entry is a separate notification, so consecutive
+        notifications about the same details entry are all listed.
 
     Arguments:
-        engine - an sql engine instance
+        session - an active sql session
         prev_timestamp_utc - timestamp of the previous summary
     Returns:
-        success - flag if the action was succesful
-        error - error message
-        update_list - a list of tuples (before, after) of subscription details
+        query - sent notifications query (one row per notification with the
+            subscription name, subscription id and the sent timestamp and
+            code columns of its kind)
     """
 
-    update_list = []
-
     if prev_timestamp_utc is not None:
-        timestamp_wh = DetailsClass.timestamp_utc >= prev_timestamp_utc
+        wh_clause = OutboxClass.sent >= prev_timestamp_utc
     else:
-        timestamp_wh = True
+        wh_clause = OutboxClass.sent.isnot(None)
 
-    session = session_open(engine)
+    # the sent timestamp and code of a notification in the columns of its kind
+    notice_columns = []
 
-    upd_subs = (
-        session.query(DetailsClass)
-        .filter(
-            DetailsClass.update_flag,
-            timestamp_wh,
+    for notice, (sent_col, code_col) in NOTICE_COLUMNS.items():
+        is_notice = OutboxClass.notice == notice
+
+        notice_columns.append(
+            case((is_notice, OutboxClass.sent)).label(sent_col)
+        )
+
+        if code_col is not None:
+            notice_columns.append(
+                case((is_notice, OutboxClass.notice_code)).label(code_col)
+            )
+
+    return (
+        session.query(
+            DetailsClass.subscription_name,
+            OutboxClass.sub_id,
+            *notice_columns
         )
+        .join(DetailsClass, OutboxClass.details_id == DetailsClass.id)
+        .filter(wh_clause)
         .order_by(
             DetailsClass.subscription_name.asc(),
-            DetailsClass.timestamp_utc.asc(),
+            OutboxClass.sent.asc(),
+            OutboxClass.id.asc(),
         )
-        .all()
     )
 
-    if len(upd_subs) > 0:
+
+def _find_new_subs(engine, prev_timestamp_utc):
+    """
+    Looks for new subscriptions to be included in the summary since
+        the last summary.
+
+    Arguments:
+        engine - an sql engine instance
+        prev_timestamp_utc - timestamp of the previous summary
+    Returns:
+        success - flag if the action was succesful
+        error - error message
+        new_subs - a lits of new subscriptions to be included in the summary
+    """
+
+    session = session_open(engine)
+
+    new_subs = _new_subs_query(session, prev_timestamp_utc).all()
+
+    if len(new_subs) > 0:
         session.expunge_all()
 
-    # for every updated subscription find its details before the update
-    for latest_details in upd_subs:
+    session_close(session)
+
+    return True, None, new_subs
 
-        # get the latest details before
-        prev_details = (
-            session.query(DetailsClass)
-            .filter(
-                DetailsClass.sub_id == latest_details.sub_id,
-                DetailsClass.timestamp_utc < latest_details.timestamp_utc,
-            )
-            .order_by(desc(DetailsClass.timestamp_utc))
-            .first()
-        )
 
-        session.expunge(prev_details)
+def _find_upd_subs(engine, prev_timestamp_utc):
+    """
+    Looks for updated subscriptions to be included in the summary since
+        the last summary.
+
+    Arguments:
+        engine - an sql engine instance
+        prev_timestamp_utc - timestamp of the previous summary
+    Returns:
+        success - flag if the action was succesful
+        error - error message
+        update_list - a list of tuples (before, after) of subscription details
+    """
+
+    session = session_open(engine)
+
+    update_list = [
+        tuple(x) for x in _upd_subs_query(session, prev_timestamp_utc).all()
+    ]
 
-        update_list.append((prev_details, latest_details))
+    session.expunge_all()
 
     session_close(session)
 
@@ -131,46 +267,76 @@ def _find_sent_notifications(engine, prev_timestamp_utc):
     Returns:
         success - flag if the action was succesful
         error - error message
-        noti_list - a list of details when notifications were sent
+        noti_list - a list of sent notifications
     """
 
-    if prev_timestamp_utc is not None:
-        wh_clause = or_(
-            DetailsClass.new_notice_sent >= prev_timestamp_utc,
-            DetailsClass.update_notice_sent >= prev_timestamp_utc,
-            DetailsClass.expiry_notice_sent >= prev_timestamp_utc,
-            DetailsClass.usage_notice_sent >= prev_timestamp_utc,
-        )
-    else:
-        wh_clause = or_(
-            DetailsClass.new_notice_sent.isnot(None),
-            DetailsClass.update_notice_sent.isnot(None),
-            DetailsClass.expiry_notice_sent.isnot(None),
-            DetailsClass.usage_notice_sent.isnot(None),
-        )
-
     session = session_open(engine)
 
-    noti_list = (
-        session.query(DetailsClass)
-        .filter(wh_clause)
-        .order_by(
-            DetailsClass.subscription_name.asc(),
-            DetailsClass.timestamp_utc.asc(),
-        )
-        .all()
-    )
+    noti_list = _sent_notifications_query(session, prev_timestamp_utc).all()
 
     if len(noti_list) > 0:
         session.expunge_all()
 
+    session_close(session)
+
     return True, None, noti_list
 
 
-def _prep_summary_email(engine, timestamp_utc=None):
+def _summary_chunks(
+    engine, lab_dict, sub_dict, prev_timestamp_utc, timestamp_utc
+):
     """
-    Prepares and sends out a summary email of new and updated
-        subscriptions and notifications sent.
+    Streams the summary email html. The section sizes are counted in the
+        database first, then the entries are fetched in batches
+        (CONST_SUMMARY_YIELD_PER) and rendered one by one.
+
+    Arguments:
+        engine - an sql engine instance
+        lab_dict - lab name/internal id dictionary
+        sub_dict - subscription id/internal id dictionary
+        prev_timestamp_utc - timestamp of the previous summary
+        timestamp_utc - summary timestamp
+    Returns:
+        chunks - a generator of html chunks
+    """
+
+    session = session_open(engine)
+
+    try:
+        new_subs_q = _new_subs_query(session, prev_timestamp_utc)
+        upd_subs_q = _upd_subs_query(
+            session, prev_timestamp_utc, changed_only=True
+        )
+        sent_noti_q = _sent_notifications_query(session, prev_timestamp_utc)
+
+        log("Counting new and updated subscriptions", level=1)
+        counts = (new_subs_q.count(), upd_subs_q.count(), sent_noti_q.count())
+
+        log(
+            "Streaming %d new, %d updated subscriptions and "
+            "%d sent notifications" % counts,
+            level=1,
+            indent=2,
+        )
+
+        yield from summary_stream(
+            lab_dict,
+            sub_dict,
+            new_subs_q.yield_per(CONST_SUMMARY_YIELD_PER),
+            upd_subs_q.yield_per(CONST_SUMMARY_YIELD_PER),
+            sent_noti_q.yield_per(CONST_SUMMARY_YIELD_PER),
+            counts,
+            prev_timestamp_utc,
+            timestamp_utc,
+        )
+    finally:
+        session_close(session)
+
+
+def _prep_summary_stream(engine, timestamp_utc=None):
+    """
+    Prepares a summary email of new and updated subscriptions and
+        notifications sent as a stream of html chunks.
 
     Arguments:
         engine - an sql engine instance
@@ -178,13 +344,13 @@ def _prep_summary_email(engine, timestamp_utc=None):
     Returns:
         success - flag if the action was succesful
         error - error message
-        html_content - html content of the summary email
+        html_stream - a generator of html chunks of the summary email
     """
 
     if timestamp_utc is None:
         timestamp_utc = datetime.now(timezone.utc)
 
-    html_content = None
+    html_stream = None
 
     log("Looking for the latest log timestamp value", level=1)
     success, error, prev_timestamp_utc = get_latest_log_timestamp(engine)
@@ -201,44 +367,44 @@ def _prep_summary_email(engine, timestamp_utc=None):
             )
 
     if success:
-        log("Looking for new subscriptions", level=1)
-        success, error, new_sub_list = _find_new_subs(
-            engine, prev_timestamp_utc
-        )
+        # find all labs
+        success, error, lab_dict = get_labs_dict(engine)
 
     if success:
-        log("Looking for updated subscriptions", level=1)
-        success, error, upd_sub_list = _find_upd_subs(
-            engine, prev_timestamp_utc
-        )
+        # find all subs
+        success, error, sub_dict = get_subs_dict(engine)
 
     if success:
-        log("Looking for sent notifications", level=1)
-        success, error, sent_noti_list = _find_sent_notifications(
-            engine, prev_timestamp_utc
+        # the entries are only fetched once the stream is consumed
+        html_stream = _summary_chunks(
+            engine, lab_dict, sub_dict, prev_timestamp_utc, timestamp_utc
         )
 
-    if success:
-        # find all labs
-        success, error, lab_dict = get_labs_dict(engine)
+    return success, error, html_stream
 
-    if success:
-        # find all subs
-        success, error, sub_dict = get_subs_dict(engine)
+
+def _prep_summary_email(engine, timestamp_utc=None):
+    """
+    Prepares and sends out a summary email of new and updated
+        subscriptions and notifications sent.
+
+    Arguments:
+        engine - an sql engine instance
+        timestamp_utc - summary timestamp
+    Returns:
+        success - flag if the action was succesful
+        error - error message
+        html_content - html content of the summary email
+    """
+
+    html_content = None
+
+    success, error, html_stream = _prep_summary_stream(engine, timestamp_utc)
 
     if success:
-        # prepare html
         log("Making a summary / html of the registered changes", level=1)
 
-        success, error, html_content = summary(
-            lab_dict,
-            sub_dict,
-            new_sub_list,
-            upd_sub_list,
-            sent_noti_list,
-            prev_timestamp_utc,
-            timestamp_utc,
-        )
+        html_content = "".join(html_stream)
 
     return success, error, html_content
 
@@ -260,11 +426,11 @@ def summary_email(engine, timestamp_utc=None):
 
     log("Preparing summary email", level=1)
 
-    success, error, html_content = _prep_summary_email(engine, timestamp_utc)
+    success, error, html_stream = _prep_summary_stream(engine, timestamp_utc)
 
     if success:
         log("Sending summary email", level=1)
-        success, error = send_summary_email(html_content, timestamp_utc)
+        success, error = send_summary_email(html_stream, timestamp_utc)
 
     if success:
         success, error = new_log(engine, timestamp_utc)
@@ -0,0 +1,392 @@
+"""
+Email templates module.
+
+Templates are compiled once at import: the static chrome (header, footer,
+    disclaimers) is pre-rendered and only the dynamic values are joined in
+    when an email is rendered.
+"""
+
+from string import Formatter
+
+
+class HtmlTemplate:
+    """
+    A template compiled from a format string with named {fields}. Fields
+        given as keyword arguments are filled in at compile time, the rest
+        are filled in by render().
+    """
+
+    def __init__(self, source, **static_values):
+        """
+        Compiles the template into a list of pre-rendered static chunks
+            and the positions (slots) of the remaining fields.
+
+        Arguments:
+            source - template source with named {fields}
+            static_values - values of the fields known at compile time
+        """
+
+        self._chunks = []
+        self._slots = []
+
+        literal_text = ""
+
+        for literal, field_name, _, _ in Formatter().parse(source):
+            literal_text += literal
+
+            if field_name is None:
+                continue
+
+            if field_name in static_values:
+                literal_text += static_values[field_name]
+                continue
+
+            if len(literal_text) > 0:
+                self._chunks.append(literal_text)
+                literal_text = ""
+
+            self._slots.append((len(self._chunks), field_name))
+            self._chunks.append(None)
+
+        if len(literal_text) > 0:
+            self._chunks.append(literal_text)
+
+    @property
+    def fields(self):
+        """
+        Names of the fields filled in by render()
+        """
+
+        return [field_name for _, field_name in self._slots]
+
+    def render(self, **values):
+        """
+        Renders the template.
+
+        Arguments:
+            values - values of the template fields
+        Returns:
+            html_content - html code
+        """
+
+        chunks = self._chunks.copy()
+
+        for position, field_name in self._slots:
+            value = values[field_name]
+
+            if value.__class__ is not str:
+                value = "%s" % (value,)
+
+            chunks[position] = value
+
+        return "".join(chunks)
+
+    def stream(self, **values):
+        """
+        Renders the template chunk by chunk. Iterator values (e.g.
+            generators) are streamed through without being joined.
+
+        Arguments:
+            values - values of the template fields
+        Returns:
+            chunks - a generator of html chunks
+        """
+
+        slot_names = dict(self._slots)
+
+        for position, chunk in enumerate(self._chunks):
+            if chunk is not None:
+                yield chunk
+                continue
+
+            value = values[slot_names[position]]
+
+            if value.__class__ is str:
+                yield value
+            elif hasattr(value, "__next__"):
+                yield from value
+            else:
+                yield "%s" % (value,)
+
+
+SEPARATOR_HTML = '<div style="border-bottom:1px solid #ededed"></div>'
+
+CONTACT_US_HTML = (
+    "<div>If the information presented in this email does not match your"
+    " expectations or if you have questions related to this service, "
+    "please contact us by submiting a ticket on "
+    '<a href="https://turingcomplete.topdesk.net/tas/public/'
+    "ssp/content/serviceflow?unid=0d44e83330e54fac9984742ab85b4e8f"
+    "&from=7edfe644-ac0d-4895"
+    '-af98-acd425ee0b19&openedFromService=true">'
+    "Turing Complete</a>.</div>"
+)
+
+DISABLED_HTML = (
+    "<div>Once a subscription is cancelled (i.e. expires) Microsoft "
+    "will <b>"
+    '<a href="https://docs.microsoft.com/en-us/microsoft-365/'
+    "commerce/subscriptions/what-if-my-subscription-expires?"
+    'view=o365-worldwide"'
+    ">permanently delete all data after 90 days</a></b>. "
+    "If you wish to access data on your cancelled subscription, "
+    "you should get in touch with us via "
+    '<a href="https://turingcomplete.topdesk.net/tas/public/'
+    "ssp/content/serviceflow?"
+    "unid=0d44e83330e54fac9984742ab85b4e8f&from=7edfe644-ac0d-4895"
+    '-af98-acd425ee0b19&openedFromService=true">Turing Complete</a> '
+    "as soon as possible.<br><br>Please also note that<b> "
+    "the final $1million 2020/21 Microsoft gift will expire on the "
+    "11th of October 2021</b>. If this subscription is being "
+    "supported by the Microsoft gift and you would like to continue "
+    "using it beyond the 11th of October 2021, you <b>need to "
+    "register your subscription for migration to an Enterprise "
+    "Agreement enrolment</b>, paid for by the Turing Institute. "
+    "Otherwise you risk of losing access to data and Azure "
+    "resources associated with the subscription.<br><br>"
+    "If you haven't received an email about the Azure Enterprise "
+    "Agreement Migration, please email "
+    '<a href="ResearchComputePlatforms@turing.ac.uk">'
+    "ResearchComputePlatforms@turing.ac.uk</a> as soon as possible "
+    'and include "EA Migration" in the subject.</div>'
+)
+
+DISCLAIMER_HTML = (
+    "<div><b>Disclaimer:</b> EduNotice is only for"
+    " demonstration purposes and we make no warranties of any "
+    "kind, express or implied, about the completeness, accuracy,"
+    " reliability, suitability or availability with respect to "
+    "the information and service. However, we endeavour to make"
+    " reasonable effort to keep the information and service up "
+    "to date and correct. </div>"
+)
+
+COMMUNICATIONS_HTML = (
+    "<div><b>Communications:</b> EduNotice will send "
+    "the following communications</div>"
+    "<div><ul>"
+    "<li><b>Confirmation:</b> an email denoting the "
+    "registration of the subscription.</li><br>"
+    "<li><b>Updates:</b> notification emails denoting"
+    " changes in the subscription details.</li><br>"
+    "<li><b>Time-based:</b> notification emails "
+    "denoting the amount of time remaining in the"
+    " subscription duration according to the "
+    "following schedule.</li>"
+    "<ul>"
+    "<li>Notification 1: 30 days before end</li>"
+    "<li>Notification 2: 7 days before end</li>"
+    "<li>Notification 3: 1 day before end</li>"
+    "</ul><br>"
+    "<li><b>Usage-based:</b> notification emails "
+    "denoting the monetary amount remaining in the "
+    "subscription according to the following schedule.</li>"
+    "<ul>"
+    "<li>Notification 1: 50% of monetary credit has been used</li>"
+    "<li>Notification 2: 75% of monetary credit has been used</li>"
+    "<li>Notification 3: 90% of monetary credit has been used</li>"
+    "<li>Notification 4: 95% of monetary credit has been used</li>"
+    "</ul>"
+    "</ul></div>"
+)
+
+# a cancelled subscription notice followed by a separator
+DISABLED_BLOCK_HTML = DISABLED_HTML + "<br>" + SEPARATOR_HTML + "<br>"
+
+EMAIL_TOP_SOURCE = (
+    "<html><body>"
+    '<div dir="ltr" style="font-family:verdana;font-size:12px;'
+    'color:#555555;line-height:14pt">'
+    '<div style="width:590px">'
+    "<div style=\"background:url('"
+    "https://www.gstatic.com/android/"
+    "market_images/email/email_top.png')"
+    " no-repeat;width:100%;height:75px;display:block\">"
+    '<div style="padding-top:30px;padding-left:50px;'
+    'padding-right:50px;font-size:24px;">'
+    "<div>{headline}</div>"
+    "</div>"
+    "</div>"
+)
+
+EMAIL_MIDDLE_SOURCE = (
+    "<div style=\"background:url("
+    "'https://www.gstatic.com/android/market_images/"
+    "email/email_mid.png') repeat-y;width:100%;"
+    "display:block\">"
+    '<div style="padding-left:50px;padding-right:50px;padding-bottom:1px">'
+    "{separator}"
+    '<div style="margin:20px 0px;font-size:20px;'
+    'line-height:30px;text-align:left">'
+    "{content}"
+    "</div>"
+    '<div style="text-align:left"></div>'
+    "{separator}"
+    "<br>"
+    "<div>This is an automated email notification sent from "
+    "the Turing Research Compute Platforms cloud platform -  "
+    "please do not reply to it.</div></div></div>"
+)
+
+EMAIL_BOTTOM_HTML = (
+    "<div style=\"background:url("
+    "'https://www.gstatic.com/android/market_images/"
+    "email/email_bottom.png') no-repeat;width:100%;"
+    "height:50px;display:block\"></div>"
+    "</div></div></body></html>"
+)
+
+EMAIL_TOP = HtmlTemplate(EMAIL_TOP_SOURCE)
+
+EMAIL_MIDDLE = HtmlTemplate(EMAIL_MIDDLE_SOURCE, separator=SEPARATOR_HTML)
+
+# a whole email: top, middle and bottom sections
+EMAIL = HtmlTemplate(
+    EMAIL_TOP_SOURCE + EMAIL_MIDDLE_SOURCE + "{bottom}",
+    separator=SEPARATOR_HTML,
+    bottom=EMAIL_BOTTOM_HTML,
+)
+
+NEW_SUB_DETAILS = HtmlTemplate(
+    "&#9 Course: <i>{course_name}</i><br>"
+    "&#9 Lab: <i>{lab_name}</i><br>"
+    "&#9 Handout status: <i>{handout_status}</i><br>"
+    "<br>"
+    "&#9 Subscription name: <i>{subscription_name}</i><br>"
+    "&#9 Subscription ID: <i>{sub_guid}</i><br>"
+    "&#9 Subscription status: <i>{subscription_status}</i><br>"
+    "<br>"
+    "{expiry_date}"
+    "&#9 Budget: <i>{budget}</i> <br>"
+    "&#9 Consumed: <i>{consumed}</i><br>"
+    "&#9 Users: <i>{users}</i><br><br>"
+)
+
+EXPIRY_DATE = HtmlTemplate("&#9 Expiry date: <i>{expiry_date}</i><br>")
+
+UPD_SUB_DETAILS = HtmlTemplate(
+    "&#9 Course: <i>{course_name}</i><br>"
+    "&#9 Lab: <i>{lab_name}</i><br>"
+    "{handout_status}"
+    "<br>"
+    "{subscription_name}"
+    "&#9 Subscription ID: <i>{sub_guid}</i><br>"
+    "{subscription_status}"
+    "<br>"
+    "{expiry_date}"
+    "{budget}"
+    "&#9 Consumed: <i>{consumed}</i><br>"
+    "&#9 Users:{users}"
+    "<br>"
+    "<br>"
+)
+
+VALUE_CHANGED = HtmlTemplate(
+    "&#9 {name}: "
+    "<strike><i>{old_value}</i></strike> "
+    "&rarr; <strong><i>{new_value}</i></strong><br>"
+)
+
+VALUE_UNCHANGED = HtmlTemplate("&#9 {name}: <i>{value}</i><br>")
+
+# individual emails, middle section
+NEW_EMAIL_CONTENT = HtmlTemplate(
+    '<div style="font-size:12px;line-height:16px;text-align:left">'
+    "<div>You are receiving this email because a subscription has been"
+    " registered on EduHub notification service (<b>EduNotice</b>)"
+    "{cancelled}"
+    " and you are listed as its user.</div>"
+    "<br>{separator}<br>"
+    "<div><b>Subscription details:</b></div><br>"
+    "{details}"
+    "{separator}<br>"
+    "{disabled}"
+    "{communications}"
+    "<br>{separator}<br>"
+    "{disclaimer}"
+    "<br>{separator}<br>"
+    "{contact_us}"
+    "</div>",
+    separator=SEPARATOR_HTML,
+    communications=COMMUNICATIONS_HTML,
+    disclaimer=DISCLAIMER_HTML,
+    contact_us=CONTACT_US_HTML,
+)
+
+UPD_EMAIL_CONTENT = HtmlTemplate(
+    '<div style="font-size:12px;line-height:16px;text-align:left">'
+    "<div>You are receiving this email because a subscription has been "
+    "{action}"
+    " and you are listed as its user.</div>"
+    "<br>{separator}<br>"
+    "{details}"
+    "<br>{separator}<br>"
+    "{disabled}"
+    "{contact_us}"
+    "</div>",
+    separator=SEPARATOR_HTML,
+    contact_us=CONTACT_US_HTML,
+)
+
+EXPIRY_EMAIL_CONTENT = HtmlTemplate(
+    '<div style="font-size:12px;line-height:16px;text-align:left">'
+    "<div>You are receiving this email because a subscription will expire "
+    "in {remain_days} days and you are listed as its user.</div>"
+    "<br>{separator}<br>"
+    "{disabled}"
+    "<br>{separator}<br>"
+    "<div><b>Subscription details:</b></div><br>"
+    "{details}"
+    "{separator}<br>"
+    "{contact_us}"
+    "</div>",
+    separator=SEPARATOR_HTML,
+    disabled=DISABLED_HTML,
+    contact_us=CONTACT_US_HTML,
+)
+
+USAGE_EMAIL_CONTENT = HtmlTemplate(
+    '<div style="font-size:12px;line-height:16px;text-align:left">'
+    "<div>You are receiving this email because a subscription has "
+    "reached &#8805; {usage_code}% utilisation and "
+    "you are listed as its user. Once a subscription utilises "
+    "its budget, it will be cancelled.</div>"
+    "<br>{separator}<br>"
+    "{disabled}"
+    "<br>{separator}<br>"
+    "<div><b>Subscription details:</b></div><br>"
+    "{details}"
+    "{separator}<br>"
+    "{contact_us}"
+    "</div>",
+    separator=SEPARATOR_HTML,
+    disabled=DISABLED_HTML,
+    contact_us=CONTACT_US_HTML,
+)
+
+# summary email, middle section
+SUMMARY_PERIOD = HtmlTemplate(
+    '<div style="font-size:18px;line-height:16px;text-align:left">'
+    "{period} ({time_zone})</div><br>"
+    "{separator}",
+    separator=SEPARATOR_HTML,
+)
+
+SUMMARY_SECTION = HtmlTemplate(
+    "{title} ({count}):"
+    '<div style="font-size:12px;line-height:16px;text-align:left">'
+    "<p><ul>{items}</ul></p>"
+    "</div>"
+)
+
+SUMMARY_ITEM = HtmlTemplate("<li><b>{name}</b> ({sub_guid})</li><br>")
+
+SUMMARY_NOTICE = HtmlTemplate("<div>{subject}: {sent} ({time_zone})</div><br>")
+
+SUMMARY_CODED_NOTICE = HtmlTemplate(
+    "<div>{subject} ({code}): {sent} ({time_zone})</div><br>"
+)
+
+SUMMARY_NOTICES_SEPARATOR_HTML = (
+    '<div style="border-bottom:1px solid #ededed">' + "</div><br>"
+)
@@ -31,3 +31,89 @@ def log(message, level=3, indent=0):
             indent_str += "  "
 
         print("%s | %s%s" % (utc_timestamp, indent_str, message))
+
+
+class IdIndex(dict):
+    """
+    A name/internal id dictionary that can also be looked up by internal id
+        in constant time. The inverted index is built on the first lookup
+        by id and is dropped whenever the dictionary is modified.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._inverse = None
+
+    @classmethod
+    def of(cls, mapping):
+        """
+        Returns the mapping as an IdIndex, wrapping it only if needed.
+
+        Arguments:
+            mapping - name/internal id dictionary
+        Returns:
+            id_index - IdIndex instance
+        """
+
+        if isinstance(mapping, cls):
+            return mapping
+
+        return cls(mapping)
+
+    def name_of(self, internal_id):
+        """
+        Looks up the name (key) of an internal id (value).
+
+        Arguments:
+            internal_id - internal id
+        Returns:
+            name - the first key mapped to the internal id
+        """
+
+        if self._inverse is None:
+            inverse = {}
+            for name, value in self.items():
+                inverse.setdefault(value, name)
+
+            self._inverse = inverse
+
+        return self._inverse[internal_id]
+
+    def _invalidate(self):
+        self._inverse = None
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._invalidate()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._invalidate()
+
+    def __ior__(self, other):
+        result = super().__ior__(other)
+        self._invalidate()
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._invalidate()
+
+    def setdefault(self, key, default=None):
+        result = super().setdefault(key, default)
+        self._invalidate()
+        return result
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._invalidate()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self._invalidate()
+        return result
+
+    def clear(self):
+        super().clear()
+        self._invalidate()
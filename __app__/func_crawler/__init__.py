@@ -2,11 +2,9 @@ import datetime
 import logging
 import azure.functions as func
 
-from sqlalchemy import create_engine
-
 from educrawler.crawler import crawl
 from edunotice.edunotice import update_subscriptions
-from edunotice.constants import SQL_CONNECTION_STRING_DB
+from edunotice.db import get_engine
 
 
 class Namespace:
@@ -48,7 +46,7 @@ def main(mytimer: func.TimerRequest) -> None:
     if status:
         args = Namespace(input_df=crawl_df)
 
-        engine = create_engine(SQL_CONNECTION_STRING_DB)
+        engine = get_engine()
 
         status, error, counts = update_subscriptions(engine, args)
 
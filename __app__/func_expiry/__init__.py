@@ -0,0 +1,36 @@
+import datetime
+import logging
+import azure.functions as func
+
+from edunotice.expiry import sweep_expiry
+from edunotice.outbox import drain_outbox
+from edunotice.constants import SG_OUTBOX_DRAIN_INLINE
+from edunotice.db import get_engine
+
+
+def main(mytimer: func.TimerRequest) -> None:
+
+    utc_timestamp = (
+        datetime.datetime.utcnow()
+        .replace(tzinfo=datetime.timezone.utc)
+        .isoformat()
+    )
+
+    engine = get_engine()
+
+    logging.info("EduNotice expiry function started at %s", utc_timestamp)
+
+    success, error, count = sweep_expiry(engine)
+
+    if success:
+        logging.info("EduNotice: queued %d time-based notification" % (count))
+
+        if SG_OUTBOX_DRAIN_INLINE:
+            success, error, counts = drain_outbox(engine)
+
+    if success:
+        logging.info("EduNotice expiry sweep finished")
+    else:
+        logging.error("EduNotice expiry sweep failed: %s" % (error))
+
+    logging.info("EduNotice expiry function finished at %s", utc_timestamp)
@@ -0,0 +1,28 @@
+import datetime
+import logging
+import azure.functions as func
+
+from edunotice.outbox import drain_outbox
+from edunotice.db import get_engine
+
+
+def main(mytimer: func.TimerRequest) -> None:
+
+    utc_timestamp = (
+        datetime.datetime.utcnow()
+        .replace(tzinfo=datetime.timezone.utc)
+        .isoformat()
+    )
+
+    engine = get_engine()
+
+    logging.info("EduNotice outbox function started at %s", utc_timestamp)
+
+    success, error, counts = drain_outbox(engine)
+
+    if success:
+        logging.info("EduNotice outbox sent: %s" % (counts))
+    else:
+        logging.info("EduNotice outbox failed: %s" % (error))
+
+    logging.info("EduNotice outbox function finished at %s", utc_timestamp)
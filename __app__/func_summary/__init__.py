@@ -2,10 +2,8 @@ import datetime
 import logging
 import azure.functions as func
 
-from sqlalchemy import create_engine
-
 from edunotice.summary import summary_email
-from edunotice.constants import SQL_CONNECTION_STRING_DB
+from edunotice.db import get_engine
 
 
 class Namespace:
@@ -21,7 +19,7 @@ def main(mytimer: func.TimerRequest) -> None:
         .isoformat()
     )
 
-    engine = create_engine(SQL_CONNECTION_STRING_DB)
+    engine = get_engine()
 
     logging.info("EduNotice summary function started at %s", utc_timestamp)
 
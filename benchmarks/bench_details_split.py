@@ -0,0 +1,142 @@
+"""
+Benchmark of the per-subscription split of the crawl data used by
+    ingress._update_details.
+
+Compares the previous approach (boolean masking of the whole dataframe for
+every subscription) with the single sort and pass / row-offset index of
+update_edu_data and _update_details. Both run on normalised crawl data
+(crawl times as python datetimes) in the crawl order.
+
+Usage (from the repository root):
+    export ENS_TEST_MODE=true PYTHONPATH=__app__
+    python benchmarks/bench_details_split.py
+"""
+
+import time
+
+import pandas as pd
+
+from edunotice.ingress import (
+    _sort_edu_data,
+    _subscription_row_index,
+    _to_pydatetime,
+)
+
+from edunotice.constants import (
+    CONST_PD_COL_SUB_ID,
+    CONST_PD_COL_CRAWL_TIME_UTC,
+)
+
+BENCH_SIZES = [1000, 10000, 100000]
+BENCH_CRAWLS_PER_SUB = 5
+
+
+def _synthetic_df(num_rows):
+    """
+    Generates a minimal normalised crawl dataframe with num_rows rows:
+        every subscription appears in BENCH_CRAWLS_PER_SUB crawls. The rows
+        are in the crawl order, not sorted by subscription.
+    """
+
+    num_subs = max(1, num_rows // BENCH_CRAWLS_PER_SUB)
+
+    sub_ids = []
+    crawl_times = []
+
+    for row_id in range(num_rows):
+        sub_ids.append("sub-%08d" % (row_id % num_subs))
+        crawl_times.append(
+            "2020-10-%02d 07:28:23.821155"
+            % (1 + row_id // num_subs % 28)
+        )
+
+    return pd.DataFrame(
+        {
+            CONST_PD_COL_SUB_ID: sub_ids,
+            CONST_PD_COL_CRAWL_TIME_UTC: _to_pydatetime(
+                pd.to_datetime(pd.Series(crawl_times))
+            ),
+        }
+    )
+
+
+def _masking_split(eduhub_df):
+    """
+    The previous approach: one boolean mask per subscription.
+    """
+
+    count = 0
+
+    for sub_guid in eduhub_df[CONST_PD_COL_SUB_ID].unique():
+        sub_eduhub_df = eduhub_df[
+            eduhub_df[CONST_PD_COL_SUB_ID] == sub_guid
+        ].sort_values([CONST_PD_COL_CRAWL_TIME_UTC])
+
+        for _, row in sub_eduhub_df.iterrows():
+            count += 1
+
+    return count
+
+
+def _index_split(eduhub_df):
+    """
+    The current approach: one sort (update_edu_data) and one pass with
+        a row-offset index (_update_details).
+    """
+
+    count = 0
+
+    eduhub_df = eduhub_df.copy()
+    _sort_edu_data(eduhub_df)
+
+    records, sub_row_index = _subscription_row_index(eduhub_df)
+
+    for sub_guid in eduhub_df[CONST_PD_COL_SUB_ID].unique():
+        for row_pos in sub_row_index.get(sub_guid, []):
+            row = records[row_pos]
+            count += row is not None
+
+    return count
+
+
+def _time(func, eduhub_df):
+    """
+    Times a single call of func
+    """
+
+    start = time.perf_counter()
+    count = func(eduhub_df)
+    elapsed = time.perf_counter() - start
+
+    assert count == len(eduhub_df)
+
+    return elapsed
+
+
+def main():
+
+    print(
+        "%10s %14s %14s %14s"
+        % ("rows", "masking (s)", "index (s)", "index us/row")
+    )
+
+    for num_rows in BENCH_SIZES:
+        eduhub_df = _synthetic_df(num_rows)
+
+        index_time = _time(_index_split, eduhub_df)
+
+        # the masking approach is quadratic, skip it for the largest frame
+        if num_rows <= 10000:
+            masking_str = "%14.3f" % _time(_masking_split, eduhub_df)
+        else:
+            masking_str = "%14s" % "skipped"
+
+        print(
+            "%10d %s %14.3f %14.2f"
+            % (num_rows, masking_str, index_time,
+               index_time / num_rows * 1e6)
+        )
+
+
+if __name__ == "__main__":
+    main()
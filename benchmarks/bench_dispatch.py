@@ -0,0 +1,100 @@
+"""
+Benchmark of the email dispatch (sender.send_emails).
+
+Starts a local fake SendGrid server answering every request after a fixed
+    latency and sends a batch of emails through it, serially and with
+    a bounded pool of workers, one email per request and batched (emails
+    sharing a template in one request), reporting the throughput and the
+    number of requests of each.
+
+Usage (from the repository root):
+    export ENS_TEST_MODE=true PYTHONPATH=__app__:tests
+    python benchmarks/bench_dispatch.py [--emails 200] [--latency 0.05]
+        [--workers 1 4 8 16] [--templates 4] [--rate 0]
+"""
+
+import argparse
+import time
+
+import sendgrid
+
+from edunotice import sender
+from edunotice.constants import CONST_EMAIL_SUB_DETAILS_TAG
+from fake_sendgrid import FakeSendGrid
+
+
+def _messages(num_emails, num_templates):
+    """
+    Generates a batch of messages sharing num_templates templates
+    """
+
+    return [
+        (
+            "user%d@example.com" % (i),
+            "Benchmark message %d" % (i % num_templates),
+            "<html><body><p>Message %d</p>%s</body></html>"
+            % (i % num_templates, CONST_EMAIL_SUB_DETAILS_TAG),
+            {CONST_EMAIL_SUB_DETAILS_TAG: "<p>Subscription %d</p>" % (i)},
+        )
+        for i in range(num_emails)
+    ]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--emails", type=int, default=200)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.05,
+        help="response latency of the fake server (seconds)",
+    )
+    parser.add_argument(
+        "--workers", type=int, nargs="+", default=[1, 4, 8, 16]
+    )
+    parser.add_argument("--templates", type=int, default=4)
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0.0,
+        help="rate limit (requests per second, 0 - unlimited)",
+    )
+    args = parser.parse_args()
+
+    messages = _messages(args.emails, args.templates)
+
+    with FakeSendGrid(latency=args.latency) as fake_sg:
+        sender.SG_EMAIL_DISABLE = False
+        sender.SG_TEST_EMAIL = False
+        sender.SG_FROM_EMAIL = "from@example.com"
+        sender.SG_CLIENT = sendgrid.SendGridAPIClient(
+            api_key="test", host=fake_sg.host
+        )
+        sender.SG_BUCKET = sender.TokenBucket(args.rate)
+
+        for batch in (False, True):
+            for max_workers in args.workers:
+                num_requests = len(fake_sg.requests)
+
+                start = time.perf_counter()
+                results = sender.send_emails(
+                    messages, max_workers=max_workers, batch=batch
+                )
+                elapsed = time.perf_counter() - start
+
+                assert all(success for success, _ in results)
+
+                print(
+                    "batch=%-5s %2d worker(s): %d emails in %.2f s, "
+                    "%.1f emails/s, %d request(s)"
+                    % (batch, max_workers, len(messages), elapsed,
+                       len(messages) / elapsed,
+                       len(fake_sg.requests) - num_requests)
+                )
+
+        print("Counters: %s" % (sender.SEND_COUNTERS.snapshot()))
+
+
+if __name__ == "__main__":
+    main()
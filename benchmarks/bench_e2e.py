@@ -0,0 +1,376 @@
+"""
+End-to-end benchmark of the crawl pipeline (update_subscriptions) and the
+    summary (summary_email).
+
+For every scale (number of subscriptions), a fresh process creates
+    a temporary database, ingests a number of synthetic crawls (see
+    tests/synthetic.py) with update_subscriptions, sends the queued
+    notifications with drain_outbox after every crawl and then sends the
+    summary with summary_email. Emails are sent to a local fake SendGrid
+    server with a fixed latency (--latency). For every stage it reports the
+    wall time percentiles over the crawls, the throughput, the number of
+    database round trips and the peak RSS of the process at the end of the
+    stage. The results are stored as JSON, so runs can be compared over time.
+
+Usage (from the repository root, requires a local PostgreSQL server):
+    export ENS_TEST_MODE=true PYTHONPATH=__app__:tests
+    python benchmarks/bench_e2e.py [--scales 100 5000 50000] [--crawls 5]
+        [--latency 0] [--output bench_e2e.json]
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+BENCH_DBNAME = "edubenchdb"
+
+BENCH_SCALES = [100, 5000, 50000]
+
+BENCH_SEED = 42
+
+# time between the crawls and the summary
+BENCH_CRAWL_INTERVAL = timedelta(hours=2)
+
+
+class Namespace:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class _PeakRssHandler(logging.Handler):
+    """
+    Notes the peak RSS of the process whenever a stage is recorded
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.peak_rss = []
+
+    def emit(self, record):
+        self.peak_rss.append(_peak_rss_mb())
+
+
+def _peak_rss_mb():
+    """
+    Returns the peak resident set size of the process (MB)
+    """
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _percentile(values, percent):
+    """
+    Returns a percentile of the values (nearest rank)
+    """
+
+    values = sorted(values)
+
+    rank = max(1, math.ceil(percent / 100.0 * len(values)))
+
+    return values[rank - 1]
+
+
+def _stage_results(records, peak_rss):
+    """
+    Summarises the records of every stage over the runs
+    """
+
+    stages = {}
+
+    for record, rss in zip(records, peak_rss):
+        stage = stages.setdefault(
+            record["stage"],
+            {"wall_time": [], "db_round_trips": [], "rows": 0, "emails": 0,
+             "peak_rss_mb": 0.0},
+        )
+
+        stage["wall_time"].append(record["wall_time"])
+        stage["db_round_trips"].append(record["db_round_trips"])
+        stage["rows"] += record["rows"]
+        stage["emails"] += record["emails"]
+        stage["peak_rss_mb"] = max(stage["peak_rss_mb"], rss)
+
+    results = {}
+
+    for name, stage in stages.items():
+        wall_times = stage["wall_time"]
+        total_time = sum(wall_times)
+
+        results[name] = {
+            "runs": len(wall_times),
+            "wall_time_total": total_time,
+            "wall_time_p50": _percentile(wall_times, 50),
+            "wall_time_p95": _percentile(wall_times, 95),
+            "wall_time_max": max(wall_times),
+            "rows": stage["rows"],
+            "rows_per_s": stage["rows"] / total_time if total_time else None,
+            "emails": stage["emails"],
+            "emails_per_s": (
+                stage["emails"] / total_time if total_time else None
+            ),
+            "db_round_trips_total": sum(stage["db_round_trips"]),
+            "db_round_trips_max": max(stage["db_round_trips"]),
+            "peak_rss_mb": stage["peak_rss_mb"],
+        }
+
+    return results
+
+
+def _fake_sendgrid(latency):
+    """
+    Starts a fake SendGrid server and points the sender at it
+    """
+
+    import sendgrid
+
+    from edunotice import sender
+    from fake_sendgrid import FakeSendGrid
+
+    fake_sg = FakeSendGrid(latency=latency).__enter__()
+
+    sender.SG_EMAIL_DISABLE = False
+    sender.SG_TEST_EMAIL = False
+    sender.SG_FROM_EMAIL = "from@example.com"
+    sender.SG_SUMMARY_RECIPIENTS = "summary@example.com"
+    sender.SG_CLIENT = sendgrid.SendGridAPIClient(
+        api_key="test", host=fake_sg.host
+    )
+    sender.SG_BUCKET = sender.TokenBucket(0)
+
+    return fake_sg
+
+
+def _run_scale(num_subs, num_crawls, latency):
+    """
+    Runs the benchmark of a scale in the current process.
+
+    Returns:
+        results - dictionary of the scale results
+    """
+
+    from sqlalchemy import create_engine
+
+    from edunotice.constants import SQL_CONNECTION_STRING
+    from edunotice.db import create_db, drop_db
+    from edunotice.edunotice import update_subscriptions
+    from edunotice.metrics import Metrics
+    from edunotice.outbox import drain_outbox
+    from edunotice.summary import summary_email
+    from synthetic import SyntheticEduHub
+
+    fake_sg = _fake_sendgrid(latency)
+
+    rss_handler = _PeakRssHandler()
+    metrics_logger = logging.getLogger("edunotice.metrics")
+    metrics_logger.addHandler(rss_handler)
+    metrics_logger.setLevel(logging.INFO)
+
+    eduhub = SyntheticEduHub(
+        num_subs=num_subs,
+        crawl_interval=BENCH_CRAWL_INTERVAL,
+        days=num_crawls * BENCH_CRAWL_INTERVAL / timedelta(days=1),
+        seed=BENCH_SEED,
+    )
+
+    success, error = create_db(db_name=BENCH_DBNAME)
+    assert success, error
+
+    engine = create_engine("%s/%s" % (SQL_CONNECTION_STRING, BENCH_DBNAME))
+
+    metrics = Metrics()
+    crawl_times = []
+    num_rows = 0
+
+    try:
+        for crawl_idx, crawl_df in enumerate(eduhub.crawls()):
+            timestamp_utc = (
+                eduhub.start + (crawl_idx + 1) * BENCH_CRAWL_INTERVAL
+            ).replace(tzinfo=timezone.utc)
+
+            num_rows += len(crawl_df)
+
+            start = time.perf_counter()
+            success, error, _ = update_subscriptions(
+                engine,
+                Namespace(input_df=crawl_df),
+                timestamp_utc=timestamp_utc,
+                metrics=metrics,
+            )
+            crawl_times.append(time.perf_counter() - start)
+
+            assert success, error
+
+            # the outbox function sends the queued notifications
+            with metrics.stage("send", engine) as record:
+                success, error, sent_counts = drain_outbox(
+                    engine, timestamp_utc=timestamp_utc
+                )
+                record["emails"] = sum(sent_counts.values())
+
+            assert success, error
+
+        with metrics.stage("summary", engine) as record:
+            success, error = summary_email(engine, timestamp_utc=timestamp_utc)
+            record["emails"] = 1
+
+        assert success, error
+    finally:
+        engine.dispose()
+        drop_db(db_name=BENCH_DBNAME)
+
+        fake_sg.__exit__(None, None, None)
+
+    stages = _stage_results(metrics.stages, rss_handler.peak_rss)
+
+    stages["update_subscriptions"] = {
+        "runs": len(crawl_times),
+        "wall_time_total": sum(crawl_times),
+        "wall_time_p50": _percentile(crawl_times, 50),
+        "wall_time_p95": _percentile(crawl_times, 95),
+        "wall_time_max": max(crawl_times),
+        "rows": num_rows,
+        "rows_per_s": num_rows / sum(crawl_times),
+        "db_round_trips_total": sum(
+            record["db_round_trips"]
+            for record in metrics.stages
+            if record["stage"] not in ("send", "summary")
+        ),
+    }
+
+    return {
+        "subscriptions": num_subs,
+        "crawls": len(crawl_times),
+        "rows": num_rows,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": stages,
+    }
+
+
+def _git_commit():
+    """
+    Returns the current git commit (None if not available)
+    """
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_scale(results):
+    """
+    Prints the results of a scale
+    """
+
+    print("=" * 79)
+    print(
+        "%d subscriptions, %d crawls, %d rows, peak RSS %.0f MB"
+        % (results["subscriptions"], results["crawls"], results["rows"],
+           results["peak_rss_mb"])
+    )
+    print(
+        "    %-22s %9s %9s %9s %10s %10s %8s"
+        % ("stage", "p50 (s)", "p95 (s)", "total (s)", "rows/s",
+           "emails/s", "queries")
+    )
+
+    for name, stage in results["stages"].items():
+        print(
+            "    %-22s %9.3f %9.3f %9.3f %10s %10s %8d"
+            % (
+                name,
+                stage["wall_time_p50"],
+                stage["wall_time_p95"],
+                stage["wall_time_total"],
+                "%.0f" % stage["rows_per_s"] if stage["rows_per_s"] else "-",
+                "%.0f" % stage["emails_per_s"]
+                if stage.get("emails_per_s") else "-",
+                stage["db_round_trips_total"],
+            )
+        )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--scales", type=int, nargs="+", default=BENCH_SCALES)
+    parser.add_argument("--crawls", type=int, default=5)
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.0,
+        help="response latency of the fake SendGrid server (seconds)",
+    )
+    parser.add_argument("--output", default="bench_e2e.json")
+    # runs a single scale in this process and writes its results to a file
+    parser.add_argument("--run-scale", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--results", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scale is not None:
+        results = _run_scale(args.run_scale, args.crawls, args.latency)
+
+        with open(args.results, "w") as results_file:
+            json.dump(results, results_file)
+
+        return
+
+    # every scale runs in a fresh process, so the peak RSS is its own
+    env = dict(os.environ, ENS_VERBOSE_LEVEL="0")
+
+    report = {
+        "timestamp_utc": datetime.now(timezone.utc).isoformat(),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "crawls": args.crawls,
+        "latency": args.latency,
+        "scales": {},
+    }
+
+    for num_subs in args.scales:
+        with tempfile.NamedTemporaryFile(suffix=".json") as results_file:
+            subprocess.run(
+                [
+                    sys.executable,
+                    __file__,
+                    "--run-scale", str(num_subs),
+                    "--crawls", str(args.crawls),
+                    "--latency", str(args.latency),
+                    "--results", results_file.name,
+                ],
+                env=env,
+                # sender and service messages are not reported
+                stdout=subprocess.DEVNULL,
+                check=True,
+            )
+
+            with open(results_file.name) as scale_file:
+                results = json.load(scale_file)
+
+        _print_scale(results)
+
+        report["scales"][str(num_subs)] = results
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+
+    print("Results written to %s" % (args.output))
+
+
+if __name__ == "__main__":
+    main()
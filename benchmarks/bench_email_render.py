@@ -0,0 +1,157 @@
+"""
+Benchmark of the individual email rendering (notifications.indiv_email_*).
+
+Renders a batch of new subscription, update, expiry and usage emails and
+    reports the per-email cost. A previous version of the notifications
+    module can be passed as a baseline to compare against, e.g.:
+
+    git show <rev>:__app__/edunotice/notifications.py > /tmp/baseline.py
+
+Usage (from the repository root):
+    export ENS_TEST_MODE=true PYTHONPATH=__app__
+    python benchmarks/bench_email_render.py [--emails 20000]
+        [--baseline /tmp/baseline.py]
+"""
+
+import argparse
+import importlib.util
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from edunotice import notifications
+from edunotice.utilities import IdIndex
+
+BENCH_NUM_LABS = 50
+BENCH_EXPIRY_DATE = datetime(2021, 10, 1)
+
+
+def _details(sub_id, users, budget, consumed, expiry_days, status="Enabled"):
+    """
+    Generates a details entry of a subscription
+    """
+
+    return SimpleNamespace(
+        id=sub_id,
+        sub_id=sub_id,
+        lab_id=1 + sub_id % BENCH_NUM_LABS,
+        handout_name="Handout %d" % (sub_id),
+        handout_status="done",
+        handout_budget=budget,
+        handout_consumed=consumed,
+        subscription_name="Subscription %d" % (sub_id),
+        subscription_status=status,
+        subscription_expiry_date=(
+            BENCH_EXPIRY_DATE + timedelta(days=expiry_days)
+        ),
+        subscription_users=users,
+    )
+
+
+def _synthetic_batch(num_emails):
+    """
+    Generates a batch of emails to render: a quarter of each kind.
+    """
+
+    lab_dict = IdIndex()
+    for lab_id in range(1, BENCH_NUM_LABS + 1):
+        course_name = "Course %d" % (lab_id % 5)
+        lab_dict.update({(course_name, "Lab %d" % (lab_id)): lab_id})
+
+    sub_dict = IdIndex()
+    for sub_id in range(num_emails):
+        sub_dict.update({"bench-%08d" % (sub_id): sub_id})
+
+    batch = []
+
+    for sub_id in range(num_emails):
+        users = "user%d@example.com,owner@example.com" % (sub_id)
+        details = _details(sub_id, users, 1000.0, 510.0, 30)
+
+        kind = sub_id % 4
+
+        if kind == 0:
+            batch.append(("indiv_email_new", (details,)))
+        elif kind == 1:
+            prev_details = _details(
+                sub_id, "owner@example.com", 500.0, 400.0, 0
+            )
+            batch.append(("indiv_email_upd", ((prev_details, details),)))
+        elif kind == 2:
+            batch.append(("indiv_email_expiry_notification", (details, 7)))
+        else:
+            batch.append(("indiv_email_usage_notification", (details, 50)))
+
+    return lab_dict, sub_dict, batch
+
+
+def _time(module, lab_dict, sub_dict, batch):
+    """
+    Renders the whole batch with the given notifications module
+    """
+
+    total_size = 0
+
+    start = time.perf_counter()
+
+    for func_name, args in batch:
+        success, error, html_content = getattr(module, func_name)(
+            lab_dict, sub_dict, *args
+        )
+
+        assert success, error
+
+        total_size += len(html_content)
+
+    return time.perf_counter() - start, total_size
+
+
+def _load_module(file_path):
+    """
+    Loads a notifications module from a file
+    """
+
+    spec = importlib.util.spec_from_file_location(
+        "baseline_notifications", file_path
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    return module
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--emails", type=int, default=20000)
+    parser.add_argument("--baseline", default=None)
+    args = parser.parse_args()
+
+    lab_dict, sub_dict, batch = _synthetic_batch(args.emails)
+
+    results = []
+
+    if args.baseline is not None:
+        baseline = _load_module(args.baseline)
+        results.append(
+            ("baseline",) + _time(baseline, lab_dict, sub_dict, batch)
+        )
+
+    results.append(
+        ("current",) + _time(notifications, lab_dict, sub_dict, batch)
+    )
+
+    # both versions have to render the same emails
+    assert len(set(total_size for _, _, total_size in results)) == 1
+
+    print("Rendered %d emails" % (args.emails))
+    print("%12s %12s %14s" % ("version", "time (s)", "us/email"))
+    for name, elapsed, _ in results:
+        print(
+            "%12s %12.3f %14.2f"
+            % (name, elapsed, elapsed / args.emails * 1e6)
+        )
+
+
+if __name__ == "__main__":
+    main()
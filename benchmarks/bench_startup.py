@@ -0,0 +1,137 @@
+"""
+Benchmark of the import (cold start) time of the function modules.
+
+Imports every module in a fresh interpreter with `python -X importtime`,
+    reports the median cumulative import time and the slowest imported
+    packages, and fails if a module exceeds the time budget. The modules are
+    imported without the database settings (ENS_SQL_*), as on a cold start.
+
+Usage (from the repository root):
+    export PYTHONPATH=__app__
+    python benchmarks/bench_startup.py [--runs 5] [--budget 500]
+        [--modules edunotice.edunotice edunotice.summary]
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+BENCH_MODULES = ["edunotice.edunotice", "edunotice.summary"]
+
+# import time budget of a module (milliseconds)
+BENCH_BUDGET_MS = 500
+
+IMPORTTIME_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def _import_times(module):
+    """
+    Imports a module in a fresh interpreter
+
+    Returns:
+        times - a dictionary of cumulative import times (us) of the
+            module and of every top level package imported
+    """
+
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.startswith("ENS_")
+    }
+
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import %s" % (module)],
+        env=env,
+        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        universal_newlines=True,
+    )
+
+    if process.returncode != 0:
+        raise RuntimeError(
+            "Importing %s failed:\n%s" % (module, process.stderr)
+        )
+
+    times = {}
+
+    # children are listed before their parents (indented one level more):
+    #   walking backwards, the stack holds the enclosing imports
+    stack = []
+
+    for line in reversed(process.stderr.splitlines()):
+        match = IMPORTTIME_RE.match(line)
+
+        if match is None:
+            continue
+
+        cumulative = int(match.group(2))
+        indent = len(match.group(3))
+        name = match.group(4)
+        package = name.split(".")[0]
+
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+
+        # time of a package, not counting its imports from within itself
+        if all(parent != package for _, parent in stack):
+            times[package] = times.get(package, 0) + cumulative
+
+        stack.append((indent, package))
+
+        if name == module:
+            times[module] = cumulative
+
+    return times
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=BENCH_BUDGET_MS,
+        help="import time budget of a module (ms)",
+    )
+    parser.add_argument("--modules", nargs="+", default=BENCH_MODULES)
+    args = parser.parse_args()
+
+    over_budget = []
+
+    for module in args.modules:
+        runs = [_import_times(module) for _ in range(args.runs)]
+
+        median_ms = statistics.median(run[module] for run in runs) / 1000
+
+        print("=" * 79)
+        print(
+            "%s: %.1f ms (median of %d runs, budget %.0f ms)"
+            % (module, median_ms, args.runs, args.budget)
+        )
+
+        packages = sorted(
+            (
+                (statistics.median(run.get(name, 0) for run in runs), name)
+                for name in runs[0]
+                if name != module and name != module.split(".")[0]
+            ),
+            reverse=True,
+        )
+
+        for time_us, name in packages[:8]:
+            print("    %-30s %8.1f ms" % (name, time_us / 1000))
+
+        if median_ms > args.budget:
+            over_budget.append(module)
+
+    if over_budget:
+        print("Over the budget: %s" % (", ".join(over_budget)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+Benchmark of the summary queries on a year of two-hourly crawls.
+
+Creates a temporary database, fills it with synthetic details history and
+    the delivered outbox entries of its notifications, runs the summary.py
+    queries and reports the timing and the query plan
+    (EXPLAIN ANALYZE) of every statement they issue.
+
+Usage (from the repository root, requires a local PostgreSQL server):
+    export ENS_TEST_MODE=true PYTHONPATH=__app__
+    python benchmarks/bench_summary_queries.py [--subs 200] [--days 365]
+        [--no-indexes]
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, event, text
+
+from edunotice.constants import SQL_CONNECTION_STRING
+from edunotice.db import create_db, drop_db
+from edunotice.structure import DetailsClass, OutboxClass
+from edunotice.summary import (
+    _find_new_subs,
+    _find_upd_subs,
+    _find_sent_notifications,
+)
+
+BENCH_DBNAME = "edubenchdb"
+
+BENCH_START = datetime(2020, 1, 1)
+BENCH_CRAWLS_PER_DAY = 12
+
+# every subscription is updated once a month, budget/usage notifications
+#   are sent at the same crawls
+BENCH_UPDATE_PERIOD = 360
+
+FILL_SQL = """
+INSERT INTO course (name) VALUES ('Benchmark course');
+
+INSERT INTO lab (course_id, name)
+SELECT id, 'Benchmark lab' FROM course;
+
+INSERT INTO subscription (guid)
+SELECT 'bench-' || s FROM generate_series(1, :subs) s;
+
+INSERT INTO details (
+    sub_id, lab_id, handout_name, handout_status, handout_budget,
+    handout_consumed, subscription_name, subscription_status,
+    subscription_expiry_date, subscription_users, timestamp_utc,
+    new_flag, new_notice_sent, update_flag, update_notice_sent,
+    usage_code, usage_notice_sent
+)
+SELECT
+    sub.id,
+    lab.id,
+    'Handout ' || sub.id,
+    'done',
+    1000.0,
+    c * 0.2,
+    'Subscription ' || sub.id,
+    'Active',
+    CAST(:start AS timestamp) + interval '400 days',
+    'user' || sub.id || '@example.com',
+    CAST(:start AS timestamp) + c * interval '2 hours',
+    c = 0,
+    CASE WHEN c = 0 THEN
+        CAST(:start AS timestamp) + c * interval '2 hours' END,
+    c > 0 AND c % :period = sub.id % :period,
+    CASE WHEN c > 0 AND c % :period = sub.id % :period THEN
+        CAST(:start AS timestamp) + c * interval '2 hours' END,
+    CASE WHEN c > 0 AND c % :period = sub.id % :period THEN 50 END,
+    CASE WHEN c > 0 AND c % :period = sub.id % :period THEN
+        CAST(:start AS timestamp) + c * interval '2 hours' END
+FROM subscription sub, lab, generate_series(0, :crawls - 1) c;
+
+INSERT INTO outbox (
+    details_id, sub_id, notice, notice_code, to_str, subject, html_content,
+    timestamp_utc, attempts, sent
+)
+SELECT
+    id, sub_id, notice, notice_code, subscription_users, 'Benchmark',
+    '<p>Benchmark</p>', sent, 1, sent
+FROM (
+    SELECT id, sub_id, 'new' AS notice, CAST(NULL AS integer) AS notice_code,
+        subscription_users, new_notice_sent AS sent
+    FROM details WHERE new_notice_sent IS NOT NULL
+    UNION ALL
+    SELECT id, sub_id, 'update', NULL, subscription_users, update_notice_sent
+    FROM details WHERE update_notice_sent IS NOT NULL
+    UNION ALL
+    SELECT id, sub_id, 'usage', usage_code, subscription_users,
+        usage_notice_sent
+    FROM details WHERE usage_notice_sent IS NOT NULL
+) notices
+ORDER BY sent;
+
+ANALYZE;
+"""
+
+
+def _fill_db(engine, num_subs, num_days):
+    """
+    Fills the database with synthetic details history and the delivered
+        outbox entries of its notifications
+    """
+
+    with engine.begin() as conn:
+        conn.execute(
+            text(FILL_SQL),
+            {
+                "subs": num_subs,
+                "crawls": num_days * BENCH_CRAWLS_PER_DAY,
+                "start": BENCH_START,
+                "period": BENCH_UPDATE_PERIOD,
+            },
+        )
+
+        num_rows = conn.execute(text("SELECT count(*) FROM details")).scalar()
+        num_sent = conn.execute(text("SELECT count(*) FROM outbox")).scalar()
+
+    return num_rows, num_sent
+
+
+def _drop_indexes(engine):
+    """
+    Drops the details and outbox indexes (apart from the unique constraint
+        and the primary keys)
+    """
+
+    with engine.begin() as conn:
+        for table in (DetailsClass.__table__, OutboxClass.__table__):
+            for index in table.indexes:
+                conn.execute(text("DROP INDEX %s" % (index.name)))
+
+        conn.execute(text("ANALYZE"))
+
+
+def _run_query(engine, name, func, prev_timestamp_utc):
+    """
+    Runs a summary query, captures all the statements it issues and
+        reports the timing and their query plans.
+    """
+
+    statements = []
+
+    def _capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", _capture)
+
+    start = time.perf_counter()
+    success, error, result = func(engine, prev_timestamp_utc)
+    elapsed = time.perf_counter() - start
+
+    event.remove(engine, "before_cursor_execute", _capture)
+
+    assert success, error
+
+    print("=" * 79)
+    print(
+        "%s: %.3f s, %d statement(s), %d result(s)"
+        % (name, elapsed, len(statements), len(result))
+    )
+
+    # plans of the distinct statements
+    explained = set()
+
+    with engine.connect() as conn:
+        for statement, parameters in statements:
+            if statement in explained:
+                continue
+            explained.add(statement)
+
+            plan = conn.exec_driver_sql(
+                "EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters
+            ).fetchall()
+
+            print("-" * 79)
+            print(statement.strip())
+            for (line,) in plan:
+                print("    " + line)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--subs", type=int, default=200)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument(
+        "--no-indexes",
+        action="store_true",
+        help="drop the details and outbox indexes to compare the query "
+        "plans",
+    )
+    args = parser.parse_args()
+
+    success, error = create_db(db_name=BENCH_DBNAME)
+    assert success, error
+
+    engine = create_engine("%s/%s" % (SQL_CONNECTION_STRING, BENCH_DBNAME))
+
+    try:
+        start = time.perf_counter()
+        num_rows, num_sent = _fill_db(engine, args.subs, args.days)
+        print(
+            "Loaded %d details rows and %d sent notifications "
+            "(%d subscriptions, %d days) in %.1f s"
+            % (
+                num_rows,
+                num_sent,
+                args.subs,
+                args.days,
+                time.perf_counter() - start,
+            )
+        )
+
+        if args.no_indexes:
+            _drop_indexes(engine)
+
+        # the last summary was sent a day before the last crawl
+        prev_timestamp_utc = (
+            BENCH_START + timedelta(days=args.days - 1)
+        ).replace(tzinfo=timezone.utc)
+
+        _run_query(engine, "_find_new_subs", _find_new_subs,
+                   prev_timestamp_utc)
+        _run_query(engine, "_find_upd_subs", _find_upd_subs,
+                   prev_timestamp_utc)
+        _run_query(engine, "_find_sent_notifications",
+                   _find_sent_notifications, prev_timestamp_utc)
+    finally:
+        engine.dispose()
+        drop_db(db_name=BENCH_DBNAME)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Benchmark of the summary email rendering (notifications.summary).
+
+Renders a summary of new, updated and notified subscriptions and compares
+    the id -> name lookups through the IdIndex inverted index with the
+    previous linear scans of the dictionary keys/values.
+
+Usage (from the repository root):
+    export ENS_TEST_MODE=true PYTHONPATH=__app__
+    python benchmarks/bench_summary_render.py [--subs 5000]
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from edunotice.notifications import summary
+from edunotice.utilities import IdIndex
+
+BENCH_NUM_LABS = 50
+BENCH_TIMESTAMP = datetime(2020, 10, 1, tzinfo=timezone.utc)
+
+
+class _LinearIndex(IdIndex):
+    """
+    The previous lookup: two full lists and a linear scan per lookup.
+    """
+
+    def name_of(self, internal_id):
+        return list(self.keys())[list(self.values()).index(internal_id)]
+
+
+def _details(sub_id, lab_id, consumed, expiry_days):
+    """
+    Generates a details entry of a subscription
+    """
+
+    return SimpleNamespace(
+        id=sub_id,
+        sub_id=sub_id,
+        lab_id=lab_id,
+        handout_name="Handout %d" % (sub_id),
+        handout_status="done",
+        handout_budget=1000.0,
+        handout_consumed=consumed,
+        subscription_name="Subscription %d" % (sub_id),
+        subscription_status="Enabled",
+        subscription_expiry_date=BENCH_TIMESTAMP + timedelta(expiry_days),
+        subscription_users="user%d@example.com" % (sub_id),
+        new_notice_sent=None,
+        update_notice_sent=BENCH_TIMESTAMP,
+        expiry_notice_sent=None,
+        expiry_code=None,
+        usage_notice_sent=BENCH_TIMESTAMP,
+        usage_code=50,
+    )
+
+
+def _synthetic_summary(num_subs):
+    """
+    Generates lab/subscription dictionaries and summary lists: a tenth of
+        the subscriptions are new, the rest were updated and notified.
+    """
+
+    lab_dict = {}
+    for lab_id in range(1, BENCH_NUM_LABS + 1):
+        course_name = "Course %d" % (lab_id % 5)
+        lab_dict.update({(course_name, "Lab %d" % (lab_id)): lab_id})
+
+    sub_dict = {}
+    for sub_id in range(1, num_subs + 1):
+        sub_dict.update({"bench-%08d" % (sub_id): sub_id})
+
+    new_sub_list = []
+    upd_sub_list = []
+    sent_noti_list = []
+
+    for sub_id in range(1, num_subs + 1):
+        lab_id = 1 + sub_id % BENCH_NUM_LABS
+
+        if sub_id % 10 == 0:
+            new_sub_list.append(_details(sub_id, lab_id, 0.0, 90))
+        else:
+            prev_details = _details(sub_id, lab_id, 400.0, 90)
+            new_details = _details(sub_id, lab_id, 600.0, 120)
+
+            upd_sub_list.append((prev_details, new_details))
+            sent_noti_list.append(new_details)
+
+    return lab_dict, sub_dict, new_sub_list, upd_sub_list, sent_noti_list
+
+
+def _time(index_class, lab_dict, sub_dict, lists):
+    """
+    Times a single summary rendering
+    """
+
+    start = time.perf_counter()
+
+    success, error, html_content = summary(
+        index_class(lab_dict),
+        index_class(sub_dict),
+        *lists,
+        BENCH_TIMESTAMP - timedelta(days=1),
+        BENCH_TIMESTAMP,
+    )
+
+    elapsed = time.perf_counter() - start
+
+    assert success, error
+
+    return elapsed, len(html_content)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--subs", type=int, default=5000)
+    args = parser.parse_args()
+
+    lab_dict, sub_dict, *lists = _synthetic_summary(args.subs)
+
+    index_time, index_len = _time(IdIndex, lab_dict, sub_dict, lists)
+    linear_time, linear_len = _time(_LinearIndex, lab_dict, sub_dict, lists)
+
+    assert index_len == linear_len
+
+    print("Summary of %d subscriptions (%d bytes)" % (args.subs, index_len))
+    print("%12s %12s %14s" % ("lookup", "time (s)", "us/sub"))
+    for name, elapsed in [("linear", linear_time), ("IdIndex", index_time)]:
+        print(
+            "%12s %12.3f %14.2f"
+            % (name, elapsed, elapsed / args.subs * 1e6)
+        )
+
+
+if __name__ == "__main__":
+    main()
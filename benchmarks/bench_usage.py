@@ -0,0 +1,171 @@
+"""
+Benchmark of the usage threshold evaluation (budget.notify_usage).
+
+Creates a temporary database with a number of subscriptions, some of them
+    already notified about their usage, and finds the updated subscriptions
+    to be notified about their usage one by one (a usage code check and
+    a query per subscription) and in a single pass (budget._usage_candidates),
+    reporting the timing and the number of statements of each.
+
+Usage (from the repository root, requires a local PostgreSQL server):
+    export ENS_TEST_MODE=true PYTHONPATH=__app__
+    python benchmarks/bench_usage.py [--subs 10000]
+"""
+
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine, event, text
+
+from edunotice.constants import SQL_CONNECTION_STRING, CONST_SUB_CANCELLED
+from edunotice.db import create_db, drop_db, session_open, session_close
+from edunotice.structure import DetailsClass, SubscriptionClass
+from edunotice.budget import _usage_codes, _usage_candidates
+
+BENCH_DBNAME = "edubenchdb"
+
+BENCH_SEED = 42
+
+FILL_SQL = """
+INSERT INTO subscription (guid, usage_code)
+SELECT
+    'bench-' || s,
+    CASE s % 4 WHEN 1 THEN 50 WHEN 2 THEN 75 END
+FROM generate_series(1, :subs) s;
+
+ANALYZE;
+"""
+
+
+def _upd_sub_list(engine, num_subs):
+    """
+    Generates the updated subscriptions details with random usages
+    """
+
+    rng = random.Random(BENCH_SEED)
+
+    with engine.connect() as conn:
+        sub_ids = [
+            row[0]
+            for row in conn.execute(
+                text("SELECT id FROM subscription ORDER BY id")
+            )
+        ]
+
+    upd_sub_list = []
+
+    for sub_id in sub_ids[:num_subs]:
+        details = DetailsClass(
+            sub_id=sub_id,
+            subscription_name="Subscription %d" % (sub_id),
+            subscription_status=(
+                CONST_SUB_CANCELLED if rng.random() < 0.05 else "Active"
+            ),
+            handout_budget=rng.choice([0.0, 100.0, 500.0, 1000.0]),
+            handout_consumed=rng.uniform(0.0, 1000.0),
+        )
+
+        upd_sub_list.append((details, details))
+
+    return upd_sub_list
+
+
+def _per_row_candidates(session, upd_sub_list):
+    """
+    Finds the subscriptions to be notified one by one
+        (the former notify_usage loop)
+    """
+
+    candidates = []
+
+    for _, new_details in upd_sub_list:
+
+        if (
+            new_details.subscription_status.lower()
+            == CONST_SUB_CANCELLED.lower()
+        ):
+            continue
+
+        usage_code = _usage_codes(
+            [new_details.handout_budget], [new_details.handout_consumed]
+        )[0]
+
+        if usage_code == 0:
+            continue
+
+        sub_latest_noti_code = (
+            session.query(SubscriptionClass)
+            .filter(SubscriptionClass.id == new_details.sub_id)
+            .first()
+            .usage_code
+        )
+
+        if sub_latest_noti_code is None or usage_code > sub_latest_noti_code:
+            candidates.append((new_details, usage_code))
+
+    return candidates
+
+
+def _run(engine, name, func, upd_sub_list):
+    """
+    Finds the subscriptions to be notified and reports the timing and
+        the number of statements issued
+    """
+
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _count)
+
+    session = session_open(engine)
+
+    start = time.perf_counter()
+    candidates = func(session, upd_sub_list)
+    elapsed = time.perf_counter() - start
+
+    session_close(session)
+
+    event.remove(engine, "before_cursor_execute", _count)
+
+    print(
+        "%-20s %d subscriptions in %.3f s, %d statement(s), %d to notify"
+        % (name, len(upd_sub_list), elapsed, len(statements),
+           len(candidates))
+    )
+
+    return [(details.sub_id, code) for details, code in candidates]
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--subs", type=int, default=10000)
+    args = parser.parse_args()
+
+    success, error = create_db(db_name=BENCH_DBNAME)
+    assert success, error
+
+    engine = create_engine("%s/%s" % (SQL_CONNECTION_STRING, BENCH_DBNAME))
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(FILL_SQL), {"subs": args.subs})
+
+        upd_sub_list = _upd_sub_list(engine, args.subs)
+
+        per_row = _run(engine, "one by one:", _per_row_candidates,
+                       upd_sub_list)
+        single_pass = _run(engine, "single pass:", _usage_candidates,
+                           upd_sub_list)
+
+        assert per_row == single_pass
+    finally:
+        engine.dispose()
+        drop_db(db_name=BENCH_DBNAME)
+
+
+if __name__ == "__main__":
+    main()
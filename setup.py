@@ -149,9 +149,9 @@ setup(
     # https://packaging.python.org/en/latest/requirements.html
     install_requires=[
         'pandas>=0.25.3',
-        'sqlalchemy>=1.3.12',
+        'numpy>=1.17',
+        'sqlalchemy>=1.4',
         'SQLAlchemy-Utils==0.36.3',
-        'flask-sqlalchemy>=2.4.1',
         'sendgrid>=6.4.7',
         'educrawler>=0.5.9',
         'psycopg2-binary>=2.8.4',
@@ -1,3 +1,7 @@
+from contextlib import contextmanager
+
+import pytest
+
 from edunotice.constants import (
     TEST_MODE,
     SQL_TEST_DBNAME1,
@@ -7,8 +11,10 @@ from edunotice.constants import (
     SQL_TEST_DBNAME5,
     SQL_TEST_DBNAME6,
     SQL_TEST_DBNAME7,
+    SQL_TEST_DBNAME8,
+    SQL_TEST_DBNAME9,
 )
-from edunotice.db import create_db, drop_db
+from edunotice.db import create_db, drop_db, QueryProfiler
 
 
 def pytest_configure(config):
@@ -50,6 +56,14 @@ def pytest_configure(config):
     success, log = create_db(db_name=SQL_TEST_DBNAME7)
     assert success, log
 
+    # creates test db 8
+    success, log = create_db(db_name=SQL_TEST_DBNAME8)
+    assert success, log
+
+    # creates test db 9
+    success, log = create_db(db_name=SQL_TEST_DBNAME9)
+    assert success, log
+
     print("pytest_configure: end")
 
 
@@ -90,4 +104,38 @@ def pytest_unconfigure(config):
     success, log = drop_db(db_name=SQL_TEST_DBNAME7)
     assert success, log
 
+    # drops test db 8
+    success, log = drop_db(db_name=SQL_TEST_DBNAME8)
+    assert success, log
+
+    # drops test db 9
+    success, log = drop_db(db_name=SQL_TEST_DBNAME9)
+    assert success, log
+
     print("pytest_unconfigure: end")
+
+
+@pytest.fixture
+def query_budget():
+    """
+    Returns a context manager profiling the statements of an operation,
+        which fails the test if the operation issues more statements than
+        its budget, e.g.:
+
+        with query_budget(ENGINE, "update_edu_data", 10):
+            update_edu_data(ENGINE, eduhub_df)
+    """
+
+    @contextmanager
+    def _query_budget(engine, name, max_statements):
+        profiler = QueryProfiler(engine)
+
+        with profiler.operation(name) as stats:
+            yield stats
+
+        assert stats["statements"] <= max_statements, (
+            "%s exceeded its query budget (%d):\n%s"
+            % (name, max_statements, profiler.report())
+        )
+
+    return _query_budget
@@ -0,0 +1,151 @@
+"""
+A local fake of the SendGrid v3 mail/send endpoint, used to test and
+    benchmark email dispatch offline. Error responses (e.g. 429, 5xx) can be
+    injected for the following requests, or for the requests sent to
+    a recipient.
+
+Usage:
+    with FakeSendGrid(latency=0.05) as fake_sg:
+        client = sendgrid.SendGridAPIClient(api_key="test", host=fake_sg.host)
+        fake_sg.inject(429, {"Retry-After": "1"})
+        fake_sg.reject("invalid@example.com", 400)
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    Accepts POST /v3/mail/send requests and records their bodies, or
+        responds with an injected error
+    """
+
+    def do_POST(self):
+        fake_sg = self.server.fake_sg
+
+        body = json.loads(
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            or b"{}"
+        )
+
+        recipients = [
+            to["email"]
+            for personalization in body.get("personalizations", [])
+            for to in personalization.get("to", [])
+        ]
+
+        if fake_sg.latency > 0:
+            time.sleep(fake_sg.latency)
+
+        with fake_sg.lock:
+            rejected_status = [
+                fake_sg.rejected_recipients[x]
+                for x in recipients
+                if x in fake_sg.rejected_recipients
+            ]
+
+            if fake_sg.errors:
+                status, headers = fake_sg.errors.pop(0)
+                fake_sg.rejected.append((status, self.path))
+            elif rejected_status:
+                status, headers = rejected_status[0], {}
+                fake_sg.rejected.append((status, self.path))
+            else:
+                status, headers = 202, {}
+                fake_sg.requests.append((self.path, body))
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        # keeps the test output clean
+        pass
+
+
+class FakeSendGrid:
+    """
+    Fake SendGrid server running in a background thread
+    """
+
+    def __init__(self, latency=0.0):
+        """
+        Arguments:
+            latency - seconds to wait before responding to a request
+        """
+
+        self.latency = latency
+        self.lock = threading.Lock()
+
+        # accepted requests: tuples (path, body)
+        self.requests = []
+
+        # error responses to be sent: tuples (status, headers),
+        #   and the rejected requests: tuples (status, path)
+        self.errors = []
+        self.rejected = []
+
+        # recipient/status code of the requests to be rejected
+        self.rejected_recipients = {}
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake_sg = self
+
+        self._thread = None
+
+    @property
+    def host(self):
+        """
+        Base url of the fake server
+        """
+
+        return "http://127.0.0.1:%d" % (self._server.server_address[1])
+
+    def inject(self, status, headers=None, times=1):
+        """
+        Responds to the following requests with an error
+
+        Arguments:
+            status - http status code
+            headers - response headers
+            times - number of requests to respond to with the error
+        """
+
+        with self.lock:
+            self.errors.extend([(status, headers or {})] * times)
+
+    def reject(self, email, status=400):
+        """
+        Responds to all the requests sent to a recipient with an error
+
+        Arguments:
+            email - recipient email
+            status - http status code
+        """
+
+        with self.lock:
+            self.rejected_recipients[email] = status
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -1,15 +1,13 @@
 
 from datetime import datetime, timezone
 
-from sqlalchemy import create_engine
-
-from edunotice.constants import SQL_CONNECTION_STRING_DB
+from edunotice.db import get_engine
 from edunotice.summary import _prep_summary_email
 from edunotice.sender import send_summary_email
 
 if __name__ == "__main__":
 
-    engine = create_engine(SQL_CONNECTION_STRING_DB)
+    engine = get_engine()
 
     timestamp_utc = datetime.now(timezone.utc)
 
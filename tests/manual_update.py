@@ -1,9 +1,8 @@
 import logging
 import pandas as pd
-from sqlalchemy import create_engine
 
+from edunotice.db import get_engine
 from edunotice.edunotice import update_subscriptions
-from edunotice.constants import SQL_CONNECTION_STRING_DB
 
 
 class Namespace:
@@ -17,7 +16,7 @@ if __name__ == "__main__":
 
     args = Namespace(input_df=crawl_df)
 
-    engine = create_engine(SQL_CONNECTION_STRING_DB)
+    engine = get_engine()
 
     status, error, counts = update_subscriptions(engine, args)
 
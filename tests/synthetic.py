@@ -0,0 +1,265 @@
+"""
+A synthetic EduHub crawl generator, used to test and benchmark ingest,
+    notifications and summaries at scale offline.
+
+Generates crawl dataframes in the EduCrawler output format (the columns of
+    CONST_PD_COL_*, amounts as "$1000.00", users as "['a@b.com']") for
+    a number of courses, labs and subscriptions crawled at a fixed cadence.
+    Over time subscriptions burn their budgets, have their expiry dates
+    changed, get cancelled and renamed, and new subscriptions appear.
+    The output is deterministic for a given seed.
+
+Usage:
+    eduhub = SyntheticEduHub(num_subs=1000, days=7, seed=42)
+
+    for crawl_df in eduhub.crawls():
+        update_edu_data(engine, crawl_df)
+
+    history_df = SyntheticEduHub(num_subs=100).history()
+"""
+
+import random
+import uuid
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from edunotice.constants import (
+    CONST_PD_COL_COURSE_NAME,
+    CONST_PD_COL_LAB_NAME,
+    CONST_PD_COL_HANDOUT_NAME,
+    CONST_PD_COL_HANDOUT_BUDGET,
+    CONST_PD_COL_HANDOUT_CONSUMED,
+    CONST_PD_COL_HANDOUT_STATUS,
+    CONST_PD_COL_SUB_NAME,
+    CONST_PD_COL_SUB_ID,
+    CONST_PD_COL_SUB_STATUS,
+    CONST_PD_COL_SUB_EXPIRY_DATE,
+    CONST_PD_COL_SUB_USERS,
+    CONST_PD_COL_CRAWL_TIME_UTC,
+    CONST_SUB_CANCELLED,
+)
+
+# columns of a crawl, in the EduCrawler output order
+SYNTHETIC_COLUMNS = [
+    CONST_PD_COL_COURSE_NAME,
+    CONST_PD_COL_LAB_NAME,
+    CONST_PD_COL_HANDOUT_NAME,
+    CONST_PD_COL_HANDOUT_BUDGET,
+    CONST_PD_COL_HANDOUT_CONSUMED,
+    CONST_PD_COL_HANDOUT_STATUS,
+    CONST_PD_COL_SUB_NAME,
+    CONST_PD_COL_SUB_ID,
+    CONST_PD_COL_SUB_STATUS,
+    CONST_PD_COL_SUB_EXPIRY_DATE,
+    CONST_PD_COL_SUB_USERS,
+    CONST_PD_COL_CRAWL_TIME_UTC,
+]
+
+SYNTHETIC_BUDGETS = (100.0, 300.0, 1000.0, 10000.0)
+
+SYNTHETIC_SUB_ACTIVE = "Active"
+SYNTHETIC_HANDOUT_DONE = "done"
+
+
+class SyntheticEduHub:
+    """
+    Synthetic EduHub: a population of subscriptions evolving crawl by crawl
+    """
+
+    def __init__(
+        self,
+        num_courses=2,
+        labs_per_course=2,
+        num_subs=100,
+        users_per_sub=(1, 3),
+        start=datetime(2020, 10, 1),
+        crawl_interval=timedelta(hours=2),
+        days=1,
+        burn_per_day=0.02,
+        expiry_change_per_day=0.01,
+        cancel_per_day=0.005,
+        rename_per_day=0.005,
+        late_fraction=0.1,
+        seed=0,
+    ):
+        """
+        Arguments:
+            num_courses - number of courses
+            labs_per_course - number of labs of every course
+            num_subs - number of subscriptions (over the whole history)
+            users_per_sub - (min, max) number of users of a subscription
+            start - time of the first crawl
+            crawl_interval - time between crawls
+            days - history length (days)
+            burn_per_day - mean fraction of the budget consumed per day
+            expiry_change_per_day - probability of an expiry date change
+                per subscription and day
+            cancel_per_day - probability of a cancellation per subscription
+                and day
+            rename_per_day - probability of a rename per subscription and day
+            late_fraction - fraction of subscriptions created after the first
+                crawl
+            seed - random seed
+        """
+
+        self.start = start
+        self.crawl_interval = crawl_interval
+        self.num_crawls = max(
+            1, int(round(timedelta(days=days) / crawl_interval))
+        )
+
+        # probabilities per crawl
+        crawls_per_day = timedelta(days=1) / crawl_interval
+        self.burn_per_crawl = burn_per_day / crawls_per_day
+        self.expiry_change_prob = expiry_change_per_day / crawls_per_day
+        self.cancel_prob = cancel_per_day / crawls_per_day
+        self.rename_prob = rename_per_day / crawls_per_day
+
+        self.labs = [
+            ("Course %d" % (course), "Lab %d-%d" % (course, lab))
+            for course in range(1, num_courses + 1)
+            for lab in range(1, labs_per_course + 1)
+        ]
+
+        self.num_subs = num_subs
+        self.users_per_sub = users_per_sub
+        self.late_fraction = late_fraction
+        self.seed = seed
+
+        self._reset()
+
+    def _reset(self):
+        """
+        Creates the subscriptions as of the first crawl
+        """
+
+        self._rng = random.Random(self.seed)
+
+        self.subs = [self._new_sub(idx) for idx in range(self.num_subs)]
+
+    def _new_sub(self, idx):
+        """
+        Creates a subscription's state
+        """
+
+        rng = self._rng
+
+        course_name, lab_name = self.labs[idx % len(self.labs)]
+
+        name = "Synthetic subscription %d" % (idx)
+
+        first_crawl = 0
+        if rng.random() < self.late_fraction:
+            first_crawl = rng.randrange(self.num_crawls)
+
+        return {
+            "course_name": course_name,
+            "lab_name": lab_name,
+            "handout_name": name,
+            "budget": rng.choice(SYNTHETIC_BUDGETS),
+            "consumed": 0.0,
+            "name": name,
+            "guid": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            "status": SYNTHETIC_SUB_ACTIVE,
+            "expiry_date": (
+                self.start + timedelta(days=rng.randint(1, 365))
+            ).date(),
+            "users": [
+                "user%d.%d@example.com" % (idx, user)
+                for user in range(rng.randint(*self.users_per_sub))
+            ],
+            "first_crawl": first_crawl,
+            "renames": 0,
+        }
+
+    def _evolve(self, sub):
+        """
+        Advances a subscription's state by one crawl
+        """
+
+        rng = self._rng
+
+        if sub["status"] == CONST_SUB_CANCELLED:
+            return
+
+        # budget burn, the consumption can slightly overshoot the budget
+        sub["consumed"] = min(
+            sub["consumed"]
+            + sub["budget"] * rng.expovariate(1.0 / self.burn_per_crawl),
+            sub["budget"] * 1.05,
+        )
+
+        if rng.random() < self.expiry_change_prob:
+            sub["expiry_date"] += timedelta(days=rng.choice((-7, 30, 90)))
+
+        if rng.random() < self.rename_prob:
+            sub["renames"] += 1
+            sub["name"] = "%s (%d)" % (sub["handout_name"], sub["renames"])
+
+        if rng.random() < self.cancel_prob:
+            sub["status"] = CONST_SUB_CANCELLED
+
+    def _crawl_frame(self, crawl_idx):
+        """
+        Returns the crawl dataframe of the subscriptions visible in a crawl
+        """
+
+        crawl_time = self.start + crawl_idx * self.crawl_interval
+
+        rows = []
+
+        for sub_idx, sub in enumerate(self.subs):
+            if sub["first_crawl"] > crawl_idx:
+                continue
+
+            rows.append(
+                [
+                    sub["course_name"],
+                    sub["lab_name"],
+                    sub["handout_name"],
+                    "$%.2f" % (sub["budget"]),
+                    "$%.2f" % (sub["consumed"]),
+                    SYNTHETIC_HANDOUT_DONE,
+                    sub["name"],
+                    sub["guid"],
+                    sub["status"],
+                    sub["expiry_date"].strftime("%Y-%m-%d"),
+                    str(sub["users"]),
+                    # the subscriptions are crawled one after another
+                    (
+                        crawl_time + timedelta(milliseconds=10 * sub_idx)
+                    ).strftime("%Y-%m-%d %H:%M:%S.%f"),
+                ]
+            )
+
+        return pd.DataFrame(rows, columns=SYNTHETIC_COLUMNS)
+
+    def crawls(self):
+        """
+        Generates the crawls one by one (every call starts from the first
+            crawl).
+
+        Returns:
+            crawls - a generator of crawl dataframes
+        """
+
+        self._reset()
+
+        for crawl_idx in range(self.num_crawls):
+            if crawl_idx > 0:
+                for sub in self.subs:
+                    if sub["first_crawl"] < crawl_idx:
+                        self._evolve(sub)
+
+            yield self._crawl_frame(crawl_idx)
+
+    def history(self):
+        """
+        Returns all the crawls in a single dataframe.
+
+        Returns:
+            history_df - crawl dataframe of the whole history
+        """
+
+        return pd.concat(list(self.crawls()), ignore_index=True)
@@ -8,7 +8,12 @@ import pandas as pd
 from sqlalchemy import create_engine
 
 from edunotice.ingress import update_edu_data
-from edunotice.budget import _usage_notification, notify_usage
+from edunotice.db import session_open, session_close
+from edunotice.budget import (
+    _usage_codes,
+    _usage_candidates,
+    notify_usage,
+)
 from edunotice.notifications import indiv_email_usage_notification
 
 from edunotice.constants import (
@@ -29,7 +34,7 @@ from edunotice.constants import (
 ENGINE = create_engine("%s/%s" % (SQL_CONNECTION_STRING, SQL_TEST_DBNAME5))
 
 
-def test_usage():
+def test_usage(query_budget):
     """
     The main routine to test the budget module
     """
@@ -70,10 +75,9 @@ def test_usage():
 
     # usage more than 50%
     sub_details = sub_update_list[2][1]
-    notify, usage_code = _usage_notification(
-        sub_details.handout_budget, sub_details.handout_consumed
-    )
-    assert notify
+    usage_code = _usage_codes(
+        [sub_details.handout_budget], [sub_details.handout_consumed]
+    )[0]
     assert usage_code == CONST_USAGE_CODE_50
 
     success, error, html_content = indiv_email_usage_notification(
@@ -84,10 +88,9 @@ def test_usage():
 
     # usage more than 75%
     sub_details = sub_update_list[3][1]
-    notify, usage_code = _usage_notification(
-        sub_details.handout_budget, sub_details.handout_consumed
-    )
-    assert notify
+    usage_code = _usage_codes(
+        [sub_details.handout_budget], [sub_details.handout_consumed]
+    )[0]
     assert usage_code == CONST_USAGE_CODE_75
 
     success, error, html_content = indiv_email_usage_notification(
@@ -97,10 +100,9 @@ def test_usage():
 
     # usage more than 90%
     sub_details = sub_update_list[4][1]
-    notify, usage_code = _usage_notification(
-        sub_details.handout_budget, sub_details.handout_consumed
-    )
-    assert notify
+    usage_code = _usage_codes(
+        [sub_details.handout_budget], [sub_details.handout_consumed]
+    )[0]
     assert usage_code == CONST_USAGE_CODE_90
 
     success, error, html_content = indiv_email_usage_notification(
@@ -110,10 +112,9 @@ def test_usage():
 
     # usage more than 95%
     sub_details = sub_update_list[5][1]
-    notify, usage_code = _usage_notification(
-        sub_details.handout_budget, sub_details.handout_consumed
-    )
-    assert notify
+    usage_code = _usage_codes(
+        [sub_details.handout_budget], [sub_details.handout_consumed]
+    )[0]
     assert usage_code == CONST_USAGE_CODE_95
 
     success, error, html_content = indiv_email_usage_notification(
@@ -121,10 +122,23 @@ def test_usage():
     )
     assert success, error
 
-    # send notifications
-    success, error, count = notify_usage(
-        ENGINE, lab_dict, sub_dict, sub_update_list
-    )
+    # subscriptions to be notified
+    session = session_open(ENGINE)
+    candidates = _usage_candidates(session, sub_update_list)
+    session_close(session)
+
+    assert [usage_code for _, usage_code in candidates] == [
+        CONST_USAGE_CODE_50,
+        CONST_USAGE_CODE_75,
+        CONST_USAGE_CODE_90,
+        CONST_USAGE_CODE_95,
+    ]
+
+    # send notifications, the usage codes are updated at once
+    with query_budget(ENGINE, "notify_usage", 3):
+        success, error, count = notify_usage(
+            ENGINE, lab_dict, sub_dict, sub_update_list
+        )
     assert success, error
     assert count == 4
 
@@ -155,6 +169,30 @@ def test_usage():
     assert count == 1
 
 
+def test_usage_codes():
+    """
+    tests the usage codes of a number of subscriptions evaluated at once
+    """
+
+    budgets = [None, 0, 100.0, 100.0, 100.0, 100.0, 100.0, 100.0, 3.0, 100.0]
+    usages = [10.0, 10.0, None, 49.99, 50.0, 75.0, 90.0, 95.0, 2.85, 120.0]
+
+    codes = _usage_codes(budgets, usages)
+
+    assert list(codes) == [
+        0,
+        0,
+        0,
+        0,
+        CONST_USAGE_CODE_50,
+        CONST_USAGE_CODE_75,
+        CONST_USAGE_CODE_90,
+        CONST_USAGE_CODE_95,
+        CONST_USAGE_CODE_95,
+        CONST_USAGE_CODE_95,
+    ]
+
+
 def test_usage_update():
     """
     Additional routine to test the budget module.
@@ -0,0 +1,158 @@
+"""
+Test db.py module
+"""
+
+import os
+import subprocess
+import sys
+
+from edunotice.constants import (
+    SQL_CONNECTION_STRING,
+    SQL_TEST_DBNAME7,
+    SQL_TEST_DBNAME9,
+    SQL_POOL_SIZE,
+)
+
+from sqlalchemy import create_engine, inspect, text
+
+from edunotice.db import (
+    get_engine,
+    dispose_engines,
+    session_open,
+    session_close,
+    QueryProfiler,
+    migrate_db,
+)
+
+CONNECTION_STRING = "%s/%s" % (SQL_CONNECTION_STRING, SQL_TEST_DBNAME7)
+
+
+def test_get_engine():
+    """
+    tests that get_engine reuses the engine and its session factory
+    """
+
+    engine = get_engine(CONNECTION_STRING)
+
+    assert engine is get_engine(CONNECTION_STRING)
+    assert engine.pool.size() == SQL_POOL_SIZE
+
+    session1 = session_open(engine)
+    session2 = session_open(engine)
+
+    assert session1 is not session2
+    assert session1.get_bind() is engine
+    assert type(session1) is type(session2)
+
+    session_close(session1)
+    session_close(session2)
+
+    dispose_engines()
+
+    assert get_engine(CONNECTION_STRING) is not engine
+
+    dispose_engines()
+
+
+def test_query_profiler():
+    """
+    tests that the profiler counts and times the statements of operations
+    """
+
+    engine = get_engine(CONNECTION_STRING)
+
+    profiler = QueryProfiler(engine, num_slowest=2)
+
+    with engine.connect() as conn:
+        # not profiled
+        conn.execute(text("SELECT 1"))
+
+        with profiler.operation("sleep") as stats:
+            conn.execute(text("SELECT pg_sleep(0.05)"))
+            conn.execute(text("SELECT 2"))
+            conn.execute(text("SELECT 3"))
+
+        with profiler.operation("select"):
+            conn.execute(text("SELECT 4"))
+
+        # statistics of an operation add up
+        with profiler.operation("select"):
+            conn.execute(text("SELECT 5"))
+
+    assert stats["statements"] == 3
+    assert stats["db_time"] >= 0.05
+    assert len(stats["slowest"]) == 2
+    assert "pg_sleep" in stats["slowest"][0][1]
+
+    assert profiler.operations["select"]["statements"] == 2
+
+    report = profiler.report()
+
+    assert report.startswith("sleep: 3 statement(s)")
+    assert "select: 2 statement(s)" in report
+
+    dispose_engines()
+
+
+def test_migrate_db():
+    """
+    tests that the migration adds the tables and indexes missing from
+        an existing database and can be run again
+    """
+
+    engine = create_engine(
+        "%s/%s" % (SQL_CONNECTION_STRING, SQL_TEST_DBNAME9)
+    )
+
+    # a database deployed before the outbox and the summary indexes
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE outbox"))
+        conn.execute(text("DROP TABLE subscription_latest"))
+        conn.execute(text("DROP INDEX ix_details_new_flag_timestamp_utc"))
+        conn.execute(
+            text(
+                "CREATE INDEX ix_details_new_notice_sent "
+                "ON details (new_notice_sent)"
+            )
+        )
+
+    for _ in range(2):
+        success, error = migrate_db(db_name=SQL_TEST_DBNAME9)
+        assert success, error
+
+    inspector = inspect(engine)
+
+    assert inspector.has_table("outbox")
+    assert inspector.has_table("subscription_latest")
+    details_indexes = [
+        index["name"] for index in inspector.get_indexes("details")
+    ]
+
+    assert "ix_details_new_flag_timestamp_utc" in details_indexes
+    assert "ix_details_new_notice_sent" not in details_indexes
+    assert {"ix_outbox_undelivered", "ix_outbox_sent"} <= {
+        index["name"] for index in inspector.get_indexes("outbox")
+    }
+
+    engine.dispose()
+
+
+def test_import_without_settings():
+    """
+    tests that the modules import without the database settings
+        (they are only read when first used)
+    """
+
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if not key.startswith("ENS_")
+    }
+
+    process = subprocess.run(
+        [sys.executable, "-c", "import edunotice.edunotice"],
+        env=env,
+        stderr=subprocess.PIPE,
+    )
+
+    assert process.returncode == 0, process.stderr
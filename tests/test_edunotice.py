@@ -4,6 +4,7 @@ Test edunotice.py module
 
 import os
 from datetime import datetime, timezone
+from types import SimpleNamespace
 import pandas as pd
 
 from sqlalchemy import create_engine
@@ -18,8 +19,12 @@ from edunotice.constants import (
 )
 
 from edunotice.ingress import update_edu_data
+from edunotice.data import get_labs_dict, get_subs_dict
+from edunotice.db import session_open, session_rollback
+from edunotice.utilities import IdIndex
 
 from edunotice.edunotice import (
+    _indv_emails,
     _notify_subscriptions,
 )
 
@@ -155,3 +160,64 @@ def test_notify_subscriptions_3():
     assert counts[1] == 0
     assert counts[2] == 1
     assert counts[3] == 1
+
+
+def test_indv_emails_index(monkeypatch):
+    """
+    id -> name indices are built once, not for every rendered notification
+    """
+
+    success, error, lab_dict = get_labs_dict(ENGINE)
+    assert success, error
+
+    success, error, sub_dict = get_subs_dict(ENGINE)
+    assert success, error
+
+    lab_id = list(lab_dict.values())[0]
+
+    new_sub_list = []
+    upd_sub_list = []
+
+    for details_id, sub_id in enumerate(list(sub_dict.values()) * 5):
+        details = SimpleNamespace(
+            id=details_id,
+            sub_id=sub_id,
+            lab_id=lab_id,
+            handout_status="done",
+            handout_budget=100.0,
+            handout_consumed=10.0,
+            subscription_name="Subscription %d" % (details_id),
+            subscription_status="Active",
+            subscription_expiry_date=datetime(2021, 10, 31),
+            subscription_users="xxxxx@turing.ac.uk",
+        )
+
+        new_sub_list.append(details)
+        upd_sub_list.append(
+            (details, SimpleNamespace(**dict(
+                vars(details), subscription_name="Renamed"
+            )))
+        )
+
+    # counts the indices built
+    indices = []
+    index_init = IdIndex.__init__
+
+    def _init(self, *args, **kwargs):
+        indices.append(self)
+        index_init(self, *args, **kwargs)
+
+    monkeypatch.setattr(IdIndex, "__init__", _init)
+
+    session = session_open(ENGINE)
+
+    success, error, new_count, upd_count = _indv_emails(
+        session, dict(lab_dict), dict(sub_dict), new_sub_list, upd_sub_list
+    )
+
+    session_rollback(session)
+
+    assert success, error
+    assert new_count == len(new_sub_list)
+    assert upd_count == len(upd_sub_list)
+    assert len(indices) == 2
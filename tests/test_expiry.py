@@ -10,12 +10,14 @@ from sqlalchemy import create_engine
 
 from edunotice.expiry import (
     _check_remaining_time,
+    _expiry_codes,
     notify_expire,
+    sweep_expiry,
 )
 
 from edunotice.notifications import indiv_email_expiry_notification
 
-from edunotice.ingress import update_edu_data
+from edunotice.ingress import update_edu_data, get_latest_log_timestamp
 
 from edunotice.constants import (
     SQL_CONNECTION_STRING,
@@ -28,6 +30,7 @@ from edunotice.constants import (
     CONST_EXPR_CODE_1,
     CONST_EXPR_CODE_7,
     CONST_EXPR_CODE_30,
+    CONST_LOG_CODE_EXPIRY_SWEEP,
 )
 
 ENGINE = create_engine("%s/%s" % (SQL_CONNECTION_STRING, SQL_TEST_DBNAME4))
@@ -109,6 +112,39 @@ def test_check_remaining_time():
     assert expiry_code is None
     assert remain_days == 70
 
+    # the current date defaults to today, not to the date of the import
+    expires, expiry_code, remain_days = _check_remaining_time(
+        datetime.datetime.utcnow() + datetime.timedelta(days=1)
+    )
+
+    assert expires
+    assert expiry_code == CONST_EXPR_CODE_1
+    assert remain_days == 1
+
+
+def test_expiry_codes():
+    """
+    tests that the expiration codes of a number of subscriptions match
+        the codes of the subscriptions one by one
+    """
+
+    current_date = datetime.datetime(2020, 11, 10).date()
+
+    expiry_dates = [
+        current_date + datetime.timedelta(days=days)
+        for days in (-400, -1, 0, 1, 2, 6, 7, 8, 29, 30, 31, 70)
+    ] + [datetime.datetime(2020, 11, 17, 23, 59)]
+
+    codes, days_diff = _expiry_codes(expiry_dates, current_date)
+
+    for expiry_date, code, days in zip(expiry_dates, codes, days_diff):
+        expires, expiry_code, remain_days = _check_remaining_time(
+            expiry_date, current_date=current_date
+        )
+
+        assert code == (expiry_code if expires else -1)
+        assert days == remain_days
+
 
 def test_expiry():
     """
@@ -187,7 +223,7 @@ def test_expiry():
     assert count == 2
 
 
-def test_expiry_update():
+def test_expiry_update(query_budget):
     """
     Additional routine to test the expiry module.
 
@@ -214,13 +250,61 @@ def test_expiry_update():
     assert len(sub_new_list) == 0
     assert len(sub_update_list) == 4
 
-    # send notifications
-    success, error, count = notify_expire(
-        ENGINE,
-        lab_dict,
-        sub_dict,
-        sub_update_list,
-        timestamp_utc=current_date,
-    )
+    # send notifications, the expiry codes are updated at once
+    with query_budget(ENGINE, "notify_expire", 3):
+        success, error, count = notify_expire(
+            ENGINE,
+            lab_dict,
+            sub_dict,
+            sub_update_list,
+            timestamp_utc=current_date,
+        )
     assert success, error
     assert count == 3
+
+
+def test_sweep_expiry():
+    """
+    tests the expiry sweep: only the subscriptions which entered
+        an expiration period since the previous sweep are notified
+    """
+
+    # the first sweep: the subscriptions were notified by the last crawl
+    success, error, count = sweep_expiry(
+        ENGINE, timestamp_utc=datetime.datetime(2020, 11, 12, 1)
+    )
+    assert success, error
+    assert count == 0
+
+    # Test 3 expires in 1 day
+    success, error, count = sweep_expiry(
+        ENGINE, timestamp_utc=datetime.datetime(2020, 11, 17, 1)
+    )
+    assert success, error
+    assert count == 1
+
+    # no expiration periods entered since the previous sweep
+    success, error, count = sweep_expiry(
+        ENGINE, timestamp_utc=datetime.datetime(2020, 11, 17, 13)
+    )
+    assert success, error
+    assert count == 0
+
+    # Test 4 expires in 6 days (7 days period entered on 2020-12-04),
+    #   Test 3 has expired (it was already notified)
+    success, error, count = sweep_expiry(
+        ENGINE, timestamp_utc=datetime.datetime(2020, 12, 5, 1)
+    )
+    assert success, error
+    assert count == 1
+
+    # sweeps are logged separately from the summaries
+    success, error, timestamp_utc = get_latest_log_timestamp(
+        ENGINE, code=CONST_LOG_CODE_EXPIRY_SWEEP
+    )
+    assert success, error
+    assert timestamp_utc == datetime.datetime(2020, 12, 5, 1)
+
+    success, error, timestamp_utc = get_latest_log_timestamp(ENGINE)
+    assert success, error
+    assert timestamp_utc is None
@@ -3,11 +3,21 @@ Test ingress.py module
 """
 
 import os
+from datetime import datetime
 import pandas as pd
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func
+
+from edunotice.db import session_open, session_close
+from edunotice.structure import (
+    CourseClass,
+    DetailsClass,
+    SubscriptionLatestClass,
+)
 
 from edunotice.ingress import (
+    _normalise_edu_data,
+    _details_hash,
     _update_courses,
     _update_labs,
     _update_subscriptions,
@@ -40,67 +50,123 @@ eduhub_df1 = pd.read_csv(file_path1)
 ENGINE = create_engine("%s/%s" % (SQL_CONNECTION_STRING, SQL_TEST_DBNAME1))
 
 
+def test_normalise_edu_data():
+    """
+    tests ingress._normalise_edu_data routine
+    """
+
+    # wrong dataframe
+    success, error, _ = _normalise_edu_data(wrong_df)
+    assert success is False, error
+
+    # good data
+    success, error, norm_df = _normalise_edu_data(eduhub_df1)
+    assert success, error
+    assert len(norm_df) == len(eduhub_df1)
+
+    row = norm_df.iloc[1]
+    assert row["Handout budget"] == 10000.0
+    assert row["Handout consumed"] == 0.0
+    assert row["Subscription expiry date"] == datetime(2020, 9, 30)
+    assert row["Subscription users"] == (
+        "xxxxx@turing.ac.uk, yyyyy@turing.ac.uk"
+    )
+
+    # the input dataframe is not modified
+    assert eduhub_df1["Handout budget"].iloc[1] == "$10000.00"
+
+    # normalising twice does not change the data
+    success, error, norm_df2 = _normalise_edu_data(norm_df)
+    assert success, error
+    assert norm_df2.equals(norm_df)
+
+    # missing expiry dates and users
+    pending_df = eduhub_df1.copy()
+    pending_df["Subscription expiry date"] = ["", None]
+    pending_df["Subscription users"] = [None, "[]"]
+
+    success, error, norm_df = _normalise_edu_data(pending_df)
+    assert success, error
+    assert norm_df["Subscription expiry date"].isnull().all()
+    assert list(norm_df["Subscription users"]) == ["", ""]
+
+
 def test_update_courses():
     """
     tests ingress._update_courses routine
     """
 
+    session = session_open(ENGINE)
+
     # wrong dataframe
-    success, error, _ = _update_courses(ENGINE, wrong_df)
+    success, error, _ = _update_courses(session, wrong_df)
     assert success is False, error
 
     # good data
-    success, error, course_dict = _update_courses(ENGINE, eduhub_df1)
+    success, error, course_dict = _update_courses(session, eduhub_df1)
     assert success, error
     assert len(course_dict) == 2
 
-    success, error, course_dict = _update_courses(ENGINE, eduhub_df1)
+    success, error, course_dict = _update_courses(session, eduhub_df1)
     assert success, error
     assert len(course_dict) == 2
 
+    session_close(session)
 
-def test_update_labs():
+
+def test_update_labs(query_budget):
     """
     tests ingress._update_labs routine
     """
 
+    session = session_open(ENGINE)
+
     # getting the courses
-    success, error, course_dict = _update_courses(ENGINE, eduhub_df1)
+    success, error, course_dict = _update_courses(session, eduhub_df1)
     assert success, error
     assert len(course_dict) == 2
 
     # wrong dataframe
-    success, error, _ = _update_labs(ENGINE, wrong_df, course_dict)
+    success, error, _ = _update_labs(session, wrong_df, course_dict)
     assert success is False, error
 
     # good data
-    success, error, lab_dict = _update_labs(ENGINE, eduhub_df1, course_dict)
+    with query_budget(ENGINE, "_update_labs", 2):
+        success, error, lab_dict = _update_labs(
+            session, eduhub_df1, course_dict
+        )
     assert success, error
     assert len(lab_dict) == 2
 
-    success, error, lab_dict = _update_labs(ENGINE, eduhub_df1, course_dict)
+    success, error, lab_dict = _update_labs(session, eduhub_df1, course_dict)
     assert success, error
     assert len(lab_dict) == 2
 
+    session_close(session)
+
 
 def test_update_subscriptions():
     """
     tests ingress._update_subscriptions routine
     """
 
+    session = session_open(ENGINE)
+
     # wrong dataframe
-    success, error, _ = _update_subscriptions(ENGINE, wrong_df)
+    success, error, _ = _update_subscriptions(session, wrong_df)
     assert success is False, error
 
     # good data
-    success, error, sub_dict = _update_subscriptions(ENGINE, eduhub_df1)
+    success, error, sub_dict = _update_subscriptions(session, eduhub_df1)
     assert success, error
     assert len(sub_dict) == 2
 
-    success, error, sub_dict = _update_subscriptions(ENGINE, eduhub_df1)
+    success, error, sub_dict = _update_subscriptions(session, eduhub_df1)
     assert success, error
     assert len(sub_dict) == 2
 
+    session_close(session)
+
 
 def test_update_details_1():
     """
@@ -109,69 +175,84 @@ def test_update_details_1():
     2 new subscriptions
     """
 
+    session = session_open(ENGINE)
+
     # getting the courses
-    success, error, course_dict = _update_courses(ENGINE, eduhub_df1)
+    success, error, course_dict = _update_courses(session, eduhub_df1)
     assert success, error
     assert len(course_dict) == 2
 
     # getting the labs
-    success, error, lab_dict = _update_labs(ENGINE, eduhub_df1, course_dict)
+    success, error, lab_dict = _update_labs(session, eduhub_df1, course_dict)
     assert success, error
     assert len(lab_dict) == 2
 
     # getting the subscriptions
-    success, error, sub_dict = _update_subscriptions(ENGINE, eduhub_df1)
+    success, error, sub_dict = _update_subscriptions(session, eduhub_df1)
     assert success, error
     assert len(sub_dict) == 2
 
+    success, error, norm_df = _normalise_edu_data(eduhub_df1)
+    assert success, error
+
     # 2 new subscriptions
     success, error, new_list, update_list = _update_details(
-        ENGINE, eduhub_df1, lab_dict, sub_dict
+        session, norm_df, lab_dict, sub_dict
     )
 
     assert success, error
     assert len(new_list) == 2
     assert len(update_list) == 0
 
+    session_close(session)
 
-def test_update_details_2():
+
+def test_update_details_2(query_budget):
     """
     tests ingress._update_details routine
 
     1 update
     """
 
+    session = session_open(ENGINE)
+
     eduhub_df_local = pd.read_csv(
         os.path.join(CONST_TEST_DIR_DATA, CONST_TEST2_FILENAME)
     )
 
     # getting the courses
-    success, error, course_dict = _update_courses(ENGINE, eduhub_df_local)
+    success, error, course_dict = _update_courses(session, eduhub_df_local)
     assert success, error
     assert len(course_dict) == 2
 
     # getting the labs
     success, error, lab_dict = _update_labs(
-        ENGINE, eduhub_df_local, course_dict
+        session, eduhub_df_local, course_dict
     )
     assert success, error
     assert len(lab_dict) == 2
 
     # getting the subscriptions
-    success, error, sub_dict = _update_subscriptions(ENGINE, eduhub_df_local)
+    success, error, sub_dict = _update_subscriptions(session, eduhub_df_local)
     assert success, error
     assert len(sub_dict) == 3
 
-    success, error, new_list, update_list = _update_details(
-        ENGINE, eduhub_df_local, lab_dict, sub_dict
-    )
+    success, error, norm_df = _normalise_edu_data(eduhub_df_local)
+    assert success, error
+
+    with query_budget(ENGINE, "_update_details", 7):
+        success, error, new_list, update_list = _update_details(
+            session, norm_df, lab_dict, sub_dict
+        )
 
     assert success, error
     assert len(new_list) == 1
     assert len(update_list) == 2
 
+    session_close(session)
+
 
-def test_update_edu_data():
+def test_update_edu_data(query_budget):
     """
     tests ingress.update_edu_data routine
     """
@@ -194,10 +275,153 @@ def test_update_edu_data():
     assert success is False, error
 
     # real data
-    success, error, _, _, sub_new_list, sub_update_list = update_edu_data(
-        ENGINE, eduhub_df1
+    with query_budget(ENGINE, "update_edu_data", 12):
+        (
+            success,
+            error,
+            _,
+            _,
+            sub_new_list,
+            sub_update_list,
+        ) = update_edu_data(ENGINE, eduhub_df1)
+
+    assert success, error
+    assert len(sub_new_list) == 0
+    assert len(sub_update_list) == 2
+
+
+def test_subscription_latest():
+    """
+    tests that subscription_latest points at the latest details entries
+    """
+
+    session = session_open(ENGINE)
+
+    latest_list = session.query(SubscriptionLatestClass).all()
+
+    max_timestamps = dict(
+        session.query(
+            DetailsClass.sub_id, func.max(DetailsClass.timestamp_utc)
+        )
+        .group_by(DetailsClass.sub_id)
+        .all()
     )
 
+    assert len(latest_list) == len(max_timestamps)
+
+    for latest in latest_list:
+        details = session.query(DetailsClass).get(latest.details_id)
+
+        assert details.sub_id == latest.sub_id
+        assert details.timestamp_utc == max_timestamps[latest.sub_id]
+        assert latest.timestamp_utc == max_timestamps[latest.sub_id]
+        assert latest.content_hash == _details_hash(details)
+        assert latest.last_seen >= latest.timestamp_utc
+
+    session_close(session)
+
+
+def _details_count():
+    """
+    Returns the number of details entries
+    """
+
+    session = session_open(ENGINE)
+    details_count = session.query(DetailsClass).count()
+    session_close(session)
+
+    return details_count
+
+
+def test_unchanged_details():
+    """
+    tests that crawls of unchanged subscriptions are not stored and only
+        advance their last seen time
+    """
+
+    eduhub_df_local = eduhub_df1.copy()
+    eduhub_df_local["Crawl time utc"] = "2020-12-01 10:00:00.000000"
+
+    success, error, _, _, _, _ = update_edu_data(ENGINE, eduhub_df_local)
+    assert success, error
+
+    details_count = _details_count()
+
+    # nothing but the crawl time has changed
+    eduhub_df_local["Crawl time utc"] = "2020-12-01 12:00:00.000000"
+
+    (
+        success,
+        error,
+        _,
+        _,
+        sub_new_list,
+        sub_update_list,
+    ) = update_edu_data(ENGINE, eduhub_df_local)
+
     assert success, error
     assert len(sub_new_list) == 0
     assert len(sub_update_list) == 2
+    assert _details_count() == details_count
+
+    for prev_details, new_details in sub_update_list:
+        assert new_details is prev_details
+
+    session = session_open(ENGINE)
+
+    latest_list = session.query(SubscriptionLatestClass).all()
+
+    for latest in latest_list:
+        if latest.sub_id in [x.sub_id for _, x in sub_update_list]:
+            assert latest.timestamp_utc == datetime(2020, 12, 1, 10)
+            assert latest.last_seen == datetime(2020, 12, 1, 12)
+
+    session_close(session)
+
+    # the consumed amount of one of the subscriptions has changed
+    eduhub_df_local["Crawl time utc"] = "2020-12-01 14:00:00.000000"
+    eduhub_df_local.loc[0, "Handout consumed"] = "$200.00"
+
+    (
+        success,
+        error,
+        _,
+        _,
+        _,
+        sub_update_list,
+    ) = update_edu_data(ENGINE, eduhub_df_local)
+
+    assert success, error
+    assert _details_count() == details_count + 1
+
+    changed_list = [x for x in sub_update_list if x[0] is not x[1]]
+    assert len(changed_list) == 1
+    assert changed_list[0][1].handout_consumed == 200.0
+    assert changed_list[0][1].timestamp_utc == datetime(2020, 12, 1, 14)
+
+
+def test_update_edu_data_rollback():
+    """
+    tests that a failed update does not leave partially written data behind
+    """
+
+    eduhub_df_local = eduhub_df1.copy()
+    eduhub_df_local["Course name"] = "Rollback course"
+
+    # handout status exceeds the column size, so inserting details fails
+    eduhub_df_local["Handout status"] = "x" * 100
+
+    success, error, _, _, _, _ = update_edu_data(ENGINE, eduhub_df_local)
+    assert success is False, error
+
+    session = session_open(ENGINE)
+
+    course_count = (
+        session.query(CourseClass)
+        .filter(CourseClass.name == "Rollback course")
+        .count()
+    )
+
+    session_close(session)
+
+    assert course_count == 0
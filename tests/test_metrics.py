@@ -0,0 +1,76 @@
+"""
+Test metrics.py module
+"""
+
+import logging
+
+from sqlalchemy import create_engine, text
+
+from edunotice.constants import SQL_CONNECTION_STRING, SQL_TEST_DBNAME7
+from edunotice.db import QueryProfiler
+from edunotice.metrics import Metrics, stage
+
+
+def test_metrics(caplog):
+    """
+    tests that stages are recorded and emitted as structured log records
+    """
+
+    metrics = Metrics()
+
+    caplog.set_level(logging.INFO, logger="edunotice.metrics")
+
+    with metrics.stage("ingest") as record:
+        record["rows"] = 10
+
+    for emails in (2, 3):
+        with stage(metrics, "send") as record:
+            record["emails"] = emails
+
+    # nothing is recorded without a recorder
+    with stage(None, "send") as record:
+        record["emails"] = 1
+
+    assert [record["stage"] for record in metrics.stages] == [
+        "ingest",
+        "send",
+        "send",
+    ]
+    assert all(record["wall_time"] >= 0 for record in metrics.stages)
+
+    stages = metrics.by_stage()
+
+    assert stages["ingest"]["rows"] == 10
+    assert stages["send"]["emails"] == 5
+    assert stages["send"]["db_round_trips"] == 0
+
+    assert len(caplog.records) == 3
+    assert caplog.records[0].custom_dimensions == metrics.stages[0]
+
+
+def test_metrics_round_trips():
+    """
+    tests that the round trips of a stage are counted, also within
+        a profiled operation
+    """
+
+    engine = create_engine("%s/%s" % (SQL_CONNECTION_STRING, SQL_TEST_DBNAME7))
+
+    metrics = Metrics()
+    profiler = QueryProfiler(engine)
+
+    with engine.connect() as conn:
+        with profiler.operation("outer") as stats:
+            conn.execute(text("SELECT 1"))
+
+            with metrics.stage("inner", engine) as record:
+                conn.execute(text("SELECT 2"))
+                conn.execute(text("SELECT 3"))
+
+        # not counted
+        conn.execute(text("SELECT 4"))
+
+    engine.dispose()
+
+    assert record["db_round_trips"] == 2
+    assert stats["statements"] == 3
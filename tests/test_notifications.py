@@ -14,9 +14,11 @@ from edunotice.ingress import (
 from edunotice.notifications import (
     indiv_email_new,
     indiv_email_upd,
+    upd_sub_details_html,
 )
 
 from edunotice.constants import (
+    CONST_EMAIL_SUB_DETAILS_TAG,
     CONST_TEST_DIR_DATA,
     CONST_TEST1_FILENAME,
     CONST_TEST2_FILENAME,
@@ -153,3 +155,18 @@ def test_indiv_email_update():
 
     assert success, error
     assert len(html_content) == 3625
+
+    # the details block substituted when sending gives the same email
+    success, error, html_template = indiv_email_upd(
+        lab_dict,
+        sub_dict,
+        sub_update_list[1],
+        details_html=CONST_EMAIL_SUB_DETAILS_TAG,
+    )
+
+    assert success, error
+    assert html_template.count(CONST_EMAIL_SUB_DETAILS_TAG) == 1
+    assert html_template.replace(
+        CONST_EMAIL_SUB_DETAILS_TAG,
+        upd_sub_details_html(lab_dict, sub_dict, sub_update_list[1]),
+    ) == html_content
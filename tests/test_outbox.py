@@ -0,0 +1,379 @@
+"""
+Test outbox.py module
+"""
+
+import os
+from datetime import datetime
+import pandas as pd
+
+from sqlalchemy import create_engine
+
+from edunotice import edunotice, outbox
+from edunotice.edunotice import update_subscriptions
+from edunotice.outbox import enqueue, drain_outbox
+from edunotice.summary import _find_sent_notifications
+from edunotice.db import session_open, session_close
+from edunotice.metrics import Metrics
+from edunotice.structure import OutboxClass, DetailsClass, SubscriptionClass
+
+from edunotice.constants import (
+    CONST_NOTICE_NEW,
+    CONST_NOTICE_UPD,
+    CONST_NOTICE_EXPIRY,
+    CONST_NOTICE_USAGE,
+    CONST_TEST_DIR_DATA,
+    CONST_TEST1_FILENAME,
+    CONST_TEST2_FILENAME,
+    CONST_TEST3_FILENAME,
+    CONST_TEST4_FILENAME,
+    SQL_CONNECTION_STRING,
+    SQL_TEST_DBNAME8,
+    SG_OUTBOX_MAX_ATTEMPTS,
+)
+
+ENGINE = create_engine("%s/%s" % (SQL_CONNECTION_STRING, SQL_TEST_DBNAME8))
+
+
+class Namespace:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def _outbox_entries():
+    """
+    Returns the outbox entries and the details of their subscriptions
+    """
+
+    session = session_open(ENGINE)
+
+    entries = (
+        session.query(OutboxClass, DetailsClass)
+        .join(DetailsClass, DetailsClass.id == OutboxClass.details_id)
+        .order_by(OutboxClass.id)
+        .all()
+    )
+
+    session.expunge_all()
+    session_close(session)
+
+    return entries
+
+
+def test_update_subscriptions_outbox(monkeypatch):
+    """
+    Notifications are queued with the crawl data and sent by the drain
+    """
+
+    monkeypatch.setattr(edunotice, "SG_OUTBOX_DRAIN_INLINE", False)
+
+    timestamp_utc = datetime(2020, 10, 20, 10, 20)
+
+    file_path = os.path.join(CONST_TEST_DIR_DATA, CONST_TEST1_FILENAME)
+    args = Namespace(input_df=pd.read_csv(file_path))
+
+    success, error, counts = update_subscriptions(
+        ENGINE, args, timestamp_utc=timestamp_utc
+    )
+
+    assert success, error
+    assert counts == (2, 0, 0, 0)
+
+    # queued, but not sent yet
+    entries = _outbox_entries()
+
+    assert len(entries) == 2
+    for entry, details in entries:
+        assert entry.notice == CONST_NOTICE_NEW
+        assert entry.sent is None
+        assert details.new_notice_sent is None
+        assert entry.html_content.count(
+            list(entry.substitutions.keys())[0]
+        ) == 1
+
+    # failed deliveries are kept in the outbox
+    monkeypatch.setattr(
+        outbox,
+        "send_emails",
+        lambda messages, max_workers=None: [(False, "Error")] * len(messages),
+    )
+
+    success, error, sent_counts = drain_outbox(ENGINE)
+
+    assert success, error
+    assert sent_counts == {}
+
+    entries = _outbox_entries()
+
+    assert [entry.attempts for entry, _ in entries] == [1, 1]
+    assert [entry.error for entry, _ in entries] == ["Error", "Error"]
+    assert all(entry.sent is None for entry, _ in entries)
+
+    monkeypatch.undo()
+
+    # successful deliveries are noted in the outbox and the details
+    success, error, sent_counts = drain_outbox(
+        ENGINE, limit=1, timestamp_utc=timestamp_utc
+    )
+
+    assert success, error
+    assert sent_counts == {CONST_NOTICE_NEW: 2}
+
+    entries = _outbox_entries()
+
+    assert [entry.attempts for entry, _ in entries] == [2, 2]
+    for entry, details in entries:
+        assert entry.sent == timestamp_utc
+        assert entry.error is None
+        assert details.new_notice_sent == timestamp_utc
+
+    # nothing left to send
+    success, error, sent_counts = drain_outbox(ENGINE)
+
+    assert success, error
+    assert sent_counts == {}
+
+    # the drain runs right after the ingest
+    monkeypatch.setattr(edunotice, "SG_OUTBOX_DRAIN_INLINE", True)
+
+    file_path = os.path.join(CONST_TEST_DIR_DATA, CONST_TEST2_FILENAME)
+    args = Namespace(input_df=pd.read_csv(file_path))
+    metrics = Metrics()
+
+    success, error, counts = update_subscriptions(
+        ENGINE, args, timestamp_utc=timestamp_utc, metrics=metrics
+    )
+
+    assert success, error
+    assert counts[:2] == (1, 2)
+
+    # every stage is recorded
+    stages = metrics.by_stage()
+
+    assert list(stages.keys()) == [
+        "ingest.courses",
+        "ingest.labs",
+        "ingest.subscriptions",
+        "ingest.details",
+        "notify.individual",
+        "notify.expiry",
+        "notify.usage",
+        "send",
+    ]
+    assert all(
+        stages[name]["db_round_trips"] > 0
+        for name in (
+            "ingest.courses",
+            "ingest.details",
+            "notify.individual",
+            "send",
+        )
+    )
+    assert stages["ingest.details"]["rows"] == len(args.input_df)
+    assert stages["notify.individual"]["emails"] == 3
+    assert stages["send"]["emails"] == 3
+
+    entries = _outbox_entries()
+
+    assert len(entries) == 5
+    assert [entry.notice for entry, _ in entries[2:]].count(
+        CONST_NOTICE_UPD
+    ) == 2
+    assert all(entry.sent == timestamp_utc for entry, _ in entries)
+
+
+def _sub_codes():
+    """
+    Returns the expiry and usage codes of the subscriptions
+    """
+
+    session = session_open(ENGINE)
+
+    codes = {
+        sub.id: (sub.expiry_code, sub.usage_code)
+        for sub in session.query(SubscriptionClass).all()
+    }
+
+    session_close(session)
+
+    return codes
+
+
+def test_exhausted_notice_requeued(monkeypatch):
+    """
+    Expiry and usage notifications that ran out of attempts are queued
+        again by the next crawl
+    """
+
+    monkeypatch.setattr(edunotice, "SG_OUTBOX_DRAIN_INLINE", False)
+
+    timestamp_utc = datetime(2020, 10, 22, 10, 10)
+
+    file_path = os.path.join(CONST_TEST_DIR_DATA, CONST_TEST3_FILENAME)
+    args = Namespace(input_df=pd.read_csv(file_path))
+
+    success, error, counts = update_subscriptions(
+        ENGINE, args, timestamp_utc=timestamp_utc
+    )
+
+    assert success, error
+    assert counts[2:] == (1, 1)
+
+    queued = [
+        entry for entry, _ in _outbox_entries()
+        if entry.notice in (CONST_NOTICE_EXPIRY, CONST_NOTICE_USAGE)
+    ]
+    assert len(queued) == 2
+
+    # the codes are set when the notifications are queued
+    codes = _sub_codes()
+    for entry in queued:
+        assert entry.notice_code in codes[entry.sub_id]
+
+    # every attempt fails
+    monkeypatch.setattr(
+        outbox,
+        "send_emails",
+        lambda messages, max_workers=None: [(False, "Error")] * len(messages),
+    )
+
+    for _ in range(SG_OUTBOX_MAX_ATTEMPTS + 1):
+        success, error, sent_counts = drain_outbox(ENGINE)
+
+        assert success, error
+        assert sent_counts == {}
+
+    entries = {entry.id: entry for entry, _ in _outbox_entries()}
+
+    for entry in queued:
+        assert entries[entry.id].attempts == SG_OUTBOX_MAX_ATTEMPTS
+        assert entries[entry.id].sent is None
+
+    # the codes are reset
+    codes = _sub_codes()
+    for entry in queued:
+        expiry_code, usage_code = codes[entry.sub_id]
+
+        if entry.notice == CONST_NOTICE_EXPIRY:
+            assert expiry_code is None
+        else:
+            assert usage_code is None
+
+    monkeypatch.undo()
+    monkeypatch.setattr(edunotice, "SG_OUTBOX_DRAIN_INLINE", False)
+
+    # the next crawl queues the notifications again
+    success, error, counts = update_subscriptions(
+        ENGINE, args, timestamp_utc=timestamp_utc
+    )
+
+    assert success, error
+    assert counts[2:] == (1, 1)
+
+    requeued = [
+        entry for entry, _ in _outbox_entries()
+        if entry.notice in (CONST_NOTICE_EXPIRY, CONST_NOTICE_USAGE)
+        and entry.id not in entries
+    ]
+
+    assert sorted(
+        (entry.sub_id, entry.notice, entry.notice_code) for entry in requeued
+    ) == sorted(
+        (entry.sub_id, entry.notice, entry.notice_code) for entry in queued
+    )
+
+    success, error, sent_counts = drain_outbox(ENGINE)
+
+    assert success, error
+    assert sent_counts == {CONST_NOTICE_EXPIRY: 1, CONST_NOTICE_USAGE: 1}
+
+
+def test_notify_failure_keeps_crawl(monkeypatch):
+    """
+    The crawl data is committed even if the notifications cannot be queued
+    """
+
+    def _bad_template(*args, **kwargs):
+        raise ValueError("Bad template")
+
+    monkeypatch.setattr(edunotice, "indiv_email_new", _bad_template)
+
+    num_entries = len(_outbox_entries())
+
+    session = session_open(ENGINE)
+    num_details = session.query(DetailsClass).count()
+    session_close(session)
+
+    file_path = os.path.join(CONST_TEST_DIR_DATA, CONST_TEST4_FILENAME)
+    args = Namespace(input_df=pd.read_csv(file_path))
+
+    success, error, _ = update_subscriptions(
+        ENGINE, args, timestamp_utc=datetime(2020, 11, 6, 11)
+    )
+
+    assert success is False
+    assert str(error) == "Bad template"
+
+    # the crawl data is kept, no notifications are queued
+    session = session_open(ENGINE)
+    assert session.query(DetailsClass).count() == num_details + 2
+    session_close(session)
+
+    assert len(_outbox_entries()) == num_entries
+
+
+def test_consecutive_notices_kept():
+    """
+    Consecutive notifications about an unchanged subscription (sharing the
+        same details entry) are all kept and listed in the summary
+    """
+
+    session = session_open(ENGINE)
+    details = (
+        session.query(DetailsClass).order_by(DetailsClass.id.desc()).first()
+    )
+    session.expunge(details)
+    session_close(session)
+
+    timestamps = [datetime(2020, 11, 13, 1), datetime(2020, 11, 17, 1)]
+    codes = [7, 1]
+
+    for timestamp_utc, code in zip(timestamps, codes):
+        session = session_open(ENGINE)
+        success, error = enqueue(
+            session,
+            CONST_NOTICE_EXPIRY,
+            details,
+            ("test@example.com", "Expiry", "<p>Expiry</p>"),
+            notice_code=code,
+            timestamp_utc=timestamp_utc,
+        )
+        session_close(session)
+        assert success, error
+
+        success, error, sent_counts = drain_outbox(
+            ENGINE, timestamp_utc=timestamp_utc
+        )
+        assert success, error
+        assert sent_counts == {CONST_NOTICE_EXPIRY: 1}
+
+    success, error, sent_noti = _find_sent_notifications(
+        ENGINE, timestamps[0]
+    )
+    assert success, error
+
+    sent_noti = [
+        noti for noti in sent_noti
+        if noti.sub_id == details.sub_id
+        and noti.expiry_notice_sent in timestamps
+    ]
+
+    assert [noti.expiry_notice_sent for noti in sent_noti] == timestamps
+    assert [noti.expiry_code for noti in sent_noti] == codes
+    assert all(noti.usage_notice_sent is None for noti in sent_noti)
+
+    # the shared details entry notes the latest notification
+    session = session_open(ENGINE)
+    latest_details = session.query(DetailsClass).get(details.id)
+    assert latest_details.expiry_code == codes[-1]
+    assert latest_details.expiry_notice_sent == timestamps[-1]
+    session_close(session)
@@ -2,9 +2,20 @@
 Test sender.py module
 """
 
+import time
+
 import pytest
+import sendgrid
+
+from edunotice import sender
+from edunotice.sender import (
+    send_email,
+    send_emails,
+    TokenBucket,
+    SendCounters,
+)
 
-from edunotice.sender import send_email
+from fake_sendgrid import FakeSendGrid
 
 from edunotice.constants import (
     SG_FROM_EMAIL,
@@ -29,3 +40,284 @@ def test_send_email1():
     # One recipient
     success, error = send_email(SG_FROM_EMAIL, subject, html_content)
     assert success, error
+
+
+@pytest.fixture
+def fake_sg(monkeypatch):
+    """
+    Routes sender.py through a local fake SendGrid server
+    """
+
+    with FakeSendGrid() as fake_sg:
+        monkeypatch.setattr(sender, "SG_EMAIL_DISABLE", False)
+        monkeypatch.setattr(sender, "SG_TEST_EMAIL", False)
+        monkeypatch.setattr(sender, "SG_FROM_EMAIL", "from@example.com")
+        monkeypatch.setattr(
+            sender,
+            "SG_CLIENT",
+            sendgrid.SendGridAPIClient(api_key="test", host=fake_sg.host),
+        )
+        monkeypatch.setattr(sender, "SG_BUCKET", TokenBucket(0))
+        monkeypatch.setattr(sender, "SEND_COUNTERS", SendCounters())
+        monkeypatch.setattr(sender, "SG_EMAIL_BACKOFF_BASE", 0.01)
+
+        yield fake_sg
+
+
+def test_send_emails(fake_sg):
+    """
+    Tests send_emails function.
+
+    """
+
+    messages = [
+        ("user%d@example.com" % (i), "Subject %d" % (i), "<p>%d</p>" % (i))
+        for i in range(20)
+    ]
+    # empty recipient list fails and is reported in its place
+    messages.insert(5, (None, "No recipients", "<p></p>"))
+
+    results = send_emails(messages, max_workers=4)
+
+    assert len(results) == len(messages)
+    assert [success for success, _ in results] == [
+        to_str is not None for to_str, _, _ in messages
+    ]
+    assert results[5] == (False, "Empty recipient list")
+
+    assert len(fake_sg.requests) == 20
+    assert sorted(
+        body["subject"] for path, body in fake_sg.requests
+    ) == sorted("Subject %d" % (i) for i in range(20))
+
+    # serial dispatch
+    results = send_emails(messages[:3], max_workers=1)
+    assert [success for success, _ in results] == [True, True, True]
+    assert len(fake_sg.requests) == 23
+
+    assert send_emails([]) == []
+
+
+def test_send_emails_batch(fake_sg, monkeypatch):
+    """
+    Tests send_emails function in the batch mode.
+
+    """
+
+    tag = "-sub_details-"
+    template = "<p>Expires in 7 day(s)</p>%s" % (tag)
+
+    messages = [
+        (
+            "user%d@example.com" % (i),
+            "Expires in 7 day(s)",
+            template,
+            {tag: "<p>Subscription %d</p>" % (i)},
+        )
+        for i in range(5)
+    ]
+    # a different template and a message without substitutions
+    messages.insert(2, ("other@example.com", "Other", "<p>%s</p>" % (tag),
+                        {tag: "other"}))
+    messages.insert(4, ("plain@example.com", "Plain", "<p>Plain</p>"))
+    # empty recipient list fails on its own
+    messages.append((None, "Expires in 7 day(s)", template, {tag: "x"}))
+
+    results = send_emails(messages, max_workers=4, batch=True)
+
+    assert len(results) == len(messages)
+    assert [success for success, _ in results] == [True] * 7 + [False]
+    assert results[-1] == (False, "Empty recipient list")
+
+    # 5 batched emails, the other and the plain one
+    assert len(fake_sg.requests) == 3
+
+    bodies = {body["subject"]: body for _, body in fake_sg.requests}
+
+    batched = bodies["Expires in 7 day(s)"]
+    assert batched["content"][0]["value"] == template
+    assert [
+        (p["to"][0]["email"], p["substitutions"][tag])
+        for p in batched["personalizations"]
+    ] == [
+        ("user%d@example.com" % (i), "<p>Subscription %d</p>" % (i))
+        for i in range(5)
+    ]
+
+    # single emails have their substitutions applied locally
+    assert bodies["Other"]["content"][0]["value"] == "<p>other</p>"
+    assert "substitutions" not in bodies["Other"]["personalizations"][0]
+
+    # batches are split at the recipient limit
+    fake_sg.requests.clear()
+    monkeypatch.setattr(sender, "SG_BATCH_MAX_RECIPIENTS", 2)
+
+    results = send_emails(messages[:2] + messages[3:4] + messages[5:7])
+
+    assert [success for success, _ in results] == [True] * 5
+    assert len(fake_sg.requests) == 3
+
+    # no batching
+    fake_sg.requests.clear()
+
+    results = send_emails(messages[:7], batch=False)
+
+    assert [success for success, _ in results] == [True] * 7
+    assert len(fake_sg.requests) == 7
+
+
+def test_send_emails_batch_rejected(fake_sg):
+    """
+    A batch rejected because of one recipient is sent email by email, so
+        only the email to that recipient fails.
+
+    """
+
+    tag = "-sub_details-"
+    template = "<p>Usage 50%%</p>%s" % (tag)
+
+    messages = [
+        (
+            "user%d@example.com" % (i),
+            "Usage 50%",
+            template,
+            {tag: "<p>Subscription %d</p>" % (i)},
+        )
+        for i in range(4)
+    ]
+    messages[2] = ("invalid@example.com",) + messages[2][1:]
+
+    fake_sg.reject("invalid@example.com", 400)
+
+    results = send_emails(messages, batch=True)
+
+    assert results == [(True, 202), (True, 202), (False, 400), (True, 202)]
+
+    # the batch and the single email to the invalid recipient
+    assert [status for status, _ in fake_sg.rejected] == [400, 400]
+
+    assert sorted(
+        body["personalizations"][0]["to"][0]["email"]
+        for _, body in fake_sg.requests
+    ) == ["user0@example.com", "user1@example.com", "user3@example.com"]
+    assert all(
+        body["content"][0]["value"] != template
+        for _, body in fake_sg.requests
+    )
+
+    assert sender.SEND_COUNTERS.snapshot() == {
+        "sent": 3,
+        "retried": 0,
+        "throttled": 0,
+        "failed": 1,
+    }
+
+
+def test_token_bucket():
+    """
+    Tests TokenBucket class.
+
+    """
+
+    # a burst of 2, then 20 requests per second
+    bucket = TokenBucket(20, 2)
+
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    elapsed = time.monotonic() - start
+
+    assert 0.18 <= elapsed < 1.0
+
+    # unlimited
+    bucket = TokenBucket(0)
+
+    start = time.monotonic()
+    for _ in range(100):
+        assert bucket.acquire() == 0.0
+    assert time.monotonic() - start < 0.1
+
+    # deferred
+    bucket.defer(0.2)
+    assert bucket.acquire() >= 0.15
+
+
+def test_send_email_retries(fake_sg, monkeypatch):
+    """
+    Tests throttled and failed requests are retried.
+
+    """
+
+    to_str = "user@example.com"
+
+    # throttled, then server errors
+    fake_sg.inject(429, {"Retry-After": "0"})
+    fake_sg.inject(500)
+    fake_sg.inject(503)
+
+    success, error = send_email(to_str, "Retried", "<p></p>")
+
+    assert success, error
+    assert len(fake_sg.requests) == 1
+    assert [status for status, _ in fake_sg.rejected] == [429, 500, 503]
+    assert sender.SEND_COUNTERS.snapshot() == {
+        "sent": 1,
+        "retried": 3,
+        "throttled": 1,
+        "failed": 0,
+    }
+
+    # Retry-After is respected
+    fake_sg.inject(429, {"Retry-After": "1"})
+
+    start = time.monotonic()
+    success, error = send_email(to_str, "Retry-After", "<p></p>")
+
+    assert success, error
+    assert time.monotonic() - start >= 0.9
+
+    # client errors are not retried
+    sender.SEND_COUNTERS.reset()
+    fake_sg.inject(400)
+
+    success, error = send_email(to_str, "Bad request", "<p></p>")
+
+    assert not success
+    assert error == 400
+    assert sender.SEND_COUNTERS.snapshot()["retried"] == 0
+    assert sender.SEND_COUNTERS.snapshot()["failed"] == 1
+
+    # gives up after the maximum number of retries, a batch counts all
+    #   its messages
+    sender.SEND_COUNTERS.reset()
+    monkeypatch.setattr(sender, "SG_EMAIL_MAX_RETRIES", 2)
+    fake_sg.inject(500, times=3)
+
+    tag = "-sub_details-"
+    messages = [
+        ("user%d@example.com" % (i), "Batch", "<p>%s</p>" % (tag), {tag: "x"})
+        for i in range(3)
+    ]
+
+    results = send_emails(messages, batch=True)
+
+    assert results == [(False, 500)] * 3
+    assert sender.SEND_COUNTERS.snapshot() == {
+        "sent": 0,
+        "retried": 6,
+        "throttled": 0,
+        "failed": 3,
+    }
+
+    # unreachable server
+    sender.SEND_COUNTERS.reset()
+    monkeypatch.setattr(
+        sender,
+        "SG_CLIENT",
+        sendgrid.SendGridAPIClient(api_key="test", host="http://127.0.0.1:9"),
+    )
+
+    success, error = send_email(to_str, "Unreachable", "<p></p>")
+
+    assert not success
+    assert sender.SEND_COUNTERS.snapshot()["retried"] == 2
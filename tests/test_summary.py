@@ -3,6 +3,7 @@ Test summary.py module
 """
 
 import os
+import re
 import pandas as pd
 
 from datetime import datetime, timezone
@@ -10,6 +11,9 @@ from datetime import datetime, timezone
 from sqlalchemy import create_engine
 
 from edunotice.constants import (
+    CONST_EMAIL_SUBJECT_EXPIRE,
+    CONST_EMAIL_SUBJECT_UPD,
+    CONST_EMAIL_SUBJECT_USAGE,
     CONST_TEST_DIR_DATA,
     CONST_TEST1_FILENAME,
     CONST_TEST2_FILENAME,
@@ -20,11 +24,13 @@ from edunotice.constants import (
 
 from edunotice.ingress import update_edu_data, get_latest_log_timestamp
 from edunotice.edunotice import _notify_subscriptions
+from edunotice.outbox import drain_outbox
 
 from edunotice.summary import (
     _find_new_subs,
     _find_upd_subs,
     _prep_summary_email,
+    _prep_summary_stream,
     _find_sent_notifications,
     summary_email,
 )
@@ -72,6 +78,12 @@ def test_summary_new():
         upd_sub_list,
         timestamp_utc=indv_email_sent_timestamp_utc,
     )
+    assert success, error
+
+    # the outbox function sends out the queued notices
+    success, error, _ = drain_outbox(
+        ENGINE, timestamp_utc=indv_email_sent_timestamp_utc
+    )
 
     assert success, error
     assert counts[0] == len(new_sub_list)
@@ -114,7 +126,7 @@ def test_summary_new():
     assert success, error
 
 
-def test_summary_upd():
+def test_summary_upd(query_budget):
     """
     Testing summary 1 new and 2 updates
 
@@ -159,36 +171,52 @@ def test_summary_upd():
         timestamp_utc=indv_email_sent_timestamp_utc,
     )
     assert success, error
+
+    # the outbox function sends out the queued notices
+    success, error, _ = drain_outbox(
+        ENGINE, timestamp_utc=indv_email_sent_timestamp_utc
+    )
+    assert success, error
     assert counts[0] == len(new_sub_list)
     assert counts[1] == len(upd_sub_list)
     assert counts[2] == 0
     assert counts[3] == 0
 
     # finding new subscriptions for the summary
-    success, error, new_subs = _find_new_subs(
-        ENGINE, prev_summary_timestamp_utc
-    )
+    with query_budget(ENGINE, "_find_new_subs", 1):
+        success, error, new_subs = _find_new_subs(
+            ENGINE, prev_summary_timestamp_utc
+        )
     assert success, error
     assert len(new_subs) == counts[0]
 
     # finding updated subscriptions for the summary
-    success, error, new_subs = _find_upd_subs(
-        ENGINE, prev_summary_timestamp_utc
-    )
+    with query_budget(ENGINE, "_find_upd_subs", 1):
+        success, error, new_subs = _find_upd_subs(
+            ENGINE, prev_summary_timestamp_utc
+        )
     assert success, error
     assert len(new_subs) == counts[1]
 
+    # every update is paired with the entry right before it
+    for prev_details, latest_details in new_subs:
+        assert prev_details.sub_id == latest_details.sub_id
+        assert prev_details.timestamp_utc < latest_details.timestamp_utc
+        assert latest_details.update_flag
+
     # finding notifications sent for the summary
-    success, error, sent_noti = _find_sent_notifications(
-        ENGINE, prev_summary_timestamp_utc
-    )
+    with query_budget(ENGINE, "_find_sent_notifications", 1):
+        success, error, sent_noti = _find_sent_notifications(
+            ENGINE, prev_summary_timestamp_utc
+        )
     assert success, error
     assert len(sent_noti) == counts[0] + counts[1]
 
     # preps a summary email
-    success, error, html_content = _prep_summary_email(
-        ENGINE, timestamp_utc=new_summary_timestamp_utc
-    )
+    with query_budget(ENGINE, "_prep_summary_email", 10):
+        success, error, html_content = _prep_summary_email(
+            ENGINE, timestamp_utc=new_summary_timestamp_utc
+        )
     assert success, error
     assert len(html_content) in (4075, 4071)
 
@@ -244,6 +272,12 @@ def test_summary_upd_2():
         timestamp_utc=indv_email_sent_timestamp_utc,
     )
     assert success, error
+
+    # the outbox function sends out the queued notices
+    success, error, _ = drain_outbox(
+        ENGINE, timestamp_utc=indv_email_sent_timestamp_utc
+    )
+    assert success, error
     assert counts[0] == 0
     assert counts[1] == 0
     assert counts[2] == 1
@@ -275,10 +309,47 @@ def test_summary_upd_2():
         ENGINE, timestamp_utc=new_summary_timestamp_utc
     )
     assert success, error
-    assert len(html_content) in (1889, 1885)
+
+    # only the notifications sent since the previous summary are listed,
+    #   the update notification sent before it is not (although it was
+    #   sent about the same details entry as the expiry notification)
+    sent_notices = re.findall(
+        r"<div>([^<]*): (\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \(",
+        html_content,
+    )
+
+    assert "Notifications sent (2):" in html_content
+    assert sent_notices == [
+        ("%s (50)" % CONST_EMAIL_SUBJECT_USAGE, "2020-10-22 10:10:00"),
+        ("%s (30)" % CONST_EMAIL_SUBJECT_EXPIRE, "2020-10-22 10:10:00"),
+    ]
+    assert CONST_EMAIL_SUBJECT_UPD not in html_content
 
     # preps and sends out summary email
     success, error = summary_email(
         ENGINE, timestamp_utc=new_summary_timestamp_utc
     )
     assert success, error
+
+
+def test_summary_stream():
+    """
+    Testing that the streamed summary matches the joined summary
+    """
+
+    summary_timestamp_utc = datetime(2020, 10, 22, 10, 30, tzinfo=timezone.utc)
+
+    success, error, html_content = _prep_summary_email(
+        ENGINE, timestamp_utc=summary_timestamp_utc
+    )
+    assert success, error
+
+    success, error, html_stream = _prep_summary_stream(
+        ENGINE, timestamp_utc=summary_timestamp_utc
+    )
+    assert success, error
+
+    html_chunks = list(html_stream)
+
+    assert len(html_chunks) > 1
+    assert "".join(html_chunks) == html_content
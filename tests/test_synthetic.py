@@ -0,0 +1,87 @@
+"""
+Test the synthetic EduHub crawl generator
+"""
+
+from datetime import timedelta
+
+from edunotice.ingress import _normalise_edu_data
+
+from edunotice.constants import (
+    CONST_PD_COL_HANDOUT_BUDGET,
+    CONST_PD_COL_HANDOUT_CONSUMED,
+    CONST_PD_COL_SUB_ID,
+    CONST_PD_COL_SUB_NAME,
+    CONST_PD_COL_SUB_STATUS,
+    CONST_PD_COL_SUB_EXPIRY_DATE,
+    CONST_PD_COL_CRAWL_TIME_UTC,
+    CONST_SUB_CANCELLED,
+)
+
+from synthetic import SyntheticEduHub, SYNTHETIC_COLUMNS
+
+
+def test_synthetic_crawls():
+    """
+    tests that the synthetic crawls follow the crawl schema and simulate
+        the subscriptions' life
+    """
+
+    eduhub = SyntheticEduHub(
+        num_subs=200,
+        days=30,
+        crawl_interval=timedelta(hours=12),
+        cancel_per_day=0.01,
+        rename_per_day=0.01,
+        expiry_change_per_day=0.02,
+        seed=1,
+    )
+
+    crawls = list(eduhub.crawls())
+
+    assert len(crawls) == 60
+    assert all(list(crawl_df.columns) == SYNTHETIC_COLUMNS
+               for crawl_df in crawls)
+
+    # new subscriptions appear over time
+    assert len(crawls[0]) < len(crawls[-1]) == 200
+
+    # deterministic for a seed
+    history_df = eduhub.history()
+
+    assert history_df.equals(
+        SyntheticEduHub(
+            num_subs=200,
+            days=30,
+            crawl_interval=timedelta(hours=12),
+            cancel_per_day=0.01,
+            rename_per_day=0.01,
+            expiry_change_per_day=0.02,
+            seed=1,
+        ).history()
+    )
+    assert len(history_df) == sum(len(crawl_df) for crawl_df in crawls)
+
+    success, error, norm_df = _normalise_edu_data(history_df)
+    assert success, error
+
+    assert norm_df[CONST_PD_COL_SUB_EXPIRY_DATE].notna().all()
+
+    by_sub = norm_df.sort_values(CONST_PD_COL_CRAWL_TIME_UTC).groupby(
+        CONST_PD_COL_SUB_ID
+    )
+
+    # budgets are burnt
+    assert by_sub[CONST_PD_COL_HANDOUT_CONSUMED].apply(
+        lambda col: col.is_monotonic_increasing
+    ).all()
+    assert (
+        norm_df[CONST_PD_COL_HANDOUT_CONSUMED]
+        <= 1.05 * norm_df[CONST_PD_COL_HANDOUT_BUDGET]
+    ).all()
+
+    # subscriptions are cancelled, renamed and their expiry dates change
+    last_df = by_sub.last()
+
+    assert (last_df[CONST_PD_COL_SUB_STATUS] == CONST_SUB_CANCELLED).any()
+    assert (by_sub[CONST_PD_COL_SUB_NAME].nunique() > 1).any()
+    assert (by_sub[CONST_PD_COL_SUB_EXPIRY_DATE].nunique() > 1).any()
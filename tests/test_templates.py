@@ -0,0 +1,50 @@
+"""
+Test templates.py module
+"""
+
+from edunotice.templates import HtmlTemplate
+
+
+def test_html_template():
+    """
+    tests compiling and rendering of templates
+    """
+
+    template = HtmlTemplate(
+        "<div>{title}</div>{footer}<i>{value}</i>",
+        footer="<br>",
+    )
+
+    # static fields are rendered at compile time
+    assert template.fields == ["title", "value"]
+
+    assert (
+        template.render(title="Budget", value="$1.00")
+        == "<div>Budget</div><br><i>$1.00</i>"
+    )
+
+    # values are converted to strings
+    assert template.render(title="Code", value=50) == (
+        "<div>Code</div><br><i>50</i>"
+    )
+
+    # escaped braces are kept as literals
+    assert HtmlTemplate("{{x}}{y}").render(y=1) == "{x}1"
+
+
+def test_html_template_stream():
+    """
+    tests streaming of templates
+    """
+
+    template = HtmlTemplate("<ul>{items}</ul>{count}")
+
+    chunks = list(
+        template.stream(items=(x for x in ["<li>1</li>", "<li>2</li>"]),
+                        count=2)
+    )
+
+    assert chunks == ["<ul>", "<li>1</li>", "<li>2</li>", "</ul>", "2"]
+    assert "".join(chunks) == template.render(
+        items="<li>1</li><li>2</li>", count=2
+    )
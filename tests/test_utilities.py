@@ -0,0 +1,36 @@
+"""
+Test utilities.py module
+"""
+
+import pytest
+
+from edunotice.utilities import IdIndex
+
+
+def test_id_index():
+    """
+    tests IdIndex lookups by internal id
+    """
+
+    sub_dict = IdIndex({"sub-1": 1, "sub-2": 2})
+
+    assert sub_dict.name_of(1) == "sub-1"
+    assert sub_dict.name_of(2) == "sub-2"
+
+    # the inverted index follows modifications
+    sub_dict.update({"sub-3": 3})
+    assert sub_dict.name_of(3) == "sub-3"
+
+    sub_dict["sub-4"] = 4
+    assert sub_dict.name_of(4) == "sub-4"
+
+    del sub_dict["sub-1"]
+    with pytest.raises(KeyError):
+        sub_dict.name_of(1)
+
+    # wrapping
+    assert IdIndex.of(sub_dict) is sub_dict
+
+    lab_dict = IdIndex.of({("Course", "Lab"): 7})
+    assert isinstance(lab_dict, IdIndex)
+    assert lab_dict.name_of(7) == ("Course", "Lab")
@@ -118,6 +118,11 @@ else
     echo "EduNotice BUILD INFO: PostgreSQL DB $ENS_SQL_SERVER already exists. Skipping."
 fi
 
+# Migrating database (creates the missing tables and indexes)
+python -c 'import sys; from edunotice import db; success, error = db.migrate_db(); sys.exit(0 if success else error);' || exit 0
+
+echo "EduNotice BUILD INFO: PostgreSQL DB $ENS_SQL_SERVER database migrated."
+
 ###################################################################################
 # Resource group
 ###################################################################################